@@ -7,6 +7,8 @@ from dash.dependencies import Input, Output, State
 import plotly.express as px
 import pywanda
 from dash.exceptions import PreventUpdate
+from wandatoolbox.util import get_series_array
+from wandatoolbox.case_index import CaseIndex, build_case_index
 
 
 app = dash.Dash(__name__)
@@ -15,9 +17,20 @@ app.config.suppress_callback_exceptions = True
 wanda_bin = r'd:\repos\wandaboom\Wanda4\Trunk\Bin64\Release\\'
 if 'wanda_model' not in globals():
     wanda_model = None
+    wanda_case_file = None
+    case_index = None
 
 
 
+def get_model():
+    # the model is only opened when the index cannot answer the request
+    global wanda_model
+    if wanda_model is None:
+        wanda_model = pywanda.WandaModel(wanda_case_file, wanda_bin)
+        wanda_model.reload_output()
+    return wanda_model
+
+
 def get_options(input_list):
     dict_list = []
     for i in range(len(input_list)):
@@ -59,27 +72,34 @@ def load_wanda_case(n_clicks, wanda_case):
     if wanda_case is None:
         raise PreventUpdate
     print(wanda_case)
-    global wanda_model
-    wanda_model = pywanda.WandaModel(wanda_case, wanda_bin)
-    wanda_model.reload_output()
-    options = get_options(wanda_model.get_all_components_str())
+    global wanda_model, wanda_case_file, case_index
+    if wanda_model is not None:
+        wanda_model.close()
+    wanda_model = None
+    wanda_case_file = wanda_case
+    # the index is built the first time a case is loaded, after that the case is browsed without opening the model
+    case_index = CaseIndex.load(wanda_case)
+    if case_index is None:
+        try:
+            case_index = build_case_index(get_model(), wanda_case)
+        except Exception as inst:
+            # the case is browsed through the model
+            print("Error in building the index of " + wanda_case)
+            print(inst)
+            return get_options(get_model().get_all_components_str())
+    options = get_options(case_index.get_item_names("component"))
     return options
 
 
 @app.callback(Output('wanda_property', 'options'),
               [Input('wanda_component', 'value')])
 def get_properties(selected_item):
-    global wanda_model
-    if wanda_model is None:
+    if wanda_case_file is None or selected_item is None:
         raise PreventUpdate
-    comp = wanda_model.get_component(selected_item)
-    props = comp.get_all_properties()
-    prop_list = []
-    for prop in props:
-        if prop.is_input():
-            continue
-        prop_list.append(prop.get_description())
-    return get_options(prop_list)
+    if case_index is not None:
+        return get_options(case_index.get_property_names(selected_item, output_only=True))
+    props = get_model().get_component(selected_item).get_all_properties()
+    return get_options([prop.get_description() for prop in props if not prop.is_input()])
 
 
 @app.callback(Output('timeseries', 'figure'),
@@ -88,13 +108,23 @@ def get_properties(selected_item):
 def update_graph(prop, comp):
     if prop is None or comp is None:
         raise PreventUpdate
-    wanda_property = wanda_model.get_component(comp).get_property(prop)
-
-    series = [x * wanda_property.get_unit_factor() for x in wanda_property.get_series()]
-    dim = wanda_model.get_current_dim(wanda_property.get_unit_dim())
+    if case_index is not None and case_index.has_output(comp, prop):
+        series = case_index.read_series(comp, prop)
+        time_steps = case_index.get_time_steps()
+    else:
+        model = get_model()
+        series = get_series_array(model.get_component(comp).get_property(prop))
+        time_steps = model.get_time_steps()
+    if case_index is not None:
+        dim = case_index.get_property(comp, prop)['unit']
+        time_unit = case_index.data['time_unit']
+    else:
+        wanda_property = get_model().get_component(comp).get_property(prop)
+        dim = get_model().get_current_dim(wanda_property.get_unit_dim())
+        time_unit = get_model().get_current_dim('time')
     series_name = prop + ' (' + dim + ')'
-    time = 'Time' + ' (' + wanda_model.get_current_dim('time') + ')'
-    data_dict = {time: wanda_model.get_time_steps(),
+    time = 'Time' + ' (' + time_unit + ')'
+    data_dict = {time: time_steps,
                  series_name: series
                  }
     df = pd.DataFrame(data_dict, columns=[time, series_name])
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from wandatoolbox.case_index import CaseIndex, build_case_index, get_case_index, get_index_file
+from wandatoolbox.wanda_plot import PlotTimeseries
+from nefis_test import write_output_file
+
+
+def create_model(mocker):
+    model = mocker.MagicMock()
+    model.get_all_components_str.return_value = ['PIPE P1', 'BOUNDH R1']
+    model.get_all_nodes_str.return_value = ['PIPE P1']
+    model.get_all_signal_lines_str.return_value = []
+    model.get_current_dim.side_effect = lambda unit_dim: {'L': 'm', 'time': 's'}[unit_dim]
+
+    def create_property(description, is_input):
+        prop = mocker.MagicMock()
+        prop.get_description.return_value = description
+        prop.get_unit_dim.return_value = 'L'
+        prop.get_unit_factor.return_value = 2.0
+        prop.is_input.return_value = is_input
+        return prop
+
+    components = {}
+    for name, keywords in [('PIPE P1', ['pipes']), ('BOUNDH R1', [])]:
+        component = mocker.MagicMock()
+        component.get_keywords.return_value = keywords
+        component.get_all_properties.return_value = [create_property('Head', False), create_property('Length', True)]
+        components[name] = component
+    model.get_component.side_effect = components.get
+    # a node with the name of a component
+    node = mocker.MagicMock()
+    node.get_keywords.return_value = ['nodes']
+    node.get_all_properties.return_value = [create_property('Pressure', False)]
+    model.get_node.return_value = node
+    return model
+
+
+def test_case_index(mocker, tmp_path):
+    case_file = str(tmp_path / 'case.wdi')
+    open(case_file, 'w').close()
+    times, heads = write_output_file(str(tmp_path / 'case.wdo'))
+    model = create_model(mocker)
+
+    build_case_index(model, case_file)
+    assert os.path.exists(get_index_file(case_file))
+    # the series are only read from the output file when asked for
+    assert not CaseIndex.load(case_file).has_output('PIPE P1', 'Head')
+    case_index = CaseIndex.load(case_file, read_output=True)
+    assert case_index.has_output('PIPE P1', 'Head')
+    assert case_index.get_item_names() == ['PIPE P1', 'BOUNDH R1', 'PIPE P1']
+    assert case_index.get_item_names('component') == ['PIPE P1', 'BOUNDH R1']
+    # keywords and names are resolved without the model
+    assert case_index.get_items('pipes') == [('component', 'PIPE P1')]
+    assert case_index.get_items('BOUNDH R1') == [('component', 'BOUNDH R1')]
+    # the node does not replace the component with the same name
+    assert case_index.get_items('PIPE P1') == [('component', 'PIPE P1'), ('node', 'PIPE P1')]
+    assert case_index.get_property_names('PIPE P1', output_only=True) == ['Head']
+    assert case_index.get_property_names('PIPE P1', kind='node') == ['Pressure']
+    assert not case_index.has_output('PIPE P1', 'Pressure')
+    assert case_index.get_property('PIPE P1', 'Head')['n_locations'] == 3
+    np.testing.assert_allclose(case_index.get_time_steps(), times)
+    np.testing.assert_allclose(case_index.read_series_pipe('PIPE P1', 'Head'), 2.0 * heads.T[:3])
+
+    # the plots read indexed series from the output file, without a model
+    plot_time = PlotTimeseries([('BOUNDH R1', 'Head', 'R1')], 'Title', case_index=case_index)
+    plot_time.extract(None)
+    x, series = plot_time.series_data
+    np.testing.assert_allclose(series[0][0], 2.0 * heads[:, 3])
+
+    # a new output file is not read with the offsets of the old one
+    os.utime(str(tmp_path / 'case.wdo'), ns=(0, 0))
+    assert not case_index.has_output('PIPE P1', 'Head')
+
+
+def test_get_case_index_after_build(mocker, tmp_path):
+    case_file = str(tmp_path / 'case.wdi')
+    open(case_file, 'w').close()
+    # a case without an index does not stay without an index once the index has been built
+    assert get_case_index(case_file) is None
+    build_case_index(create_model(mocker), case_file)
+    case_index = get_case_index(case_file)
+    assert case_index is not None
+    assert get_case_index(case_file) is case_index
+
+
+def test_case_index_unreadable_output(mocker, tmp_path):
+    case_file = str(tmp_path / 'case.wdi')
+    open(case_file, 'w').close()
+    with open(str(tmp_path / 'case.wdo'), 'wb') as f:
+        f.write(b'not a NEFIS file')
+    # the lookups are indexed, the series are read with pywanda
+    case_index = build_case_index(create_model(mocker), case_file, read_output=True)
+    assert case_index.get_items('pipes') == [('component', 'PIPE P1')]
+    assert not case_index.has_output('PIPE P1', 'Head')
@@ -0,0 +1,90 @@
+import numpy as np
+from wandatoolbox.analysis.monte_carlo import MonteCarloInputProperty, MonteCarloOutputProperty, WandaMonteCarlo, worker, \
+    worker_state, open_worker_model, get_running_statistics
+from wandatoolbox.analysis.sampling import normal_cdf
+
+
+def create_model(mocker, extr_min):
+    model = mocker.MagicMock()
+    prop = mocker.MagicMock()
+    prop.get_number_of_elements.return_value = 1
+    prop.get_extr_min.return_value = extr_min
+    prop.get_unit_factor.return_value = 1.0
+    model.get_component.return_value.get_property.return_value = prop
+    return model, prop
+
+
+def test_worker_retry_with_reopened_model(mocker):
+    first, first_prop = create_model(mocker, 1.0)
+    second, second_prop = create_model(mocker, 2.0)
+    first.run_steady.side_effect = RuntimeError("license lost")
+    mocker.patch('wandatoolbox.analysis.monte_carlo.pw.WandaModel', side_effect=[first, second], create=True)
+    inp = MonteCarloInputProperty('PIPE P1', 'Wall roughness', 0.1, 0.2, 'uniform')
+    outp = MonteCarloOutputProperty('PIPE P1', 'Pressure', extreme='MIN')
+    worker_state.clear()
+    worker_state.update(worker_id=0, case='case.wdi', wandabin='bin', parameters=[inp], outputs=[outp], retries=1)
+    try:
+        open_worker_model()
+        run_id, results, error, attempts = worker((7, [0.15]))
+    finally:
+        worker_state["finalizer"]()
+        worker_state.clear()
+
+    assert (run_id, results, error, attempts) == (7, [2.0], None, 2)
+    first.close.assert_called_once()
+    # the retry uses the properties of the reopened model only
+    assert inp.wanda_prop == [second_prop] and outp.wanda_prop == [second_prop]
+    second_prop.set_scalar.assert_called_once_with(0.15)
+    first_prop.set_scalar.assert_called_once_with(0.15)
+
+
+def test_running_statistics_large_mean():
+    data = 1e9 + np.random.default_rng(1).normal(0.0, 1e-3, 1000)
+    running_mean, running_std = get_running_statistics(data)
+    np.testing.assert_allclose(running_mean[-1], np.mean(data))
+    np.testing.assert_allclose(running_std[[1, 99, -1]], [np.std(data[:2]), np.std(data[:100]), np.std(data)],
+                               rtol=1e-3)
+    assert running_std[0] == 0.0
+
+
+def test_input_ppf():
+    normal = MonteCarloInputProperty('PIPE P1', 'Wall roughness', 2.0, 0.5, 'normal')
+    np.testing.assert_allclose(normal.ppf([0.5, normal_cdf(1.0), normal_cdf(-2.0)]), [2.0, 2.5, 1.0])
+    uniform = MonteCarloInputProperty('PIPE P1', 'Wall roughness', 2.0, 4.0, 'uniform')
+    np.testing.assert_allclose(uniform.ppf([0.0, 0.25, 1.0]), [2.0, 2.5, 4.0])
+    # the other types are integers from min_val up to and including max_val, with equal probabilities
+    integer = MonteCarloInputProperty('PUMP P1', 'Number of pumps', 1, 3)
+    np.testing.assert_array_equal(integer.ppf([0.0, 0.33, 0.34, 0.66, 0.67, 0.999, 1.0]), [1, 1, 2, 2, 3, 3, 3])
+    counts = np.bincount(integer.ppf(np.linspace(0.0, 1.0, 3000, endpoint=False)).astype(int))
+    np.testing.assert_array_equal(counts, [0, 1000, 1000, 1000])
+
+
+def test_input_update_draws_value(mocker):
+    model, prop = create_model(mocker, 0.0)
+    inp = MonteCarloInputProperty('PIPE P1', 'Wall roughness', 0.1, 0.2, 'uniform')
+    # without a value, a value of the distribution is drawn like before the designs were added
+    inp.update(model)
+    value = prop.set_scalar.call_args[0][0]
+    assert 0.1 <= value <= 0.2
+    inp.update(model, 0.15)
+    prop.set_scalar.assert_called_with(0.15)
+
+
+def test_pool_restarts_on_changed_outputs(mocker, tmp_path):
+    pool = mocker.patch('wandatoolbox.analysis.monte_carlo.mp.Pool')
+    mocker.patch('wandatoolbox.analysis.monte_carlo.prepare_worker_directory')
+    wanda_model = mocker.MagicMock()
+    wanda_model.get_case_path.return_value = str(tmp_path / 'case.wdi')
+    inputs = [MonteCarloInputProperty('PIPE P1', 'Wall roughness', 0.1, 0.2, 'uniform')]
+    outputs = [MonteCarloOutputProperty('PIPE P1', 'Pressure', extreme='MIN')]
+    monte_carlo = WandaMonteCarlo(wanda_model, inputs, outputs, n_workers=2, work_directory=str(tmp_path))
+
+    monte_carlo.start_pool()
+    monte_carlo.start_pool()
+    # the warm pool is reused as long as the workers have the current inputs and outputs
+    assert pool.call_count == 1
+    outputs.append(MonteCarloOutputProperty('PIPE P1', 'Pressure', extreme='MAX'))
+    monte_carlo.start_pool()
+    assert pool.call_count == 2
+    pool.return_value.close.assert_called_once()
+    assert pool.call_args[1]['initargs'][4] is outputs
@@ -0,0 +1,159 @@
+import os
+import shutil
+import struct
+import numpy as np
+import pytest
+from wandatoolbox.nefis import NefisFile, WandaOutputFile, QUANTITIES
+from wandatoolbox.util import get_series_array, get_series_pipe_array
+
+WANDA_BIN = r'c:\Program Files (x86)\Deltares\Wanda 4.6\Bin\\'
+
+
+def text(value, length):
+    return value.encode('latin-1').ljust(length)
+
+
+class NefisWriter:
+    """Writes a minimal NEFIS file with the layout of the Wanda output files, all records are chained in the first
+    bucket of their hash table."""
+
+    def __init__(self):
+        self.data = bytearray(text('Deltares, NEFIS Definition and Data File', 127) + b'L' + bytes(8))
+        self.data += struct.pack('<q', -1) * (4 * 997)
+        self.last = [128 + 8 + table * 997 * 8 for table in range(4)]
+
+    def add_record(self, table, code, name, body):
+        offset = len(self.data)
+        struct.pack_into('<q', self.data, self.last[table], offset)
+        self.last[table] = offset
+        self.data += struct.pack('<qq', -1, 24 + len(body)) + text(str(code).rjust(8), 8) + text(name, 16) + body
+        return offset
+
+    def add_element(self, name, element_type, single_bytes, dims=(1,)):
+        body = text(element_type, 8) + struct.pack('<qi', single_bytes * int(np.prod(dims)), single_bytes)
+        body += text('', 16) + text('', 16) + text(name.lower(), 64)
+        body += struct.pack('<i5i', len(dims), *(tuple(dims) + (1,) * (5 - len(dims))))
+        self.add_record(0, 1, name, body)
+
+    def add_group(self, name, elements, dims, cells=None, order=(1, 2, 3, 4, 5)):
+        """Adds the cell, the group definition and the data group. The cells are given as bytes, for a variable
+        group as a list of blocks, one per variable index."""
+        self.add_record(1, 2, name, struct.pack('<qi', 0, len(elements)) + b''.join(text(e, 16) for e in elements))
+        self.add_record(2, 3, name, text(name, 16) + struct.pack('<i5i5i', len(dims),
+                                                                 *(tuple(dims) + (1,) * (5 - len(dims))), *order))
+        if 0 not in dims:
+            self.add_record(3, 4, name, text(name, 16) + text('', 360) + cells)
+            return
+        offset = self.add_record(3, 5, name, text(name, 16) + text('', 360) + struct.pack('<q', 0) +
+                                 struct.pack('<q', -1) * 256)
+        tables = [offset + 424]
+        for level in range(3):
+            struct.pack_into('<q', self.data, tables[-1], len(self.data))
+            tables.append(len(self.data))
+            self.data += struct.pack('<q', -1) * 256
+        for index, block in enumerate(cells, start=1):
+            struct.pack_into('<q', self.data, tables[-1] + index * 8, len(self.data))
+            self.data += block
+
+    def write(self, file_name):
+        struct.pack_into('<q', self.data, 128, len(self.data))
+        with open(file_name, 'wb') as f:
+            f.write(self.data)
+
+
+def test_read_example_output():
+    with NefisFile(r'Examples/example_data/Sewage_transient.wdo') as nefis:
+        assert len(nefis.groups) == 29
+        assert nefis.get_strings('WANDA', 'Wanda_version')[0] == '4.60'
+        assert nefis.get_element_definition('Abs_position').description == 'Absolute position X,Y'
+        np.testing.assert_allclose(nefis.get_element('CALC_CONTR_DATA', 'Gravitat_accel')[0], [9.0, 10.0, 9.81, 9.81])
+        # a variable group with a single cell
+        assert nefis.groups['INIT_VALUES'].variable
+        assert nefis.get_strings('INIT_VALUES', 'Key_lloss_txt1')[0] == 'Unrefrnc'
+        # the example has not been computed, there are no output time steps
+        assert nefis.get_element('OUTPUT_TIME', 'Value').shape == (0,)
+
+
+def write_output_file(file_name):
+    """Writes an output file with the head of a pipe P1 (3 locations) and a boundary R1, returns the time steps and
+    the heads, with one row per time step."""
+    writer = NefisWriter()
+    for name, element_type, single_bytes in [('Value', 'REAL', 4), ('H_comp_key', 'CHARACTE', 8),
+                                             ('Name', 'CHARACTE', 128), ('Name_prefix', 'CHARACTE', 8),
+                                             ('Ndx_head', 'INTEGER', 4), ('Nof_head', 'INTEGER', 4)]:
+        writer.add_element(name, element_type, single_bytes)
+    times = np.array([0.0, 0.5, 1.0], dtype='<f4')
+    heads = np.arange(12, dtype='<f4').reshape(3, 4)  # 3 time steps of 4 output locations
+    writer.add_group('OUTPUT_TIME', ['Value'], (0,), [t.tobytes() for t in times])
+    writer.add_group('OUTP_HEAD', ['Value'], (4, 0), [h.tobytes() for h in heads])
+    writer.add_group('H_COMPONENTS', ['H_comp_key', 'Name', 'Name_prefix'], (2,),
+                     text('K1', 8) + text('P1', 128) + text('PIPE', 8) + text('K2', 8) + text('R1', 128) +
+                     text('BOUNDH', 8))
+    writer.add_group('H_COMP_INDEX', ['H_comp_key', 'Ndx_head', 'Nof_head'], (2,),
+                     text('K2', 8) + struct.pack('<ii', 4, 1) + text('K1', 8) + struct.pack('<ii', 1, 3))
+    writer.write(file_name)
+    return times, heads
+
+
+def test_read_series(tmp_path):
+    times, heads = write_output_file(str(tmp_path / 'case.wdo'))
+
+    with WandaOutputFile(str(tmp_path / 'case.wdo')) as output:
+        np.testing.assert_allclose(output.get_time_steps(), times)
+        assert set(output.get_component_names()) == {'P1', 'PIPE P1', 'R1', 'BOUNDH R1'}
+        pipe = output.get_series_pipe('PIPE P1', 'Head')
+        np.testing.assert_allclose(pipe, heads.T[:3])
+        # the series are views on the memory-mapped file
+        assert not pipe.flags.owndata
+        np.testing.assert_allclose(output.get_series('R1', 'head'), heads[:, 3])
+        # properties without a known quantity are not guessed
+        with pytest.raises(KeyError):
+            output.get_series('R1', 'Head 1')
+
+
+def test_dimension_order(tmp_path):
+    writer = NefisWriter()
+    writer.add_element('Value', 'REAL', 4)
+    writer.add_group('NATURAL', ['Value'], (2, 3), np.arange(6, dtype='<f4').tobytes())
+    writer.add_group('TRANSPOSED', ['Value'], (2, 3), np.arange(6, dtype='<f4').tobytes(), order=(2, 1, 3, 4, 5))
+    writer.write(str(tmp_path / 'order.wdo'))
+
+    # a group in another order does not prevent reading the other groups
+    with NefisFile(str(tmp_path / 'order.wdo')) as nefis:
+        np.testing.assert_allclose(nefis.get_element('NATURAL', 'Value'), np.arange(6.0).reshape(2, 3, order='F'))
+        assert nefis.groups['TRANSPOSED'].order == (2, 1)
+        with pytest.raises(NotImplementedError):
+            nefis.get_element('TRANSPOSED', 'Value')
+
+
+@pytest.mark.skipif(not os.path.isdir(WANDA_BIN), reason="needs an installed Wanda to compute the example case")
+def test_series_match_pywanda(tmp_path):
+    """Computes the example case and compares every series of the output file with the series of pywanda."""
+    pywanda = pytest.importorskip("pywanda")
+    for extension in ('.wdi', '.wdx'):
+        shutil.copy(f'Examples/example_data/Sewage_transient{extension}', str(tmp_path / f'case{extension}'))
+    model = pywanda.WandaModel(str(tmp_path / 'case.wdi'), WANDA_BIN)
+    try:
+        model.run_steady()
+        model.run_unsteady()
+        model.reload_output()
+        items = [(name, model.get_component(name)) for name in model.get_all_components_str()]
+        items += [(name, model.get_node(name)) for name in model.get_all_nodes_str()]
+        with WandaOutputFile(str(tmp_path / 'case.wdo')) as output:
+            np.testing.assert_allclose(output.get_time_steps(), model.get_time_steps(), rtol=1e-6)
+            n_compared = 0
+            for name, item in items:
+                is_pipe = hasattr(item, 'is_pipe') and item.is_pipe()
+                for prop in item.get_all_properties():
+                    description = prop.get_description()
+                    if prop.is_input() or description not in QUANTITIES:
+                        continue
+                    # the output file holds the series in SI units, without the unit factor of the model
+                    expected = (get_series_pipe_array(prop, apply_unit_factor=False) if is_pipe else
+                                get_series_array(prop, apply_unit_factor=False)[None, :])
+                    np.testing.assert_allclose(output.get_series_pipe(name, description), expected, rtol=1e-5,
+                                               atol=1e-6, err_msg=f"{description} of {name}")
+                    n_compared += 1
+            assert n_compared > 0
+    finally:
+        model.close()
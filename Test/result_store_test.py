@@ -0,0 +1,39 @@
+import pytest
+import numpy as np
+from wandatoolbox.result_store import SeriesStore, ResultWriter
+
+
+def test_series_store_roundtrip(tmp_path):
+    store = SeriesStore(str(tmp_path / 'series'))
+    time_steps = np.linspace(0, 10, 11)
+    store.write('case_1', time_steps, {'PIPE P1|Pressure': np.ones(11)})
+    store.write('case_2', time_steps, {'PIPE P1|Pressure': np.full(11, 2.0)})
+
+    assert store.contains('case_1')
+    assert not store.contains('case_3')
+    frame = store.read('case_2', columns=['PIPE P1|Pressure'])
+    np.testing.assert_allclose(frame['PIPE P1|Pressure'], 2.0)
+    all_frame = store.read_all()
+    assert len(all_frame) == 22
+    assert set(all_frame['scenario'].astype(str)) == {'case_1', 'case_2'}
+
+
+def test_result_writer_orders_by_case_number(tmp_path):
+    writer = ResultWriter(str(tmp_path / 'results.csv'),
+                          [('Scenario', 'Name', ' '), ('PIPE P1', 'Pressure', 'Max')])
+    writer.start()
+    writer.append(3, ['case_3', 1.5])
+    writer.append(1, ['case_1', 2.5])
+
+    frame = writer.read()
+    assert list(frame.index) == [1, 3]
+    assert list(frame[('Scenario', 'Name', ' ')]) == ['case_1', 'case_3']
+    np.testing.assert_allclose(frame[('PIPE P1', 'Pressure', 'Max')], [2.5, 1.5])
+
+
+def test_series_store_rejects_partition_separators(tmp_path):
+    store = SeriesStore(str(tmp_path / 'series'))
+    for name in ['case/1', 'case\\1', 'case=1']:
+        with pytest.raises(ValueError):
+            store.write(name, np.zeros(2), {'PIPE P1|Pressure': np.zeros(2)})
+    assert not store.contains('case 1')
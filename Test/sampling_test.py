@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from wandatoolbox.analysis.sampling import create_design, latin_hypercube, halton, correlate
+
+
+class UnitParameter:
+    def ppf(self, u):
+        return u
+
+
+def test_latin_hypercube_strata():
+    design = latin_hypercube(20, 3, np.random.default_rng(1))
+    for dim in range(3):
+        assert sorted(np.floor(design[:, dim] * 20).astype(int)) == list(range(20))
+
+
+def test_halton_is_low_discrepancy():
+    design = halton(64, 2, np.random.default_rng(1))
+    assert design.shape == (64, 2)
+    assert np.all((design >= 0) & (design < 1))
+    # every quarter of the unit interval gets exactly a quarter of the samples
+    counts = np.bincount(np.floor(design[:, 0] * 4).astype(int), minlength=4)
+    assert np.all(np.abs(counts - 16) <= 1)
+
+
+def test_correlate():
+    design = latin_hypercube(2000, 2, np.random.default_rng(2))
+    correlated = correlate(design, [[1.0, 0.8], [0.8, 1.0]])
+    assert np.corrcoef(correlated.T)[0, 1] == pytest.approx(0.8, abs=0.05)
+
+
+def test_create_design_is_reproducible():
+    parameters = [UnitParameter(), UnitParameter()]
+    design_1 = create_design(parameters, 10, "lhs", seed=42)
+    design_2 = create_design(parameters, 10, "lhs", seed=42)
+    np.testing.assert_array_equal(design_1, design_2)
+    with pytest.raises(ValueError):
+        create_design(parameters, 10, "unknown")
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from wandatoolbox.analysis.surrogate import PolynomialSurrogate, GaussianProcessSurrogate, create_surrogate, \
+    validation_errors, exceedance_probability
+
+
+def test_polynomial_surrogate():
+    rng = np.random.default_rng(1)
+    x = rng.random((30, 2)) * [10.0, 2.0]
+    y = 1.0 + 2.0 * x[:, 0] - x[:, 1] ** 2 + 0.5 * x[:, 0] * x[:, 1]
+    surrogate = PolynomialSurrogate(degree=2).fit(x, y)
+    x_new = rng.random((10, 2)) * [10.0, 2.0]
+    np.testing.assert_allclose(surrogate.predict(x_new),
+                               1.0 + 2.0 * x_new[:, 0] - x_new[:, 1] ** 2 + 0.5 * x_new[:, 0] * x_new[:, 1])
+    with pytest.raises(ValueError):
+        PolynomialSurrogate(degree=3).fit(x[:5], y[:5])
+
+
+def test_gaussian_process_surrogate():
+    rng = np.random.default_rng(2)
+    x = rng.random((40, 2))
+    y = np.sin(3.0 * x[:, 0]) + x[:, 1]
+    surrogate = create_surrogate("gp").fit(x, y)
+    mean, std = surrogate.predict(x[:5], return_std=True)
+    np.testing.assert_allclose(mean, y[:5], atol=1e-3)
+    assert np.all(std < 1e-2)
+    x_new = rng.random((200, 2))
+    errors = validation_errors(np.sin(3.0 * x_new[:, 0]) + x_new[:, 1], surrogate.predict(x_new))
+    assert errors["RMSE"] < 0.05
+    assert errors["R2"] > 0.99
+
+
+def test_exceedance_probability():
+    values = np.arange(100)
+    assert exceedance_probability(values, 89.5) == 0.1
+    assert exceedance_probability(values, 10, below=True) == 0.1
+
+
+def test_gaussian_process_chunks_and_uncertainty():
+    rng = np.random.default_rng(3)
+    x = rng.random((30, 1))
+    y = np.cos(4.0 * x[:, 0])
+    surrogate = GaussianProcessSurrogate(chunk_size=7).fit(x, y)
+    assert surrogate.length_scale in surrogate.length_scales
+    x_new = np.linspace(-1.0, 2.0, 50)[:, None]
+    # predicting per chunk gives the same result as predicting at once
+    mean, std = surrogate.predict(x_new, return_std=True)
+    mean_all, std_all = GaussianProcessSurrogate(chunk_size=1000).fit(x, y).predict(x_new, return_std=True)
+    np.testing.assert_allclose(mean, mean_all)
+    np.testing.assert_allclose(std, std_all)
+    # the uncertainty grows away from the training points
+    inside = (x_new[:, 0] > 0.1) & (x_new[:, 0] < 0.9)
+    assert std[inside].max() < std[0] and std[inside].max() < std[-1]
+    # a constant output does not break the standardization
+    np.testing.assert_allclose(GaussianProcessSurrogate().fit(x, np.full(30, 2.0)).predict(x_new), 2.0)
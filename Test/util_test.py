@@ -0,0 +1,91 @@
+import os
+import numpy as np
+from wandatoolbox.util import RouteGeometry, RouteGeometryCache, decimate, get_series_array, prepare_worker_directory, \
+    refine_points
+
+
+def test_refine_points_curvature():
+    evaluations = []
+
+    def evaluate(points):
+        evaluations.append(points)
+        return [np.tanh(20.0 * (p - 0.7)) for p in points]
+
+    x, y = refine_points(evaluate, 0.0, 1.0, initial_points=5, tolerance=0.01, max_points=40)
+    assert x == sorted(x)
+    assert len(x) <= 40
+    np.testing.assert_allclose(y, np.tanh(20.0 * (np.array(x) - 0.7)))
+    # the points are concentrated around the steep part of the curve
+    assert np.sum(np.abs(np.array(x) - 0.7) < 0.15) > np.sum(np.array(x) < 0.4)
+    assert len(evaluations) > 1
+
+
+def test_refine_points_linear():
+    x, y = refine_points(lambda points: [2.0 * p + 1.0 for p in points], 0.0, 1.0, initial_points=5)
+    np.testing.assert_allclose(x, np.linspace(0.0, 1.0, 5))
+
+
+def test_get_series_array(mocker):
+    prop = mocker.MagicMock()
+    prop.get_series.return_value = [1.0, 2.0, 3.0]
+    prop.get_unit_factor.return_value = 0.5
+    series = get_series_array(prop)
+    assert series.dtype == np.float64 and series.flags['C_CONTIGUOUS']
+    np.testing.assert_allclose(series, [0.5, 1.0, 1.5])
+    prop.get_unit_factor.assert_called_once()
+    assert get_series_array(prop, np.float32).dtype == np.float32
+    np.testing.assert_allclose(get_series_array(prop, apply_unit_factor=False), [1.0, 2.0, 3.0])
+
+
+def test_decimate_keeps_peaks():
+    x = np.linspace(0.0, 100.0, 100001)
+    y = np.sin(x) + 0.01 * x
+    y[54321] = 10.0
+    y[12345] = -10.0
+    for method in ('minmax', 'lttb'):
+        x_dec, y_dec = decimate(x, y, 500, method)
+        assert len(x_dec) <= 1002
+        assert np.all(np.diff(x_dec) > 0)
+        assert y_dec.max() == 10.0 and y_dec.min() == -10.0
+        assert x_dec[0] == x[0] and x_dec[-1] == x[-1]
+    x_short, y_short = decimate(x[:100], y[:100], 500)
+    assert len(x_short) == 100
+
+
+def test_route_geometry_cache(mocker, tmp_path):
+    cache_file = str(tmp_path / 'route_geometry.pkl')
+    geometry = RouteGeometry(['PIPE P1', 'PIPE P2'], [1, 1], [10, 20], np.arange(32.0), np.zeros(32), np.arange(4.0))
+    # two processes add a geometry to the same file, neither geometry is lost
+    first = RouteGeometryCache(cache_file)
+    second = RouteGeometryCache(cache_file)
+    first.add(('model', 'route 1', 1), geometry)
+    second.add(('model', 'route 2', 1), geometry)
+    cache = RouteGeometryCache(cache_file)
+    assert cache.get(('model', 'route 1', 1)) is not None
+    assert cache.get(('model', 'route 2', 1)).n_elements == [10, 20]
+
+    model = mocker.MagicMock()
+    pipes = {'PIPE P1': mocker.MagicMock(), 'PIPE P2': mocker.MagicMock()}
+    pipes['PIPE P1'].get_num_elements.return_value = 10
+    pipes['PIPE P2'].get_num_elements.return_value = 20
+    model.get_component.side_effect = pipes.get
+    assert geometry.matches(model)
+    pipes['PIPE P2'].get_num_elements.return_value = 40
+    assert not geometry.matches(model)
+
+
+def test_prepare_worker_directory(tmp_path):
+    wanda_bin = tmp_path / 'bin'
+    wanda_bin.mkdir()
+    (wanda_bin / 'wanda.exe').write_text('4.6')
+    (tmp_path / 'case.wdi').write_text('case')
+    worker_directory = str(tmp_path / 'worker')
+    prepare_worker_directory(worker_directory, str(tmp_path / 'case.wdi'), str(wanda_bin))
+    assert (tmp_path / 'worker' / 'bin' / 'wanda.exe').read_text() == '4.6'
+
+    # Wanda is updated in place, at the same path
+    (tmp_path / 'update.exe').write_text('4.7 update')
+    os.replace(str(tmp_path / 'update.exe'), str(wanda_bin / 'wanda.exe'))
+    prepare_worker_directory(worker_directory, str(tmp_path / 'case.wdi'), str(wanda_bin))
+    assert (tmp_path / 'worker' / 'bin' / 'wanda.exe').read_text() == '4.7 update'
+    assert (tmp_path / 'worker' / 'case.wdi').read_text() == 'case'
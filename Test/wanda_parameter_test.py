@@ -0,0 +1,251 @@
+import pickle
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from PyPDF2 import PdfFileReader
+from wandatoolbox.wanda_parameter import WandaParameter, WandaPropertyCache, WandaScenario, ScenarioResultCache, \
+    WandaParameterScript, FigureDate, get_result_extremes, compile_plan, shared_outputs
+
+
+def create_property(mocker, extr_min, extr_max, unit_factor=1.0, disused=False):
+    prop = mocker.MagicMock()
+    prop.get_extr_min.return_value = extr_min
+    prop.get_extr_max.return_value = extr_max
+    prop.get_unit_factor.return_value = unit_factor
+    prop.is_disused.return_value = disused
+    return prop
+
+
+def create_model(mocker, components, keywords=None):
+    """Mocked model with the components by name, each component has the properties in a dict by name."""
+    keywords = keywords or {}
+    model = mocker.MagicMock()
+
+    def create_component(properties):
+        component = mocker.MagicMock()
+        component.contains_property.side_effect = lambda name: name in properties
+        component.get_property.side_effect = properties.get
+        return component
+
+    items = {name: create_component(properties) for name, properties in components.items()}
+    model.get_components_with_keyword.side_effect = lambda keyword: [items[name] for name in keywords.get(keyword, [])]
+    model.component_exists.side_effect = lambda name: name in items
+    model.get_component.side_effect = items.get
+    model.get_nodes_with_keyword.return_value = []
+    model.node_exists.return_value = False
+    model.get_signal_lines_with_keyword.return_value = []
+    model.sig_line_exists.return_value = False
+    return model
+
+
+def create_scenario(tmp_path, name='A', case_number=1):
+    plot_data = {"Case number": case_number, "Appendix": "A", "Description": "Project", "Case description": name,
+                 "Extra description": "", "Project number": "P1", "Chapter": 1, "Date": "2024-01-01"}
+    return WandaScenario(str(tmp_path / 'model.wdi'), 'bin', name, {}, plot_data, {})
+
+
+def test_property_cache(mocker):
+    model = create_model(mocker, {'PIPE P1': {'Head': create_property(mocker, 1.0, 2.0)}})
+    cache = WandaPropertyCache(model)
+    head = WandaParameter('PIPE P1', 'Head', output='Max')
+    head_min = WandaParameter('PIPE P1', 'Head', output='Min')
+
+    assert cache.get_properties(head) == cache.get_properties(head_min)
+    assert cache.get_statistics() == {"hits": 1, "misses": 1, "size": 1}
+    assert model.get_component.call_count == 1
+
+    # after a reload the handles are resolved again
+    cache.reload_output()
+    cache.get_properties(head)
+    assert cache.get_statistics() == {"hits": 1, "misses": 2, "size": 1}
+    model.reload_output.assert_called_once()
+
+
+def test_result_extremes(mocker):
+    model = create_model(mocker, {'PIPE P1': {'Head': create_property(mocker, 1.0, 4.0, unit_factor=2.0)},
+                                  'PIPE P2': {'Head': create_property(mocker, -3.0, 6.0)},
+                                  'PIPE P3': {'Head': create_property(mocker, -9.0, 9.0, disused=True)}},
+                         keywords={'pipes': ['PIPE P1', 'PIPE P2', 'PIPE P3']})
+    outputs = [WandaParameter('pipes', 'Head', output='Max'), WandaParameter('pipes', 'Head', output='Min'),
+               WandaParameter('PIPE P1', 'Head', output='Series'), WandaParameter('PIPE P1', 'Head', output='min')]
+
+    extremes = get_result_extremes(model, outputs, WandaPropertyCache(model))
+    # the series are no extremes and the disused pipe is left out
+    assert extremes.index.tolist() == [('pipes', 'Head', 'Max'), ('pipes', 'Head', 'Min'),
+                                       ('PIPE P1', 'Head', 'min')]
+    np.testing.assert_allclose(extremes.to_numpy(), [8.0, -3.0, 2.0])
+    assert outputs[3].get_result_extreme(model) == 2.0
+    assert get_result_extremes(model, outputs[2:3]).empty
+
+
+def test_result_cache(tmp_path):
+    result_cache = ScenarioResultCache(str(tmp_path / 'cache'))
+    assert result_cache.load('key') is None
+    result_cache.store('key', ['A', 1.0])
+    assert result_cache.load('key') == {"result": ['A', 1.0]}
+
+    scenario = create_scenario(tmp_path)
+    scenario.add_parameter('PIPE P1', 'Length', 10.0)
+    scenario.result_cache = result_cache
+    scenario.cache_key = scenario.get_cache_key('model', 'bin')
+    result_cache.store(scenario.cache_key, ['A', 1.0])
+    # without its figures the scenario has to run again
+    assert scenario.load_cached_result() is None
+    open(scenario.pdf_file, 'w').close()
+    # a pdf without the key of the scenario may be of an older version of the scenario
+    assert scenario.load_cached_result() is None
+    scenario.write_pdf_key()
+    assert scenario.load_cached_result() == ['A', 1.0]
+
+    # a changed parameter gives another key
+    other = create_scenario(tmp_path)
+    other.add_parameter('PIPE P1', 'Length', 20.0)
+    assert other.get_cache_key('model', 'bin') != scenario.cache_key
+    assert create_scenario(tmp_path).get_cache_key('model', 'other bin') != \
+        create_scenario(tmp_path).get_cache_key('model', 'bin')
+    other.cache_key = other.get_cache_key('model', 'bin')
+    other.result_cache = result_cache
+    result_cache.store(other.cache_key, ['A', 2.0])
+    assert other.load_cached_result() is None
+
+
+def write_workbook(file_name, y_max=10, route_texts=()):
+    cases = pd.DataFrame([["Number", "Include", "Description", "Extra", "Appendix", "Chapter", "Date", "Name",
+                           "PIPE P1", "PIPE P1"],
+                          [None, "P123", "Project", None, None, None, None, None, "Length", "Diameter"],
+                          [1, 1, "Case 1", "extra", "A", 1, "2024-01-01", "case_1", 10.0, 0.5],
+                          [2, 0, "Case 2", "extra", "A", 1, "2024-01-01", "case_2", 20.0, 0.5],
+                          [3, 1, "Case 3", "extra", "B", 2, "2024-01-01", "case_3", 30.0, 0.6]])
+    output = pd.DataFrame({"Component": ["PIPE P1", "PIPE P1"], "Property": ["Head", "Head"], "Kind": ["Max", "Min"]})
+    axes = {"title": ["Head"], "Xlabel": ["Time"], "Ylabel": ["Head"], "Xmin": [0], "Xtick": [1], "Xmax": [10],
+            "Xscale": [1], "Ymin": [0], "Ytick": [1], "Ymax": [y_max], "Yscale": [1]}
+    series = pd.DataFrame(dict(name=["PIPE P1"], property=["Head"], fig=["a"], plot=[1], Legend=["P1"], **axes))
+    routes = pd.DataFrame(dict(name=["ROUTE"], property=["Head"], fig=["b"], plot=[1], Legend=[None], Direction=[-1],
+                               times=[0.0], **axes))
+    route_points = pd.DataFrame([["b", 1, 0.0, 1.0, text, 0.0, 0.0] for text in route_texts],
+                                columns=["fig", "plot", "x", "y", "text", "dx", "dy"])
+    with pd.ExcelWriter(file_name) as writer:
+        cases.to_excel(writer, sheet_name="Cases", header=False, index=False)
+        output.to_excel(writer, sheet_name="Output", index=False)
+        series.to_excel(writer, sheet_name="Tplots", index=False)
+        routes.to_excel(writer, sheet_name="Rplots", index=False)
+        route_points.to_excel(writer, sheet_name="route_points", index=False)
+
+
+def test_compile_plan(tmp_path):
+    write_workbook(str(tmp_path / 'cases.xlsx'))
+    plan = compile_plan(str(tmp_path / 'cases.xlsx'))
+
+    # only the included cases with a number
+    assert [name for name, plot_data, parameters in plan.cases] == ["case_1", "case_3"]
+    name, plot_data, parameters = plan.cases[1]
+    assert plot_data["Description"] == "Project"
+    assert plot_data["Project number"] == "P123"
+    assert plot_data["Appendix"] == "B"
+    assert [(component, prop, float(value)) for component, prop, value in parameters] == \
+        [("PIPE P1", "Length", 30.0), ("PIPE P1", "Diameter", 0.6)]
+    assert plan.output_columns == [("PIPE P1", "Head", "Max"), ("PIPE P1", "Head", "Min")]
+    assert [output.output for output in plan.outputs] == ["Max", "Min", "Series", "Route"]
+    assert plan.outputs[3].direction == -1
+    assert set(plan.figures) == {"a", "b"}
+    assert plan.figures["b"][1].times == [0.0]
+    assert plan.text_data == []
+
+
+def get_cache_keys(tmp_path, **kwargs):
+    write_workbook(str(tmp_path / 'cases.xlsx'), **kwargs)
+    script = WandaParameterScript(str(tmp_path / 'model.wdi'), 'bin', str(tmp_path / 'cases.xlsx'), use_cache=False)
+    script.parse_excel_file()
+    return [scenario.get_cache_key('model', 'bin') for scenario in script.scenarios]
+
+
+def test_cache_key_of_workbook(tmp_path):
+    # the plot numbers of the workbook are NumPy integers in the figure settings and route texts
+    keys = get_cache_keys(tmp_path, route_texts=['Pump'])
+    assert len(set(keys)) == 2
+    assert get_cache_keys(tmp_path, route_texts=['Pump']) == keys
+    # changed figure settings and route texts give other keys
+    assert set(get_cache_keys(tmp_path, y_max=20, route_texts=['Pump'])).isdisjoint(keys)
+    assert set(get_cache_keys(tmp_path, route_texts=['Valve'])).isdisjoint(keys)
+    assert set(get_cache_keys(tmp_path)).isdisjoint(keys)
+
+
+def test_shared_outputs(tmp_path):
+    outputs = (WandaParameter('PIPE P1', 'Head', output='Max'), WandaParameter('PIPE P1', 'Head', output='Series'))
+    scenario = create_scenario(tmp_path)
+    scenario.set_shared_outputs('sweep', outputs)
+    assert shared_outputs['sweep'] is outputs
+
+    # the shared outputs are not pickled with the scenario, the receiving process takes them from shared_outputs
+    assert scenario.__getstate__()['output'] is None
+    copy = pickle.loads(pickle.dumps(scenario))
+    assert copy.output is outputs
+
+    # the output definitions use slots, they are pickled without a __dict__
+    assert not hasattr(outputs[0], '__dict__')
+    parameter = pickle.loads(pickle.dumps(outputs[1]))
+    assert (parameter.wanda_component, parameter.wanda_property, parameter.output) == ('PIPE P1', 'Head', 'Series')
+
+    # a scenario with an output of its own gets its own list, the shared outputs are unchanged
+    scenario.add_output('PIPE P2', 'Head', 'Min')
+    assert scenario.outputs_key is None
+    assert len(scenario.output) == 3 and len(outputs) == 2
+    assert len(pickle.loads(pickle.dumps(scenario)).output) == 3
+
+
+def test_series_columns(tmp_path):
+    scenario = create_scenario(tmp_path)
+    scenario.output = [WandaParameter('PIPE P1', 'Head', output='Series', legend='P1 start'),
+                       WandaParameter('PIPE P1', 'Head', output='Series', legend='P1 end'),
+                       WandaParameter('pipes', 'Head', output='Series')]
+    scenario.series = {0: [np.zeros(3)], 1: [np.ones(3)], 2: [np.zeros(3), np.ones(3)]}
+    # outputs of the same property get columns of their own
+    columns = scenario.get_series_columns()
+    assert list(columns) == ['PIPE P1|Head|0', 'PIPE P1|Head|1', 'pipes|Head|2|0', 'pipes|Head|2|1']
+    np.testing.assert_allclose(columns['PIPE P1|Head|1'], 1.0)
+
+
+def test_pages_decimate(mocker, tmp_path):
+    extract = mocker.patch('wandatoolbox.wanda_parameter.PlotTimeseries.extract')
+    scenario = create_scenario(tmp_path)
+    scenario.output = [WandaParameter('PIPE P1', 'Head', output='Series', fig_number='a', plot_number=1)]
+    scenario.figure_data = {'a': {1: FigureDate('Head', 'Time', 'Head', None, None, [])}}
+    key = scenario.get_cache_key('model', 'bin')
+    scenario.decimate = 'minmax'
+
+    plot = scenario.get_pages(mocker.MagicMock())[0][0][0]
+    assert plot.decimate == 'minmax'
+    extract.assert_called_once()
+    # the rendered pdf depends on the decimation, so does the key
+    assert scenario.get_cache_key('model', 'bin') != key
+
+
+def test_case_index_fallback(mocker, tmp_path):
+    model = mocker.MagicMock()
+    # a pywanda version without the methods the index needs
+    model.get_all_components_str.side_effect = AttributeError("get_all_components_str")
+    mocker.patch('wandatoolbox.wanda_parameter.pywanda.WandaModel', return_value=model, create=True)
+    open(str(tmp_path / 'model.wdi'), 'w').close()
+    script = WandaParameterScript(str(tmp_path / 'model.wdi'), 'bin', 'cases.xlsx')
+    script.scenarios = [create_scenario(tmp_path)]
+
+    # the scenarios use the keyword search instead of the index
+    script.prepare_case_index()
+    assert script.scenarios[0].case_index_file is None
+    model.close.assert_called_once()
+
+
+def test_merge_appendices(tmp_path, capsys):
+    script = WandaParameterScript(str(tmp_path / 'model.wdi'), 'bin', 'cases.xlsx', use_cache=False)
+    pdf_files = [str(tmp_path / f'A_{number:03}.pdf') for number in (1, 2, 3)]
+    for pdf_file in pdf_files[:2]:
+        figure = Figure()
+        figure.savefig(pdf_file)
+    script.appendix = {'A': pdf_files}
+
+    # the second scenario failed, its pdf is of an older run; the third has no pdf at all
+    script.merge_appendices({pdf_files[0]})
+    assert PdfFileReader(script.model_dir + '\\figures\\' + 'A.pdf').getNumPages() == 1
+    output = capsys.readouterr().out
+    assert 'Appendix A is incomplete' in output
+    assert pdf_files[1] in output and pdf_files[2] in output
@@ -5,7 +5,10 @@ from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 import pandas as pd
 import pywanda
-from wandatoolbox.wanda_plot import PlotText, PlotTable, PlotImage, plot
+from PyPDF2 import PdfFileReader
+from wandatoolbox.wanda_plot import (PlotText, PlotTable, PlotImage, PlotTimeseries, PlotRoute, PlotSyschar,
+                                     PageTemplate, plot, render_report)
+from wandatoolbox.util import RouteGeometryCache, get_route_geometry, get_syschar
 
 
 def test_wandaplot_text(mocker):
@@ -74,13 +77,125 @@ def test_wandaplot_table(mocker):
         plt.close()
 
 
-def test_wandaplot_route(mocker):
-    pass
+def mock_route(mocker, n_pipes=2, n_elements=2, n_times=5):
+    model = mocker.MagicMock()
+    model.get_time_steps.return_value = np.arange(n_times, dtype=float).tolist()
+    pipes = []
+    for i in range(n_pipes):
+        pipe = mocker.MagicMock()
+        pipe.get_complete_name_spec.return_value = f'PIPE P{i + 1}'
+        pipe.get_num_elements.return_value = n_elements
+        pipe.get_property.return_value.get_table.return_value.get_float_data.return_value = [
+            [0.0, 0.0], [float(i), float(i + 1)], [0.0, 100.0]]
+        series = np.arange((n_elements + 1) * n_times, dtype=float).reshape(n_elements + 1, n_times) + 100 * i
+        pipe.get_property.return_value.get_series_pipe.return_value = series.tolist()
+        pipe.get_property.return_value.get_unit_factor.return_value = 1.0
+        pipes.append(pipe)
+    model.get_component.side_effect = lambda name: pipes[int(name[6:]) - 1]
+    return model, pipes
 
 
-def test_wandaplot_time(mocker):
-    pass
+def test_wandaplot_route(mocker, tmp_path):
+    model, pipes = mock_route(mocker)
+    geometry = get_route_geometry(model, pipes, [1, 1])
+    np.testing.assert_allclose(geometry.s_location, [0, 50, 100, 100, 150, 200])
+    assert geometry.pipe_names == ['PIPE P1', 'PIPE P2']
 
+    cache = RouteGeometryCache(str(tmp_path / 'route_geometry.pkl'))
+    cache.add(('model.wdi', 'ROUTE', 1), geometry)
+    reloaded = RouteGeometryCache(str(tmp_path / 'route_geometry.pkl')).get(('model.wdi', 'ROUTE', 1))
+    np.testing.assert_allclose(reloaded.elevation, geometry.elevation)
 
-def test_wandaplot_syschar(mocker):
-    pass
+    plot_route = PlotRoute(geometry.pipe_names, geometry.annotations, 'Pressure', [0.0, 2.0, 'max'], 'Title',
+                           'Distance (m)', 'Pressure (barg)', geometry=geometry)
+    plot_route.extract(model)
+    with PdfPages(str(tmp_path / 'test_wandaplotroute.pdf')) as pdf:
+        plot(None, [plot_route], 'Title', 'Case title', 'Case description', '11201234', 'Section name', 'Fig A.1')
+        pdf.savefig()
+        plt.close()
+    data = plot_route.route_data[2]
+    np.testing.assert_allclose(data[2.0], [2, 7, 12, 102, 107, 112])
+    np.testing.assert_allclose(data['max'], [4, 9, 14, 104, 109, 114])
+
+
+def test_wandaplot_time(mocker, tmp_path):
+    model = mocker.MagicMock()
+    model.get_time_steps.return_value = [0.0, 1.0, 2.0]
+    prop = model.get_component.return_value.get_property.return_value
+    prop.get_series.return_value = [1.0, 2.0, 3.0]
+    prop.get_unit_factor.return_value = 2.0
+
+    plot_time = PlotTimeseries([('PIPE P1', 'Pressure', 'P1')], 'Title', 'Time (s)', 'Pressure (barg)')
+    plot_time.extract(model)
+    # once extracted, the page is rendered without the model
+    with PdfPages(str(tmp_path / 'test_wandaplottime.pdf')) as pdf:
+        plot(None, [plot_time], 'Title', 'Case title', 'Case description', '11201234', 'Section name', 'Fig A.1')
+        pdf.savefig()
+        plt.close()
+    x, series = plot_time.series_data
+    np.testing.assert_allclose(series[0][0], [2.0, 4.0, 6.0])
+    assert series[0][1] == 'P1'
+
+
+def test_wandaplot_template(tmp_path):
+    plot_time = PlotTimeseries([], 'Title', 'Time (s)', 'Pressure (barg)')
+    plot_time.series_data = ([0.0, 1.0, 2.0], [(np.array([1.0, 2.0, 3.0]), 'P1')])
+    template = PageTemplate()
+    with PdfPages(str(tmp_path / 'test_wandaplottemplate.pdf')) as pdf:
+        for counter in range(1, 3):
+            figure = plot(None, [plot_time] * counter, 'Title', 'Case title', 'Case description',
+                          '11201234', 'Section name', f'Fig A.{counter}', template=template)
+            pdf.savefig(figure)
+    # the frame and logo axes are reused, only the subplots of the last page are added
+    assert len(template.figure.axes) == len(template.frame_axes) + 2
+    assert template.texts['fig_name'].get_text() == 'Fig A.2'
+    template.close()
+
+
+def test_render_report(tmp_path):
+    plot_time = PlotTimeseries([], 'Title', 'Time (s)', 'Pressure (barg)')
+    plot_time.series_data = ([0.0, 1.0, 2.0], [(np.array([1.0, 2.0, 3.0]), 'P1')])
+    pages = [([plot_time], dict(title='Title', case_title='Case title', case_description='Case description',
+                                proj_number='11201234', section_name='Section name', fig_name=f'Fig A.{number}'))
+             for number in range(1, 6)]
+    # the pages are rendered headless, no figure is left open in pyplot
+    n_figures = len(plt.get_fignums())
+    pdf_file = str(tmp_path / 'test_renderreport.pdf')
+    assert render_report(pages, pdf_file, n_workers=2) == [pdf_file]
+    assert PdfFileReader(pdf_file).getNumPages() == 5
+    png_files = render_report(pages[:2], str(tmp_path / 'test_renderreport_{}.png'), n_workers=2, image_format='png',
+                              dpi=50)
+    assert png_files == [str(tmp_path / 'test_renderreport_1.png'), str(tmp_path / 'test_renderreport_2.png')]
+    height, width = plt.imread(png_files[1]).shape[:2]
+    assert height > width
+    assert len(plt.get_fignums()) == n_figures
+
+
+def test_wandaplot_syschar(tmp_path):
+    syschar_data = pd.DataFrame({'scenario': ['Min'] * 3 + ['Max'] * 3,
+                                 'flow': [0.0, 0.5, 1.0] * 2,
+                                 'result': [10.0, 11.0, 14.0, 12.0, 13.0, 16.0]})
+    plot_syschar = PlotSyschar('BOUNDQ S1', 1.0, 'Supplier 1', pd.DataFrame(), 'Wanda_name', ['Min', 'Max'], 3,
+                               'Title', 'Discharge (m3/day)', 'Head (m)', syschar_data=syschar_data)
+    with PdfPages(str(tmp_path / 'test_wandaplotsyschar.pdf')) as pdf:
+        plot(None, [plot_syschar], 'Title', 'Case title', 'Case description', '11201234', 'Section name', 'Fig A.1')
+        pdf.savefig()
+        plt.close()
+    flows, heads = plot_syschar.syschar_data
+    np.testing.assert_allclose(flows['Max'], [0.0, 43200.0, 86400.0])
+    assert heads['Min'] == [10.0, 11.0, 14.0]
+
+
+def test_get_syschar(mocker):
+    model = mocker.MagicMock()
+    component = model.get_component.return_value
+    component.get_property.return_value.get_scalar_float.side_effect = [1.0, 2.0, 3.0]
+    warm_start = mocker.MagicMock()
+    timings = []
+    flows, heads = get_syschar(model, pd.DataFrame(), 'BOUNDQ S1', 1.0, 'Min', flows=[1.0, 0.0, 0.5],
+                               warm_start=warm_start, timings=timings)
+    assert flows == [0.0, 0.5, 1.0]
+    assert heads == [1.0, 2.0, 3.0]
+    assert model.save_model_input.call_count == 3
+    assert [call.args[1:] for call in warm_start.call_args_list] == [(0.0, 0.5), (0.5, 1.0)]
+    assert [timing['flow'] for timing in timings] == flows
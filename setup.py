@@ -35,7 +35,8 @@ setup(
         "pywanda>=0.4.1",
         "matplotlib>=3.1.3",
         "pandas>=1.0.1",
-        "numpy>=1.18.1"
+        "numpy>=1.18.1",
+        "pyarrow>=1.0.1"
     ],
 
     extras_require={
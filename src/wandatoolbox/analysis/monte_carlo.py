@@ -4,8 +4,13 @@ This is a somewhat more extensive example showing Monte Carlo simulations with W
 This also shows how you can run Wanda cases in parallel by using the multiprocessing features in python
 """
 
+import copy
+import itertools
+import math
 import multiprocessing as mp
+import multiprocessing.util
 import os
+import queue
 import pywanda as pw
 import random
 import shutil
@@ -14,6 +19,9 @@ import numpy as np
 import pandas as pd
 import logging
 from wandatoolbox.wanda_plot import get_syschar
+from wandatoolbox.util import get_extreme_pipe_array, prepare_worker_directory
+from wandatoolbox.analysis.sampling import create_design, normal_ppf
+from wandatoolbox.analysis.surrogate import create_surrogate, exceedance_probability, validation_errors
 
 
 class MonteCarloInputProperty:
@@ -51,25 +59,67 @@ class MonteCarloInputProperty:
                 self.wanda_prop.append(model.get_component(self.comp_name).get_property(self.prop_name))
         self.is_initialized = True
 
-    def update(self, model):
-        if not self.is_initialized:
-            self.initialize_property(model)
+    def ppf(self, u):
+        """Maps samples on the unit interval to the distribution of this property (inverse cdf). For the normal
+        distribution min_val is the mean and max_val the standard deviation, other types are integers from min_val
+        up to and including max_val."""
+        u = np.asarray(u, dtype=float)
         if self.dist_type == "uniform":
-            value = random.uniform(self.min_val, self.max_val)
-            for prop in self.wanda_prop:
-                prop.set_scalar(value)
+            return self.min_val + u * (self.max_val - self.min_val)
         elif self.dist_type == "normal":
-            value = random.gauss(self.min_val, self.max_val)
-            for prop in self.wanda_prop:
-                prop.set_scalar(value)
+            return self.min_val + self.max_val * normal_ppf(u)
         else:
-            value = random.randint(self.min_val, self.max_val)
-            for prop in self.wanda_prop:
-                prop.set_scalar(value)
+            return np.minimum(self.min_val + np.floor(u * (self.max_val - self.min_val + 1)), self.max_val)
+
+    def update(self, model, value=None):
+        """Sets the value of the property, without a value a random value of the distribution is drawn."""
+        if not self.is_initialized:
+            self.initialize_property(model)
+        if value is None:
+            value = self.ppf(random.random()).item()
+        for prop in self.wanda_prop:
+            prop.set_scalar(value)
+
+
+class RunningStatistics:
+    """Running mean and standard deviation of a stream of values (Welford's algorithm)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def get_variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.inf
+
+    def get_std(self):
+        return math.sqrt(self.get_variance())
+
+    def get_confidence_half_width(self, confidence=0.95):
+        """Half width of the confidence interval of the mean"""
+        if self.n < 2:
+            return np.inf
+        return normal_ppf(0.5 + confidence / 2.0) * self.get_std() / math.sqrt(self.n)
 
 
 class MonteCarloOutputProperty:
-    def __init__(self, comp_name, prop_name, keyword=False, extreme='MIN'):
+    def __init__(self, comp_name, prop_name, keyword=False, extreme='MIN', tolerance=None, quantile=None,
+                 confidence=0.95):
+        """Output property of the Monte Carlo analysis.
+
+        Args:
+            tolerance (float, optional): Relative tolerance for early stopping. The output has converged when the
+                confidence interval of the mean is smaller than tolerance * |mean|. Defaults to None (no criterion).
+            quantile (float, optional): When given, the estimate of this quantile must be stable as well: adding the
+                last 10% of the runs may change it by no more than tolerance (relative). Defaults to None.
+            confidence (float, optional): Confidence level of the interval of the mean. Defaults to 0.95.
+        """
         self.wanda_prop = []
         self.prop_name = prop_name
         self.comp_name = comp_name
@@ -77,6 +127,10 @@ class MonteCarloOutputProperty:
         self.is_keyword = keyword
         self.extreme = extreme
         self.results = []
+        self.tolerance = tolerance
+        self.quantile = quantile
+        self.confidence = confidence
+        self.statistics = RunningStatistics()
 
     def initialize_property(self, model):
         if self.comp_name == "GENERAL":
@@ -107,7 +161,7 @@ class MonteCarloOutputProperty:
         for prop in self.wanda_prop:
             unit_factor = prop.get_unit_factor()
             if prop.get_number_of_elements() > 1:
-                result.append(max(prop.get_extr_max_pipe()))
+                result.append(np.max(get_extreme_pipe_array(prop, 'MAX')))
             else:
                 result.append(prop.get_extr_max())
         return max(result) * unit_factor
@@ -120,7 +174,7 @@ class MonteCarloOutputProperty:
         for prop in self.wanda_prop:
             unit_factor = prop.get_unit_factor()
             if prop.get_number_of_elements() > 1:
-                result.append(min(prop.get_extr_min_pipe()))
+                result.append(np.min(get_extreme_pipe_array(prop, 'MIN')))
             else:
                 result.append(prop.get_extr_min())
         return min(result) * unit_factor
@@ -128,52 +182,131 @@ class MonteCarloOutputProperty:
     def get_results(self):
         return list(self.results)
 
+    def add_result(self, value):
+        self.results.append(value)
+        self.statistics.update(value)
+
+    def is_converged(self):
+        if self.tolerance is None:
+            return True
+        scale = max(abs(self.statistics.mean), np.finfo(float).tiny)
+        if self.statistics.get_confidence_half_width(self.confidence) > self.tolerance * scale:
+            return False
+        if self.quantile is not None:
+            window = max(len(self.results) // 10, 1)
+            current = np.quantile(self.results, self.quantile)
+            previous = np.quantile(self.results[:-window], self.quantile)
+            if abs(current - previous) > self.tolerance * max(abs(current), np.finfo(float).tiny):
+                return False
+        return True
 
-def worker(n_runs, wandacase, working_directory, parameters, outputs, worker_id):
+
+def get_running_statistics(data):
+    """Running mean and standard deviation of the first x results, for all x at once. The expanding window of pandas
+    updates the moments incrementally, so the standard deviation stays accurate for results with a large mean."""
+    running = pd.Series(np.asarray(data, dtype=float)).expanding()
+    return running.mean().to_numpy(), running.std(ddof=0).to_numpy()
+
+
+# Every worker process of the pool keeps its own copy of the case, its own Wanda bin directory and an opened model.
+# This state lives as long as the pool, so successive runs do not pay the setup again.
+worker_state = {}
+
+
+def open_worker_model():
+    """(Re)opens the model of this worker, a model that is still open is closed first."""
+    if "finalizer" in worker_state:
+        worker_state["finalizer"]()
+    # the properties of the old model can not be used with the new one, they are looked up again on first use
+    for para in itertools.chain(worker_state["parameters"], worker_state["outputs"]):
+        para.wanda_prop = []
+        para.is_initialized = False
+    model = pw.WandaModel(worker_state["case"], worker_state["wandabin"])
+    # the model is closed when the pool shuts the worker down
+    worker_state.update(model=model, finalizer=mp.util.Finalize(None, model.close, exitpriority=10))
+    return model
+
+
+def init_worker(worker_ids, working_directory, casename, parameters, outputs, retries=1):
     # Every process gets its own Wandacase and Wandabin
-    wandacase_directory, casename = os.path.split(wandacase)
+    worker_id = worker_ids.get()
     dst = os.path.join(working_directory, str(worker_id), casename)
     wandabin = os.path.join(working_directory, str(worker_id), "bin")
-    model = pw.WandaModel(str(dst), str(wandabin + "\\"))
-
-    results = []
-    for i in range(n_runs):
-        run_id = (n_runs * worker_id) + i
-        # if(run_id == None):
-        #     break
-        print("Worker #" + str(worker_id) + " running task ID: " + str(run_id))
-        for para in parameters:
-            para.update(model)
-        model.save_model_input()
+    worker_state.update(worker_id=worker_id, case=str(dst), wandabin=str(wandabin + "\\"), parameters=parameters,
+                        outputs=outputs, retries=retries)
+    open_worker_model()
+
+
+def run_sample(model, values):
+    for para, value in zip(worker_state["parameters"], values):
+        para.update(model, value)
+    model.save_model_input()
+    model.run_steady()
+    model.run_unsteady()
+    model.reload_input()
+    model.reload_output()
+    return [output.get_extreme(model) for output in worker_state["outputs"]]
+
+
+def worker(task):
+    """Runs one sample. A failing sample is retried with a freshly opened model, when it keeps failing the error is
+    returned instead of the results, so the worker continues with the next sample.
+
+    Returns:
+        tuple: (run_id, extreme values or None, error message or None, number of attempts)
+    """
+    run_id, values = task
+    worker_id = worker_state["worker_id"]
+    print("Worker #" + str(worker_id) + " running task ID: " + str(run_id))
+    attempts = 0
+    while True:
+        attempts += 1
         try:
-            model.run_steady()
+            return run_id, run_sample(worker_state["model"], values), None, attempts
         except Exception as inst:
-            print("Error in running steady thread " + str(worker_id))
+            print("Error in running task ID " + str(run_id) + " on thread " + str(worker_id))
             print(inst)
-            break
+            error = f"{type(inst).__name__}: {inst}"
+        if attempts > worker_state["retries"]:
+            return run_id, None, error, attempts
         try:
-            model.run_unsteady()
+            open_worker_model()
         except Exception as inst:
-            print("Error in running unsteady thread " + str(worker_id))
+            print("Error in reopening the model on thread " + str(worker_id))
             print(inst)
-            break
-        model.reload_input()
-        model.reload_output()
-        extreme_values = []
-        for output in outputs:
-            extreme_values.append(output.get_extreme(model))
-        results.append(extreme_values)
-    model.close()
-    return results
+            return run_id, None, error, attempts
 
 
 class WandaMonteCarlo:
-    def __init__(self, wanda_model, input_parameters, output_parameters, nruns=25, n_workers=None, work_directory=None):
+    def __init__(self, wanda_model, input_parameters, output_parameters, nruns=25, n_workers=None, work_directory=None,
+                 sampling="random", seed=None, correlation=None, min_runs=20, retries=1):
+        """Monte Carlo analysis of a Wanda model.
+
+        Args:
+            sampling (str, optional): Sampling design, 'random', 'lhs', 'halton' or 'sobol'. Defaults to "random".
+            seed (int, optional): Seed of the sampling design, for reproducible designs. Defaults to None.
+            correlation (array, optional): Correlation matrix between the input parameters. Defaults to None.
+            min_runs (int, optional): Minimum number of runs before a run can stop early, when the outputs with a
+                tolerance have converged. Defaults to 20.
+            retries (int, optional): Number of times a failing sample is retried with a freshly opened model. Samples
+                that keep failing are recorded in the failures DataFrame. Defaults to 1.
+        """
         self.wanda_model = wanda_model
         self.inputs = input_parameters
         self.outputs = output_parameters
         self.n_runs = nruns
         self.df = pd.DataFrame(columns=None)
+        self.sampling = sampling
+        self.correlation = correlation
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.design = pd.DataFrame(columns=[para.comp_name + " " + para.prop_name for para in self.inputs])
+        self.retries = retries
+        self.sample_ids = []
+        self.failures = pd.DataFrame(columns=["Error", "Attempts"] + list(self.design.columns))
+        self.failures.index.name = "Sample"
+        self.surrogates = {}
+        self.surrogate_df = None
+        self.surrogate_errors = None
         if n_workers is None:
             self.n_workers = mp.cpu_count()
         else:
@@ -184,50 +317,206 @@ class WandaMonteCarlo:
             if not os.path.isdir(work_directory):
                 raise NotADirectoryError
             self.work_directory = work_directory
+        self.pool = None
+        self.pool_workers = 0
+        self.pool_key = None
+        self.min_runs = min_runs
 
-    def run(self, n_workers=None):
-        # Todo self.work_directory integreren in runs
-        # Todo Logging
+    def is_converged(self):
+        criteria = [outp for outp in self.outputs if outp.tolerance is not None]
+        if not criteria or min(outp.statistics.n for outp in criteria) < self.min_runs:
+            return False
+        return all(outp.is_converged() for outp in criteria)
 
-        logger = logging.getLogger(__name__)
-        if n_workers is not None:
-            self.n_workers = n_workers
+    def get_pool_key(self):
+        """The definitions of the inputs and outputs and the retries the workers get when the pool is started."""
+        return ([(para.comp_name, para.prop_name, para.is_keyword) for para in self.inputs],
+                [(outp.comp_name, outp.prop_name, outp.is_keyword, outp.extreme) for outp in self.outputs],
+                self.retries)
+
+    def start_pool(self):
+        """Starts the worker pool, the pool is kept alive for successive runs until close_pool() is called. The pool
+        is started again when the number of workers, the inputs and outputs or the retries have changed."""
+        if self.pool is not None and self.pool_workers == self.n_workers and self.pool_key == self.get_pool_key():
+            return
+        self.close_pool()
         case_path = self.wanda_model.get_case_path()
         wanda_bin = self.wanda_model.get_wandabin()
         case_directory, case_name = os.path.split(case_path)
+        worker_ids = mp.Queue()
         for i in range(0, self.n_workers):
-            if os.path.isdir(os.path.join(self.work_directory, str(i))):
-                shutil.rmtree(os.path.join(self.work_directory, str(i)))  # delete directory if it already exists
-            os.mkdir(str(i))
-            dst = os.path.join(self.work_directory, str(i), case_name)
-            shutil.copyfile(case_path, dst)
-            shutil.copytree(wanda_bin, os.path.join(self.work_directory, str(i), "bin"))
+            prepare_worker_directory(os.path.join(self.work_directory, str(i)), case_path, wanda_bin)
+            worker_ids.put(i)
+        self.pool = mp.Pool(self.n_workers, initializer=init_worker,
+                            initargs=(worker_ids, self.work_directory, case_name, self.inputs, self.outputs,
+                                      self.retries))
+        self.pool_workers = self.n_workers
+        self.pool_key = self.get_pool_key()
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.pool_workers = 0
+            self.pool_key = None
+
+    def create_samples(self, n_samples):
+        """Creates the next n_samples of the design, every call gets its own independent seed. The samples are added
+        to the design, the sample ids continue from the previous samples."""
+        first_id = len(self.design)
+        design = create_design(self.inputs, n_samples, self.sampling, self.seed_sequence.spawn(1)[0],
+                               self.correlation)
+        design = pd.DataFrame(design, index=range(first_id, first_id + n_samples), columns=self.design.columns)
+        self.design = pd.concat([self.design, design]) if first_id > 0 else design
+        return design
+
+    def run_samples(self, design, stop_on_convergence=True):
+        """Simulates the samples of the design on the worker pool.
+
+        Args:
+            design (DataFrame): Samples to simulate, indexed by sample id.
+            stop_on_convergence (bool, optional): Stop submitting samples once the outputs have converged, the
+                samples that are not simulated are removed from the design. Defaults to True.
 
+        Returns:
+            list: (sample id, extreme values) of the successful samples, ordered by sample id
+        """
+        logger = logging.getLogger(__name__)
+        self.start_pool()
         logger.debug("Starting workers...")
-        # all_results = worker(self.n_runs, case_name, self.work_directory, self.inputs, self.outputs, 0)
-        pool = mp.Pool(self.n_workers)
-        output = [pool.apply_async(worker, args=(self.n_runs, case_name, self.work_directory,
-                                                 self.inputs, self.outputs, worker_id))
-                  for worker_id in range(0, self.n_workers)]
-        pool.close()
-        pool.join()
+        # Only a few samples per worker are queued at a time, the workers pull them one by one. The results stream back
+        # as they finish, and no new samples are submitted once all outputs with a tolerance have converged.
+        results_queue = queue.Queue()
+        tasks = zip(design.index, design.values)
+        submitted = []
+        n_pending = 0
+
+        def submit(task):
+            # an error in the pool itself is reported as a failed sample as well
+            self.pool.apply_async(worker, (task,), callback=results_queue.put,
+                                  error_callback=lambda inst: results_queue.put((task[0], None, repr(inst), 0)))
+            submitted.append(task[0])
+
+        for task in itertools.islice(tasks, 2 * self.n_workers):
+            submit(task)
+            n_pending += 1
+        converged = False
+        all_results = []
+        failures = []
+        while n_pending > 0:
+            run_id, res, error, attempts = results_queue.get()
+            n_pending -= 1
+            if res is not None:
+                # you need to transport the output data to the output objects manually, this cannot be transferred
+                # easily over the Multi-process boundary
+                all_results.append((run_id, res))
+                for outp, value in zip(self.outputs, res):
+                    outp.add_result(value)
+            else:
+                logger.warning(f"Sample {run_id} failed after {attempts} attempt(s): {error}")
+                failures.append([run_id, error, attempts] + list(design.loc[run_id]))
+            if stop_on_convergence and not converged and self.is_converged():
+                converged = True
+                logger.info(f"Outputs converged after {len(all_results)} runs, remaining samples are cancelled")
+            task = None if converged else next(tasks, None)
+            if task is not None:
+                submit(task)
+                n_pending += 1
+        cancelled = design.index.difference(submitted)
+        if len(cancelled):
+            self.design = self.design.drop(cancelled)
         logger.debug("workers have finished, generating output")
 
-        # you need to transport the output data to the output objects manually, this cannot be transferred easily over
-        # the Multi-process boundary
-        all_results = [res for results in output for res in results.get()]
-        for res in all_results:
+        # the results arrive in order of completion, they are stored in order of the sample id
+        all_results.sort(key=lambda r: r[0])
+        for outp in self.outputs:
+            del outp.results[len(outp.results) - len(all_results):]
+        for run_id, res in all_results:
+            self.sample_ids.append(run_id)
             for i in range(len(res)):
                 self.outputs[i].results.append(res[i])
+        if failures:
+            failures = pd.DataFrame(failures, columns=["Sample"] + list(self.failures.columns)).set_index("Sample")
+            self.failures = pd.concat([self.failures, failures]).sort_index() if len(self.failures) else failures
+            logger.warning(f"{len(failures)} of {len(submitted)} samples failed, see the failures DataFrame")
 
+        # the results are indexed by sample id, so they can be matched with the design and the failed samples
+        self.df = pd.DataFrame(index=pd.Index(self.sample_ids, name="Sample"))
         for outp in self.outputs:
-            column_name = outp.comp_name + " " + outp.prop_name + "_" + outp.extreme
-            self.df[column_name] = pd.Series(outp.get_results())
+            self.df[self.get_column_name(outp)] = outp.get_results()
         logger.debug("Output is available!")
+        return all_results
+
+    def run(self, n_workers=None):
+        if n_workers is not None:
+            self.n_workers = n_workers
+        # the complete design of this run is generated up front
+        self.run_samples(self.create_samples(self.n_runs * self.n_workers))
+
+    def run_surrogate(self, n_train, n_validation=None, n_samples=1000000, method="gp", n_workers=None, **kwargs):
+        """Monte Carlo analysis with a surrogate model of every output. The surrogates are fitted on n_train
+        simulations and checked with n_validation other simulations, after which the distribution of the outputs is
+        estimated from n_samples surrogate evaluations. The simulated samples are added to the regular results.
+
+        Args:
+            n_train (int): Number of simulations to fit the surrogates.
+            n_validation (int, optional): Number of simulations to validate the surrogates. Defaults to n_train // 4.
+            n_samples (int, optional): Number of surrogate evaluations. Defaults to 1000000.
+            method (str, optional): 'gp' (Gaussian process), 'polynomial' or a regressor with fit and predict.
+                Defaults to "gp".
+            **kwargs: Options of the surrogate, e.g. degree for the polynomial surrogate.
+
+        Returns:
+            DataFrame: Validation errors (RMSE, maximum absolute error and R2) per output
+        """
+        logger = logging.getLogger(__name__)
+        if n_workers is not None:
+            self.n_workers = n_workers
+        if n_validation is None:
+            n_validation = max(n_train // 4, 1)
+        train = self.run_samples(self.create_samples(n_train), stop_on_convergence=False)
+        validation = self.run_samples(self.create_samples(n_validation), stop_on_convergence=False)
+        x_train = self.design.loc[[run_id for run_id, res in train]].values.astype(float)
+        x_validation = self.design.loc[[run_id for run_id, res in validation]].values.astype(float)
+
+        # the cheap samples are not added to the design, only their surrogate results are kept
+        samples = create_design(self.inputs, n_samples, self.sampling, self.seed_sequence.spawn(1)[0],
+                                self.correlation)
+        self.surrogates = {}
+        self.surrogate_df = pd.DataFrame(index=pd.RangeIndex(n_samples, name="Sample"))
+        errors = {}
+        for i, outp in enumerate(self.outputs):
+            column_name = self.get_column_name(outp)
+            surrogate = create_surrogate(copy.deepcopy(method), **kwargs)
+            surrogate.fit(x_train, [res[i] for run_id, res in train])
+            errors[column_name] = validation_errors([res[i] for run_id, res in validation],
+                                                    surrogate.predict(x_validation))
+            logger.info(f"Surrogate of {column_name}: {errors[column_name]}")
+            self.surrogates[column_name] = surrogate
+            self.surrogate_df[column_name] = surrogate.predict(samples)
+        self.surrogate_errors = pd.DataFrame(errors).T
+        return self.surrogate_errors
+
+    def get_surrogate_results(self):
+        return self.surrogate_df
+
+    def get_exceedance_probability(self, output, threshold, below=False):
+        """Probability that the output exceeds the threshold (or stays below it), estimated with the surrogate
+        results when available and with the simulated results otherwise."""
+        df = self.surrogate_df if self.surrogate_df is not None else self.df
+        return exceedance_probability(df[self.get_column_name(output)], threshold, below)
+
+    @staticmethod
+    def get_column_name(output):
+        return output.comp_name + " " + output.prop_name + "_" + output.extreme
 
     def get_results(self):
         return self.df
 
+    def get_failures(self):
+        return self.failures
+
     def plot_results(self, filename_prefix, width=300, height=300):
         for output in self.outputs:
             data = output.get_results()
@@ -235,10 +524,11 @@ class WandaMonteCarlo:
             axarr[0].hist(output.get_results(), 15)
             axarr[0].set_xlabel(output.prop_name + "_" + output.extreme)
             axarr[0].set_ylabel('Number of occurences')
-            axarr[1].plot([np.mean(data[0:x]) for x in range(1, len(data))])
+            running_mean, running_std = get_running_statistics(data)
+            axarr[1].plot(running_mean)
             axarr[1].set_xlabel('Number of runs')
             axarr[1].set_ylabel('Average of results')
-            axarr[2].plot([np.std(data[0:x]) for x in range(1, len(data))])
+            axarr[2].plot(running_std)
             axarr[2].set_xlabel('Number of runs')
             axarr[2].set_ylabel('Standard deviation of results')
             dpi = f.get_dpi()
@@ -248,5 +538,6 @@ class WandaMonteCarlo:
                         bbox_inches='tight', pad_inches=0.1)
 
     def cleanup(self):
+        self.close_pool()
         for i in range(0, self.n_workers):
-            shutil.rmtree(os.path.join(os.getcwd(), str(i)))
+            shutil.rmtree(os.path.join(self.work_directory, str(i)))
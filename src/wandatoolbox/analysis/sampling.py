@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling designs for the Monte Carlo analysis. The complete design is generated up front in the main process, every
+sample is then dispatched to the workers by its index, so the result does not depend on which worker runs a sample.
+All designs are generated on the unit hypercube and mapped to the distributions of the input properties afterwards.
+"""
+
+import math
+from statistics import NormalDist
+import numpy as np
+
+# keep the unit samples away from 0 and 1, the inverse cdf of unbounded distributions is infinite there
+EPSILON = 1e-12
+
+normal_cdf = np.vectorize(lambda z: 0.5 * (1.0 + math.erf(z / math.sqrt(2.0))), otypes=[float])
+normal_ppf = np.vectorize(NormalDist().inv_cdf, otypes=[float])
+
+
+def random_design(n_samples, n_dims, rng):
+    """Plain Monte Carlo design."""
+    return rng.random((n_samples, n_dims))
+
+
+def latin_hypercube(n_samples, n_dims, rng):
+    """Latin hypercube design, every dimension has exactly one sample in each of the n_samples strata."""
+    strata = np.array([rng.permutation(n_samples) for _ in range(n_dims)]).reshape(n_dims, n_samples).T
+    return (strata + rng.random((n_samples, n_dims))) / n_samples
+
+
+def first_primes(n):
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton(n_samples, n_dims, rng):
+    """Halton sequence, randomized with a random shift (modulo 1) per dimension."""
+    design = np.empty((n_samples, n_dims))
+    indices = np.arange(1, n_samples + 1)
+    for dim, base in enumerate(first_primes(n_dims)):
+        remaining = indices.copy()
+        fraction = 1.0
+        values = np.zeros(n_samples)
+        while np.any(remaining > 0):
+            fraction /= base
+            values += fraction * (remaining % base)
+            remaining //= base
+        design[:, dim] = values
+    return (design + rng.random(n_dims)) % 1.0
+
+
+def sobol(n_samples, n_dims, rng):
+    """Scrambled Sobol sequence, this design requires scipy."""
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("Sobol sampling requires scipy (>=1.7), use 'lhs' or 'halton' instead")
+    return qmc.Sobol(n_dims, scramble=True, seed=rng).random(n_samples)
+
+
+SAMPLING_METHODS = {"random": random_design, "lhs": latin_hypercube, "halton": halton, "sobol": sobol}
+
+
+def correlate(design, correlation):
+    """Imposes a correlation on a unit hypercube design with a Gaussian copula.
+
+    :param design: Samples on the unit hypercube, one row per sample
+    :param correlation: Correlation matrix of the (normal scores of the) dimensions
+    :return: Correlated samples on the unit hypercube
+    """
+    cholesky = np.linalg.cholesky(np.asarray(correlation, dtype=float))
+    normal_scores = normal_ppf(np.clip(design, EPSILON, 1.0 - EPSILON))
+    return normal_cdf(normal_scores @ cholesky.T)
+
+
+def create_design(parameters, n_samples, method="random", seed=None, correlation=None):
+    """Creates the design matrix for a list of MonteCarloInputProperty objects.
+
+    :param parameters: List of input properties, every property is mapped with its own distribution
+    :param n_samples: Number of samples
+    :param method: Sampling method, one of 'random', 'lhs', 'halton' or 'sobol'
+    :param seed: Seed, a numpy SeedSequence or a numpy Generator
+    :param correlation: Optional correlation matrix between the input properties
+    :return: Array with one row per sample and one column per input property
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method '{method}', use one of {list(SAMPLING_METHODS)}")
+    rng = np.random.default_rng(seed)
+    design = SAMPLING_METHODS[method](n_samples, len(parameters), rng)
+    if correlation is not None:
+        design = correlate(design, correlation)
+    design = np.clip(design, EPSILON, 1.0 - EPSILON)
+    return np.column_stack([para.ppf(design[:, i]) for i, para in enumerate(parameters)])
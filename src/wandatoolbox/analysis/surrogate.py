@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Surrogate models (emulators) for the Monte Carlo analysis. A surrogate is fitted on a modest number of Wanda
+simulations and then evaluated for a large number of cheap samples. The surrogates only need numpy and follow the
+scikit-learn fit/predict convention, so a scikit-learn regressor can be used instead as well.
+"""
+
+import itertools
+import numpy as np
+
+
+class PolynomialSurrogate:
+    """Polynomial regression of total degree ``degree``, fitted with least squares. The inputs are scaled to [-1, 1]
+    with the range of the training samples."""
+
+    def __init__(self, degree=2):
+        self.degree = degree
+        self.lower = None
+        self.upper = None
+        self.terms = None
+        self.coefficients = None
+
+    def _scale(self, x):
+        return 2.0 * (x - self.lower) / np.where(self.upper > self.lower, self.upper - self.lower, 1.0) - 1.0
+
+    def _features(self, x):
+        x = self._scale(np.atleast_2d(np.asarray(x, dtype=float)))
+        features = np.ones((x.shape[0], len(self.terms)))
+        for i, term in enumerate(self.terms):
+            for dim in term:
+                features[:, i] *= x[:, dim]
+        return features
+
+    def fit(self, x, y):
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        self.lower = x.min(axis=0)
+        self.upper = x.max(axis=0)
+        self.terms = [term for degree in range(self.degree + 1)
+                      for term in itertools.combinations_with_replacement(range(x.shape[1]), degree)]
+        if len(self.terms) > x.shape[0]:
+            raise ValueError(f"A polynomial of degree {self.degree} in {x.shape[1]} inputs needs at least "
+                             f"{len(self.terms)} training samples, got {x.shape[0]}")
+        self.coefficients = np.linalg.lstsq(self._features(x), np.asarray(y, dtype=float), rcond=None)[0]
+        return self
+
+    def predict(self, x):
+        return self._features(x) @ self.coefficients
+
+
+class GaussianProcessSurrogate:
+    """Gaussian process regression with a squared exponential (RBF) kernel. The inputs and outputs are standardized,
+    the length scale is chosen from ``length_scales`` by the log marginal likelihood of the training data."""
+
+    def __init__(self, length_scales=(0.1, 0.2, 0.5, 1.0, 2.0, 5.0), noise=1e-6, chunk_size=10000):
+        self.length_scales = length_scales
+        self.noise = noise
+        self.chunk_size = chunk_size
+        self.length_scale = None
+
+    def _kernel(self, a, b):
+        distance = np.sum(a ** 2, axis=1)[:, None] + np.sum(b ** 2, axis=1)[None, :] - 2.0 * a @ b.T
+        return np.exp(-0.5 * np.maximum(distance, 0.0) / self.length_scale ** 2)
+
+    def _solve(self, x, y):
+        cholesky = np.linalg.cholesky(self._kernel(x, x) + self.noise * np.eye(len(x)))
+        alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y))
+        log_likelihood = -0.5 * y @ alpha - np.sum(np.log(np.diag(cholesky)))
+        return cholesky, alpha, log_likelihood
+
+    def fit(self, x, y):
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        y = np.asarray(y, dtype=float)
+        self.x_mean = x.mean(axis=0)
+        self.x_std = np.where(x.std(axis=0) > 0, x.std(axis=0), 1.0)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        self.x_train = (x - self.x_mean) / self.x_std
+        y_train = (y - self.y_mean) / self.y_std
+        best = None
+        for length_scale in self.length_scales:
+            self.length_scale = length_scale
+            try:
+                solution = self._solve(self.x_train, y_train)
+            except np.linalg.LinAlgError:
+                continue
+            if best is None or solution[2] > best[1][2]:
+                best = (length_scale, solution)
+        if best is None:
+            raise np.linalg.LinAlgError("The kernel matrix is not positive definite, increase the noise")
+        self.length_scale, (self.cholesky, self.alpha, _) = best
+        return self
+
+    def predict(self, x, return_std=False):
+        x = (np.atleast_2d(np.asarray(x, dtype=float)) - self.x_mean) / self.x_std
+        mean = np.empty(len(x))
+        std = np.empty(len(x)) if return_std else None
+        # the kernel between the samples and the training points is built per chunk to limit the memory use
+        for start in range(0, len(x), self.chunk_size):
+            kernel = self._kernel(x[start:start + self.chunk_size], self.x_train)
+            mean[start:start + self.chunk_size] = kernel @ self.alpha
+            if return_std:
+                v = np.linalg.solve(self.cholesky, kernel.T)
+                std[start:start + self.chunk_size] = np.sqrt(np.maximum(1.0 - np.sum(v ** 2, axis=0), 0.0))
+        mean = mean * self.y_std + self.y_mean
+        if return_std:
+            return mean, std * self.y_std
+        return mean
+
+
+SURROGATE_METHODS = {"polynomial": PolynomialSurrogate, "gp": GaussianProcessSurrogate}
+
+
+def create_surrogate(method="gp", **kwargs):
+    """Creates a surrogate by name, or returns ``method`` itself when it already is an (unfitted) regressor."""
+    if hasattr(method, "fit") and hasattr(method, "predict"):
+        return method
+    if method not in SURROGATE_METHODS:
+        raise ValueError(f"Unknown surrogate method '{method}', use one of {list(SURROGATE_METHODS)}")
+    return SURROGATE_METHODS[method](**kwargs)
+
+
+def validation_errors(y_true, y_predicted):
+    """Error measures of a surrogate on re-simulated validation samples.
+
+    :param y_true: Simulated values
+    :param y_predicted: Values predicted by the surrogate
+    :return: Dictionary with the RMSE, the maximum absolute error and the coefficient of determination (R2)
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    error = np.asarray(y_predicted, dtype=float) - y_true
+    total = np.sum((y_true - y_true.mean()) ** 2)
+    return {"RMSE": float(np.sqrt(np.mean(error ** 2))),
+            "Max error": float(np.max(np.abs(error))),
+            "R2": float(1.0 - np.sum(error ** 2) / total) if total > 0 else np.nan}
+
+
+def exceedance_probability(values, threshold, below=False):
+    """Fraction of the values above the threshold, or below it when ``below`` is set."""
+    values = np.asarray(values)
+    return float(np.mean(values < threshold if below else values > threshold))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Index sidecar of a Wanda case. Looking up a property through pywanda means walking the model: listing all components,
+scanning keywords and calling get_property per object over the bridge. The index is built once after a run and stored
+next to the case (<case>_index.json). It lists the components, nodes and signal lines with their keywords, the
+description, unit and unit factor of their properties, the number of output locations and the location of the output
+series in the output file (.wdo). Lookups are dictionary lookups. The indexed series can be read straight from the
+memory-mapped output file without pywanda, but the series reader of wandatoolbox.nefis is experimental, so this is
+only done for an index with read_output set.
+"""
+
+import json
+import os
+import numpy as np
+from wandatoolbox.nefis import WandaOutputFile
+
+INDEX_VERSION = 2
+ITEM_KINDS = ("component", "node", "signal_line")
+# errors of an output file, or of a part of it, that can not be read. The index is then built without those series.
+OUTPUT_ERRORS = (KeyError, ValueError, NotImplementedError)
+
+
+def get_index_file(case_file):
+    return os.path.splitext(case_file)[0] + "_index.json"
+
+
+def get_output_file(case_file):
+    return os.path.splitext(case_file)[0] + ".wdo"
+
+
+def get_file_stamp(file_name):
+    """Size and modification time of a file, used to detect that the index no longer matches the case."""
+    if not os.path.exists(file_name):
+        return None
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_case_index(model, case_file, read_output=False):
+    """Builds the index of a case and writes it next to the case.
+
+    :param model: Opened pywanda model of the case, the output is read when the case has been computed
+    :param case_file: Name of the case file (.wdi), the output file is the .wdo file next to it
+    :param read_output: Read the indexed series from the output file instead of through pywanda (experimental)
+    :return: CaseIndex
+    """
+    output_file = get_output_file(case_file)
+    output = None
+    if os.path.exists(output_file):
+        try:
+            output = WandaOutputFile(output_file)
+        except OUTPUT_ERRORS as inst:
+            print(f"The output of {case_file} is not indexed, {inst}")
+    items = {}
+    keywords = {}
+    try:
+        item_lists = (("component", model.get_all_components_str(), model.get_component),
+                      ("node", model.get_all_nodes_str(), model.get_node),
+                      ("signal_line", model.get_all_signal_lines_str(), model.get_signal_line))
+        for kind, names, get_item in item_lists:
+            for name in names:
+                item = get_item(name)
+                item_keywords = list(item.get_keywords())
+                for keyword in item_keywords:
+                    keywords.setdefault(kind, {}).setdefault(keyword, []).append(name)
+                properties = {}
+                for wanda_property in item.get_all_properties():
+                    description = wanda_property.get_description()
+                    unit_dim = wanda_property.get_unit_dim()
+                    entry = {"unit_dim": unit_dim, "unit": model.get_current_dim(unit_dim),
+                             "unit_factor": wanda_property.get_unit_factor(), "input": wanda_property.is_input()}
+                    if output is not None and not entry["input"]:
+                        try:
+                            layout = output.get_series_layout(name, description)
+                        except OUTPUT_ERRORS:
+                            layout = None
+                        if layout is not None:
+                            entry["n_locations"] = layout["shape"][0]
+                            entry["output"] = layout
+                    properties[description] = entry
+                # a node or signal line can have the name of a component, the items are kept per kind
+                items.setdefault(kind, {})[name] = {"keywords": item_keywords, "properties": properties}
+        time_steps = None
+        if output is not None:
+            try:
+                time_steps = output.get_time_steps_layout()
+            except OUTPUT_ERRORS:
+                time_steps = None
+    finally:
+        if output is not None:
+            output.close()
+    data = {"version": INDEX_VERSION,
+            "case_stamp": get_file_stamp(case_file),
+            "output_stamp": get_file_stamp(output_file),
+            "time_unit": model.get_current_dim("time"),
+            "time_steps": time_steps,
+            "items": items,
+            "keywords": keywords}
+    index_file = get_index_file(case_file)
+    # write to a temporary file first, parallel workers may build the index of the same case
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_file, index_file)
+    return CaseIndex(case_file, data, read_output)
+
+
+class CaseIndex:
+    """Index of a case, see build_case_index."""
+
+    def __init__(self, case_file, data, read_output=False):
+        self.case_file = case_file
+        self.output_file = get_output_file(case_file)
+        self.data = data
+        self.items = data["items"]
+        self.keywords = data["keywords"]
+        # the series are only read from the output file when asked for, the series reader is experimental
+        self.read_output = read_output
+        self.output_data = None
+
+    def __getstate__(self):
+        # the memory map is opened again in the receiving process
+        state = self.__dict__.copy()
+        state["output_data"] = None
+        return state
+
+    @classmethod
+    def load(cls, case_file, read_output=False):
+        """Loads the index of a case, returns None when there is no index or when the case has changed since the
+        index was built."""
+        index_file = get_index_file(case_file)
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file) as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION or data["case_stamp"] != get_file_stamp(case_file):
+            return None
+        return cls(case_file, data, read_output)
+
+    def get_item_names(self, kind=None):
+        return [name for item_kind in ITEM_KINDS if kind is None or item_kind == kind
+                for name in self.items.get(item_kind, {})]
+
+    def get_item(self, name, kind=None):
+        """Returns the item with the name, without a kind the first of a component, node and signal line with the name
+        is used, like pywanda does when plotting a series."""
+        for item_kind in ITEM_KINDS if kind is None else (kind,):
+            if name in self.items.get(item_kind, {}):
+                return self.items[item_kind][name]
+        raise KeyError(f"{name} is not in the index of {self.case_file}")
+
+    def get_items(self, name_or_keyword):
+        """Returns the (kind, name) of the items with the keyword, per kind of item the item with the name is used
+        when no item has the keyword. This is the lookup of WandaParameter.resolve_properties."""
+        items = []
+        for kind in ITEM_KINDS:
+            names = self.keywords.get(kind, {}).get(name_or_keyword, [])
+            if not names and name_or_keyword in self.items.get(kind, {}):
+                names = [name_or_keyword]
+            items.extend((kind, name) for name in names)
+        return items
+
+    def get_property_names(self, name, output_only=False, kind=None):
+        return [description for description, entry in self.get_item(name, kind)["properties"].items()
+                if not (output_only and entry["input"])]
+
+    def get_property(self, name, property_name, kind=None):
+        return self.get_item(name, kind)["properties"][property_name]
+
+    def has_output(self, name, property_name, kind=None):
+        """Whether the series of the property can be read from the output file: reading the output is enabled, the
+        series is indexed and the output file has not changed since the index was built."""
+        if not self.read_output:
+            return False
+        try:
+            entry = self.get_property(name, property_name, kind)
+        except KeyError:
+            return False
+        return "output" in entry and self.data["output_stamp"] == get_file_stamp(self.output_file)
+
+    def _read(self, layout):
+        if self.output_data is None:
+            if self.data["output_stamp"] != get_file_stamp(self.output_file):
+                raise ValueError(f"{self.output_file} has changed since the index was built, build the index again")
+            self.output_data = np.memmap(self.output_file, dtype=np.uint8, mode="r")
+        return np.ndarray(tuple(layout["shape"]), np.dtype(layout["dtype"]), buffer=self.output_data,
+                          offset=layout["offset"], strides=tuple(layout["strides"]))
+
+    def get_time_steps(self):
+        if self.data["time_steps"] is None:
+            raise KeyError(f"The index of {self.case_file} has no output")
+        return np.array(self._read(self.data["time_steps"]), dtype=np.float64)
+
+    def read_series_pipe(self, name, property_name, dtype=np.float64, apply_unit_factor=True, kind=None):
+        """Reads the series of a property at all its output locations from the output file, like
+        get_series_pipe_array but without pywanda."""
+        entry = self.get_property(name, property_name, kind)
+        if "output" not in entry:
+            raise KeyError(f"{property_name} of {name} is not in the output file")
+        series = np.array(self._read(entry["output"]), dtype=dtype)
+        if apply_unit_factor:
+            series *= entry["unit_factor"]
+        return series
+
+    def read_series(self, name, property_name, dtype=np.float64, apply_unit_factor=True, kind=None):
+        """Reads the series of a property from the output file, like get_series_array but without pywanda."""
+        return self.read_series_pipe(name, property_name, dtype, apply_unit_factor, kind)[0]
+
+
+# the loaded indexes of this process, by case file and stamp of the case
+case_indexes = {}
+
+
+def load_case_index(case_file, case_stamp=None):
+    """Loads the index of a case once per process, the stamp of the case is part of the key so a changed case is
+    loaded again. A missing index is not remembered, it is looked for again once it may have been built."""
+    key = (case_file, case_stamp)
+    if key not in case_indexes:
+        case_index = CaseIndex.load(case_file)
+        if case_index is None:
+            return None
+        case_indexes[key] = case_index
+    return case_indexes[key]
+
+
+def get_case_index(case_file):
+    return load_case_index(case_file, tuple(get_file_stamp(case_file) or ()))
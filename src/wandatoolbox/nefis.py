@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for Wanda output files (.wdo) without pywanda. The output file is a NEFIS file (the Deltares self describing
+data format), it is memory-mapped and the arrays of the elements are returned as NumPy views on the file, so only the
+pages that are actually used are read from disk. This makes the results available on platforms where Wanda itself
+is not installed, e.g. for post-processing and plotting on Linux.
+
+The layout of the records below was checked against the example output of Wanda 4.6 in Examples/example_data, a case
+that has not been computed:
+
+- a 128 byte header ending with the byte order ('L' or 'B'), followed by the file length;
+- four hash tables of 997 pointers for the element, cell, group definition and data group records, the records in a
+  bucket are chained by their first field;
+- element and cell definitions, group definitions with up to 5 dimensions, and data groups. The data of a group with
+  fixed dimensions follows its record. A group with a variable dimension (dimension 0) holds a 4 level tree of 256
+  pointers, indexed by the bytes of the (1-based) variable index, every leaf points to the cells of one index.
+
+The series reader (WandaOutputFile) is experimental. How the series of a component are found in the output groups -
+the names of the quantities, the Ndx_/Nof_ index elements and the (locations, time steps) layout of the OUTP_ groups -
+has not been checked against the series of pywanda yet, see test_series_match_pywanda in Test/nefis_test.py, which
+needs an installed Wanda. Until it passes, do not rely on the series without comparing them with pywanda.
+"""
+
+import numpy as np
+
+HEADER_SIGNATURE = b"Deltares, NEFIS"
+HEADER_LENGTH = 128
+HASH_TABLE_SIZE = 997
+NIL = -1
+# byte offset of the data (fixed groups) or the pointer table (variable groups) in a data group record
+DATA_GROUP_HEADER = 416
+POINTER_TABLE_SIZE = 256
+POINTER_TABLE_LEVELS = 4
+
+
+class NefisElement:
+    """Definition of an element, the type and shape of the array stored in a cell."""
+
+    def __init__(self, name, element_type, single_bytes, quantity, unit, description, dims):
+        self.name = name
+        self.element_type = element_type
+        self.single_bytes = single_bytes
+        self.quantity = quantity
+        self.unit = unit
+        self.description = description
+        self.dims = dims
+
+    @property
+    def nbytes(self):
+        return self.single_bytes * int(np.prod(self.dims))
+
+    def get_dtype(self, byte_order):
+        if self.element_type == "CHARACTE":
+            return np.dtype(f"S{self.single_bytes}")
+        kinds = {"REAL": "f", "INTEGER": "i", "LOGICAL": "i", "COMPLEX": "c"}
+        if self.element_type not in kinds:
+            raise ValueError(f"Unsupported NEFIS element type {self.element_type} of element {self.name}")
+        return np.dtype(f"{byte_order}{kinds[self.element_type]}{self.single_bytes}")
+
+
+class NefisGroup:
+    """A data group: the cells of a group definition, with the file offset of its data or of its pointer table."""
+
+    def __init__(self, name, definition, cell, dims, offset, variable, order=None):
+        self.name = name
+        self.definition = definition
+        self.cell = cell
+        self.dims = dims
+        self.offset = offset
+        self.variable = variable
+        # the order in which the dimensions are stored, 1-based, the natural order when not given
+        self.order = tuple(range(1, len(dims) + 1)) if order is None else order
+
+
+class NefisFile:
+    """Memory-mapped NEFIS file. The definitions are read when the file is opened, the data only when it is requested.
+
+    The arrays are read-only views on the file: use np.array(...) to get a copy that outlives the file or can be
+    changed.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.data = np.memmap(file_name, dtype=np.uint8, mode="r")
+        if bytes(self.data[:len(HEADER_SIGNATURE)]) != HEADER_SIGNATURE:
+            raise ValueError(f"{file_name} is not a NEFIS file")
+        self.byte_order = "<" if bytes(self.data[HEADER_LENGTH - 1:HEADER_LENGTH]) == b"L" else ">"
+        self.elements = {}
+        self.cells = {}
+        self.groups = {}
+        self._read_definitions()
+
+    def close(self):
+        # the memory map is closed when the last array that refers to it is gone
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read(self, dtype, offset, count=1):
+        values = np.frombuffer(self.data, dtype=np.dtype(dtype).newbyteorder(self.byte_order), count=count,
+                               offset=offset)
+        return values if count > 1 else values[0]
+
+    def _read_text(self, offset, length):
+        return bytes(self.data[offset:offset + length]).decode("latin-1").strip()
+
+    def _records(self, table):
+        """Offsets of all records in one of the hash tables, in file order."""
+        buckets = self._read("i8", HEADER_LENGTH + 8 + table * HASH_TABLE_SIZE * 8, HASH_TABLE_SIZE)
+        offsets = []
+        for offset in buckets[buckets != NIL]:
+            while offset != NIL:
+                offsets.append(int(offset))
+                offset = self._read("i8", offset)
+        return sorted(offsets)
+
+    def _read_definitions(self):
+        for offset in self._records(0):
+            ndim = int(self._read("i4", offset + 156))
+            self.elements[self._read_text(offset + 24, 16)] = NefisElement(
+                self._read_text(offset + 24, 16), self._read_text(offset + 40, 8), int(self._read("i4", offset + 56)),
+                self._read_text(offset + 60, 16), self._read_text(offset + 76, 16), self._read_text(offset + 92, 64),
+                tuple(int(dim) for dim in self._read("i4", offset + 160, 5)[:ndim]))
+        for offset in self._records(1):
+            n_elements = int(self._read("i4", offset + 48))
+            self.cells[self._read_text(offset + 24, 16)] = [self._read_text(offset + 52 + 16 * i, 16)
+                                                            for i in range(n_elements)]
+        definitions = {}
+        for offset in self._records(2):
+            ndim = int(self._read("i4", offset + 56))
+            definitions[self._read_text(offset + 24, 16)] = (
+                self._read_text(offset + 40, 16), tuple(int(dim) for dim in self._read("i4", offset + 60, 5)[:ndim]),
+                tuple(int(i) for i in self._read("i4", offset + 80, 5)[:ndim]))
+        for offset in self._records(3):
+            name = self._read_text(offset + 24, 16)
+            definition = self._read_text(offset + 40, 16)
+            cell, dims, order = definitions[definition]
+            self.groups[name] = NefisGroup(name, definition, cell, dims, offset + DATA_GROUP_HEADER, 0 in dims, order)
+
+    def get_group_names(self):
+        return list(self.groups)
+
+    def get_element_names(self, group_name):
+        return list(self.cells[self.groups[group_name].cell])
+
+    def get_element_definition(self, element_name):
+        return self.elements[element_name]
+
+    def get_cell_size(self, cell_name):
+        return sum(self.elements[element].nbytes for element in self.cells[cell_name])
+
+    def get_variable_blocks(self, group_name):
+        """Returns the variable indices (1-based) of a variable group that hold data, and the file offsets of their
+        cells."""
+        group = self.groups[group_name]
+        indices, offsets = [], []
+        tables = [(group.offset + 8, 0)]
+        for level in range(POINTER_TABLE_LEVELS):
+            children = []
+            for table_offset, prefix in tables:
+                pointers = self._read("i8", table_offset, POINTER_TABLE_SIZE)
+                for i in np.flatnonzero(pointers != NIL):
+                    children.append((int(pointers[i]), prefix * POINTER_TABLE_SIZE + int(i)))
+            tables = children
+        for offset, index in tables:
+            indices.append(index)
+            offsets.append(offset)
+        return np.array(indices, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+    def get_element(self, group_name, element_name):
+        """Returns the values of an element in all cells of a group.
+
+        The shape of the array is the shape of the group followed by the shape of the element, the element dimensions
+        are left out for elements with a single value. For a variable group the variable dimension has the length of
+        the last index that holds data. The array is a view on the file when the cells are evenly spaced in the file,
+        which is the case when the file is written in one go, otherwise it is a copy.
+
+        :param group_name: Name of the data group
+        :param element_name: Name of the element in the cell of the group
+        :return: NumPy array, strings are returned as bytes (see get_strings)
+        """
+        group = self.groups[group_name]
+        if group.order != tuple(range(1, len(group.dims) + 1)):
+            raise NotImplementedError(f"Group {group_name} has a dimension order {group.order}, which is not supported")
+        element = self.elements[element_name]
+        cell_names = self.cells[group.cell]
+        if element_name not in cell_names:
+            raise KeyError(f"Element {element_name} is not part of group {group_name}")
+        element_offset = sum(self.elements[name].nbytes for name in cell_names[:cell_names.index(element_name)])
+        cell_size = self.get_cell_size(group.cell)
+        dtype = element.get_dtype(self.byte_order)
+        element_dims = () if element.dims == (1,) else element.dims
+        # NEFIS stores the cells and the values of an element in column major (Fortran) order
+        element_strides = tuple(int(np.prod(element.dims[:i])) * element.single_bytes
+                                for i in range(len(element_dims)))
+        fixed_dims = [dim for dim in group.dims if dim != 0]
+        fixed_strides = [int(np.prod(fixed_dims[:i])) * cell_size for i in range(len(fixed_dims))]
+        if not group.variable:
+            return np.ndarray(group.dims + element_dims, dtype, buffer=self.data,
+                              offset=group.offset + element_offset, strides=tuple(fixed_strides) + element_strides)
+        variable_axis = group.dims.index(0)
+        indices, offsets = self.get_variable_blocks(group_name)
+        n_variable = int(indices[-1]) if len(indices) else 0
+        shape = group.dims[:variable_axis] + (n_variable,) + group.dims[variable_axis + 1:] + element_dims
+        fixed_shape = tuple(fixed_dims) + element_dims
+        strides = tuple(fixed_strides) + element_strides
+        if n_variable == 0:
+            return np.empty(shape, dtype)
+        steps = np.diff(offsets)
+        if np.array_equal(indices, np.arange(1, n_variable + 1)) and (len(steps) == 0 or np.all(steps == steps[0])):
+            step = int(steps[0]) if len(steps) else cell_size
+            strides = strides[:variable_axis] + (step,) + strides[variable_axis:]
+            return np.ndarray(shape, dtype, buffer=self.data, offset=int(offsets[0]) + element_offset,
+                              strides=strides)
+        # scattered cells, the blocks are gathered in a new array, indices without data are zero
+        values = np.zeros((n_variable,) + fixed_shape, dtype)
+        for index, offset in zip(indices, offsets):
+            values[index - 1] = np.ndarray(fixed_shape, dtype, buffer=self.data, offset=int(offset) + element_offset,
+                                           strides=strides)
+        return np.moveaxis(values, 0, variable_axis)
+
+    def get_strings(self, group_name, element_name):
+        """Returns the values of a character element as an array of stripped strings."""
+        return np.char.strip(np.char.decode(self.get_element(group_name, element_name), "latin-1"))
+
+
+def get_array_layout(array, data):
+    """Returns the byte offset, shape, strides and dtype of an array that is a view on the memory-mapped data, so it
+    can be recreated later with np.ndarray without reading the definitions again. Returns None for a copy."""
+    if array.size == 0 or not np.may_share_memory(array, data):
+        return None
+    return {"offset": array.__array_interface__["data"][0] - data.__array_interface__["data"][0],
+            "shape": list(array.shape), "strides": list(array.strides), "dtype": array.dtype.str}
+
+
+# Names of the output quantities of Wanda for the properties as they are named in pywanda. The quantity selects the
+# output group (OUTP_<QUANTITY>) and the index elements (Ndx_<quantity>, Nof_<quantity>) of a component.
+QUANTITIES = {
+    "Discharge": "discharge",
+    "Head": "head",
+    "Pressure": "pressure_g",
+    "Pressure absolute": "pressure_a",
+    "Velocity": "velocity",
+    "Mass flow": "massflow",
+    "Temperature": "temperature",
+    "Density": "density",
+    "Volume": "volume",
+    "Level": "level",
+}
+
+# (component group, index group, key element) of the hydraulic components and the hydraulic nodes
+INDEX_GROUPS = (("H_COMPONENTS", "H_COMP_INDEX", "H_comp_key"), ("H_NODES", "H_NODE_INDEX", "H_node_key"))
+
+
+class WandaOutputFile:
+    """Results of a Wanda case read directly from its output file (.wdo), without pywanda.
+
+    Series are returned as read-only views on the memory-mapped file, in the SI units in which Wanda stores them
+    (pywanda applies the unit factor of the model on top of that). Only hydraulic components and nodes are supported,
+    control components are not. Only the properties in QUANTITIES are read, other properties (e.g. 'Head 1' of a
+    component with several connection points) raise a KeyError.
+
+    Experimental: the layout of the series has not been checked against pywanda, see the module documentation.
+    """
+
+    def __init__(self, wdo_file):
+        self.nefis = NefisFile(wdo_file)
+        self.index = None
+        self.time_steps = None
+
+    def close(self):
+        self.nefis.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read_index(self):
+        """Reads the output index of all components and nodes: their names and the position of every quantity in
+        the output groups."""
+        self.index = {}
+        for names_group, index_group, key in INDEX_GROUPS:
+            if names_group not in self.nefis.groups or index_group not in self.nefis.groups:
+                continue
+            names = self.nefis.get_strings(names_group, "Name")
+            prefixes = (self.nefis.get_strings(names_group, "Name_prefix")
+                        if "Name_prefix" in self.nefis.get_element_names(names_group) else [""] * len(names))
+            keys = dict(zip(self.nefis.get_strings(names_group, key), zip(prefixes, names)))
+            elements = {name: np.array(self.nefis.get_element(index_group, name))
+                        for name in self.nefis.get_element_names(index_group) if name.startswith(("Ndx_", "Nof_"))}
+            for i, component_key in enumerate(self.nefis.get_strings(index_group, key)):
+                if component_key not in keys:
+                    continue
+                prefix, name = keys[component_key]
+                entry = {element: int(values[i]) for element, values in elements.items()}
+                self.index[name] = entry
+                if prefix:
+                    self.index[f"{prefix} {name}"] = entry
+
+    def get_component_names(self):
+        if self.index is None:
+            self._read_index()
+        return list(self.index)
+
+    def get_time_steps(self):
+        if self.time_steps is None:
+            self.time_steps = self.nefis.get_element("OUTPUT_TIME", "Value")
+        return self.time_steps
+
+    @staticmethod
+    def get_quantity(property_name):
+        if property_name in QUANTITIES:
+            return QUANTITIES[property_name]
+        if property_name in QUANTITIES.values():
+            return property_name
+        raise KeyError(f"{property_name} has no known output quantity")
+
+    def get_output_group(self, quantity):
+        cell = f"OUTP_{quantity.upper()}"
+        for group in self.nefis.groups.values():
+            if group.cell == cell:
+                return group.name
+        raise KeyError(f"The output file has no results for {quantity}, the case has not been computed")
+
+    def get_series_pipe(self, component_name, property_name):
+        """Returns the series of a property of a component at all its output locations.
+
+        :param component_name: Name of the component, with or without its type prefix (e.g. 'PIPE P1' or 'P1')
+        :param property_name: pywanda name of the property (e.g. 'Head') or the name of the Wanda quantity
+        :return: Array with one row per output location and one column per time step
+        """
+        if self.index is None:
+            self._read_index()
+        if component_name not in self.index:
+            raise KeyError(f"Component {component_name} is not in the output file")
+        quantity = self.get_quantity(property_name)
+        entry = self.index[component_name]
+        first, count = entry.get(f"Ndx_{quantity}", 0), entry.get(f"Nof_{quantity}", 0)
+        if first <= 0 or count <= 0:
+            raise KeyError(f"Component {component_name} has no output for {property_name}")
+        values = self.nefis.get_element(self.get_output_group(quantity), "Value")
+        return values[first - 1:first - 1 + count]
+
+    def get_series(self, component_name, property_name):
+        """Returns the series of a property of a component at its first output location, see get_series_pipe."""
+        return self.get_series_pipe(component_name, property_name)[0]
+
+    def get_series_layout(self, component_name, property_name):
+        """Returns where the series of get_series_pipe are stored in the file, see get_array_layout."""
+        return get_array_layout(self.get_series_pipe(component_name, property_name), self.nefis.data)
+
+    def get_time_steps_layout(self):
+        return get_array_layout(self.get_time_steps(), self.nefis.data)
@@ -0,0 +1,93 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+
+class SeriesStore:
+    """Columnar on-disk store for the time series of a parameter script sweep.
+
+    The store is a parquet dataset with one partition per scenario (``<store_dir>/scenario=<name>/series.parquet``).
+    Every partition holds a ``time`` column and one float column per series, so downstream tools can read single
+    columns or memory-map a scenario instead of opening the Wanda output files again.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def check_name(scenario_name):
+        """Raises a ValueError for a scenario name that can not be used as partition key: a path separator would
+        place the partition elsewhere and an ``=`` breaks the partition key when the dataset is read."""
+        invalid = [character for character in ("/", "\\", "=") if character in str(scenario_name)]
+        if invalid:
+            raise ValueError(f"Scenario name {scenario_name} contains {' '.join(invalid)}, which is not allowed in the "
+                             f"series store")
+
+    def get_file(self, scenario_name):
+        self.check_name(scenario_name)
+        return os.path.join(self.store_dir, f"scenario={scenario_name}", "series.parquet")
+
+    def contains(self, scenario_name):
+        return os.path.exists(self.get_file(scenario_name))
+
+    def write(self, scenario_name, time_steps, series):
+        """Writes the series of one scenario.
+
+        :param scenario_name: Name of the scenario, used as partition key
+        :param time_steps: Time steps of the series
+        :param series: Dictionary with the column name and NumPy array of every series
+        """
+        columns = {"time": np.asarray(time_steps, dtype=np.float64)}
+        columns.update(series)
+        file_name = self.get_file(scenario_name)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        # write to a temporary file first, a crashed worker should never leave a half written partition
+        temp_file = os.path.join(os.path.dirname(file_name), '.series.parquet.tmp')
+        pd.DataFrame(columns).to_parquet(temp_file, index=False)
+        os.replace(temp_file, file_name)
+
+    def read(self, scenario_name, columns=None):
+        return pd.read_parquet(self.get_file(scenario_name), columns=columns, memory_map=True)
+
+    def read_all(self, columns=None):
+        """Reads the series of all scenarios, the partition key is added as ``scenario`` column."""
+        return pd.read_parquet(self.store_dir, columns=columns)
+
+
+class ResultWriter:
+    """Incremental writer for the summary table of a parameter script run.
+
+    Every row is appended to a CSV sidecar as soon as its scenario has finished. The (component, property, kind)
+    header is written once as three header rows. The summary workbook is created from the sidecar and ordered by case
+    number, so it can also be recreated after an interrupted run.
+    """
+
+    def __init__(self, csv_file, columns):
+        """
+        :param csv_file: Name of the CSV sidecar
+        :param columns: List of (component, property, kind) tuples, one for every value in a result row
+        """
+        self.csv_file = csv_file
+        self.columns = list(columns)
+
+    def start(self):
+        with open(self.csv_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            for level in range(3):
+                writer.writerow(["Case number" if level == 0 else ""] + [column[level] for column in self.columns])
+
+    def append(self, case_number, row):
+        with open(self.csv_file, 'a', newline='') as f:
+            csv.writer(f).writerow([case_number] + list(row))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        frame = pd.read_csv(self.csv_file, header=[0, 1, 2], index_col=0)
+        frame.index.name = "Case number"
+        return frame.sort_index(kind='stable')
+
+    def write_excel(self, excel_file):
+        self.read().to_excel(excel_file)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel engine for system characteristics. The (scenario x flow point) grid of a supplier is distributed over a pool
+of worker processes, every worker has its own copy of the case and of the Wanda bin directory. The pool is kept alive
+between suppliers, so a report with many suppliers pays the setup only once.
+"""
+
+import multiprocessing as mp
+import multiprocessing.util
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pywanda as pw
+from wandatoolbox.util import prepare_worker_directory
+
+# Every worker process keeps its opened model copy and the discharges it has changed, so the discharges of a previous
+# supplier can be reset before the grid of the next supplier is computed.
+worker_state = {}
+
+
+def init_syschar_worker(worker_ids, working_directory, casename):
+    worker_id = worker_ids.get()
+    dst = os.path.join(working_directory, str(worker_id), casename)
+    wandabin = os.path.join(working_directory, str(worker_id), "bin")
+    model = pw.WandaModel(str(dst), str(wandabin + "\\"))
+    # the model is closed when the pool shuts the worker down
+    mp.util.Finalize(None, model.close, exitpriority=10)
+    worker_state.update(worker_id=worker_id, model=model, original={}, applied={})
+
+
+def apply_discharges(model, discharges, discharge_parameter):
+    """Sets the discharges of a task, the discharges set by previous tasks that are not part of this task are reset to
+    their original value. Only the discharges that change are set."""
+    original = worker_state["original"]
+    applied = worker_state["applied"]
+    settings = dict(discharges)
+    reset = [component_name for component_name in applied if component_name not in settings]
+    for component_name in reset:
+        settings[component_name] = original[component_name]
+    for component_name, value in settings.items():
+        if applied.get(component_name) == value:
+            continue
+        prop = model.get_component(component_name).get_property(discharge_parameter)
+        if component_name not in original:
+            original[component_name] = prop.get_scalar_float()
+        prop.set_scalar(value)
+        applied[component_name] = value
+    for component_name in reset:
+        del applied[component_name]
+
+
+def syschar_worker(task):
+    """Computes one point of a system characteristic.
+
+    :param task: (scenario, flow, discharges, component name, discharge parameter, result parameter), with discharges a
+        list of (component name, discharge) of all suppliers including the varied component
+    :return: (scenario, flow, result), the result is NaN when the steady run fails
+    """
+    scenario, flow, discharges, component_name, discharge_parameter, result_parameter = task
+    model = worker_state["model"]
+    apply_discharges(model, discharges, discharge_parameter)
+    model.save_model_input()
+    try:
+        model.run_steady()
+    except Exception as inst:
+        print(f"Error in running steady for {component_name}, scenario {scenario}, flow {flow}")
+        print(inst)
+        return scenario, flow, np.nan
+    model.reload_output()
+    return scenario, flow, model.get_component(component_name).get_property(result_parameter).get_scalar_float()
+
+
+class SyscharEngine:
+    """Computes system characteristics on a pool of model copies.
+
+    The case is copied when the pool starts, so changes to the model after that are not seen by the workers. Save the
+    model input before creating the engine, or call close() and start() again.
+    """
+
+    def __init__(self, model, n_workers=None, work_directory=None):
+        """
+        :param model: Wanda model to compute the system characteristics for
+        :param n_workers: Number of worker processes, defaults to the number of cpus
+        :param work_directory: Directory for the model copies, defaults to a temporary directory
+        """
+        self.model = model
+        self.n_workers = mp.cpu_count() if n_workers is None else n_workers
+        self.work_directory = work_directory
+        self.temporary_directory = None
+        self.pool = None
+
+    def start(self):
+        if self.pool is not None:
+            return
+        if self.work_directory is None:
+            self.temporary_directory = tempfile.mkdtemp(prefix="syschar_")
+        work_directory = self.work_directory or self.temporary_directory
+        case_path = self.model.get_case_path()
+        worker_ids = mp.Queue()
+        for i in range(self.n_workers):
+            prepare_worker_directory(os.path.join(work_directory, str(i)), case_path, self.model.get_wandabin())
+            worker_ids.put(i)
+        self.pool = mp.Pool(self.n_workers, initializer=init_syschar_worker,
+                            initargs=(worker_ids, work_directory, os.path.split(case_path)[1]))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.temporary_directory is not None:
+            shutil.rmtree(self.temporary_directory, ignore_errors=True)
+            self.temporary_directory = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def compute(self, component_name, max_flowrate, dataframe, scenario_names, number_of_points=10,
+                discharge_parameter='Discharge at t = 0 [s]', result_parameter='Head 1'):
+        """Calculates the system characteristics of a supplier for a number of flow scenarios.
+
+        :param component_name: Component who's parameter is varied for the system characteristics
+        :param max_flowrate: Maximum flow rate for the system characteristic
+        :param dataframe: Pandas dataframe with columns for the names and flowrates of the other suppliers
+        :param scenario_names: Names of the columns of the dataframe with the discharges of the scenarios
+        :param number_of_points: Number of steps in the system characteristic
+        :param discharge_parameter: the parameter in the model used for setting the discharge
+        :param result_parameter: The parameter that is used for the output
+        :return: Dataframe with the columns scenario, flow and result, one row per point
+        """
+        self.start()
+        flows = np.linspace(0, max_flowrate, number_of_points).tolist()
+        tasks = []
+        for scenario in scenario_names:
+            discharges = [('BOUNDQ ' + row['name'], row[scenario]) for i, row in dataframe.iterrows()]
+            for flow in flows:
+                tasks.append((scenario, flow, discharges + [(component_name, flow)], component_name,
+                              discharge_parameter, result_parameter))
+        print(f"Computing {len(tasks)} points for {component_name} on {self.n_workers} workers")
+        # consecutive points of a scenario go to the same worker, so the worker only changes the varied discharge
+        chunksize = max(1, min(number_of_points, len(tasks) // self.n_workers))
+        results = self.pool.map(syschar_worker, tasks, chunksize=chunksize)
+        return pd.DataFrame(results, columns=["scenario", "flow", "result"])
+
+
+def compute_syschar(model, component_name, max_flowrate, dataframe, scenario_names, number_of_points=10,
+                    n_workers=None, **kwargs):
+    """Calculates the system characteristics of a supplier on a temporary pool, see SyscharEngine.compute. Use a
+    SyscharEngine directly to share the pool between suppliers."""
+    with SyscharEngine(model, n_workers) as engine:
+        return engine.compute(component_name, max_flowrate, dataframe, scenario_names, number_of_points, **kwargs)
@@ -1,14 +1,124 @@
+import hashlib
+import os
+import pickle
+import shutil
+import time
 import numpy as np
 # import pywanda as pw
 
 
+def get_series_array(wanda_property, dtype=np.float64, apply_unit_factor=True):
+    """Returns the series of a property as a contiguous NumPy array.
+
+    :param wanda_property: Wanda property
+    :param dtype: Data type of the array, e.g. np.float32 for large exports
+    :param apply_unit_factor: Convert the series to the units of the model, the unit factor is fetched once and applied
+    in place
+    :return: 1D array with one value per time step
+    """
+    series = np.array(wanda_property.get_series(), dtype=dtype)
+    if apply_unit_factor:
+        series *= wanda_property.get_unit_factor()
+    return series
+
+
+def get_series_pipe_array(wanda_property, dtype=np.float64, apply_unit_factor=True):
+    """Returns the series of a pipe property as a contiguous NumPy array with one row per element and one column per
+    time step, see get_series_array."""
+    series = np.array(wanda_property.get_series_pipe(), dtype=dtype)
+    if apply_unit_factor:
+        series *= wanda_property.get_unit_factor()
+    return series
+
+
+def get_extreme_pipe_array(wanda_property, extreme='MAX', dtype=np.float64, apply_unit_factor=False):
+    """Returns the minimum ('MIN') or maximum ('MAX') of a pipe property along the pipe as a NumPy array, see
+    get_series_array."""
+    if extreme.upper() == 'MIN':
+        values = np.array(wanda_property.get_extr_min_pipe(), dtype=dtype)
+    else:
+        values = np.array(wanda_property.get_extr_max_pipe(), dtype=dtype)
+    if apply_unit_factor:
+        values *= wanda_property.get_unit_factor()
+    return values
+
+
+def decimate_minmax(x, y, n_bins):
+    """Reduces a series to the minimum and maximum of n_bins bins of equal length, plus the first and last point. The
+    envelope of the series, and therefore every peak, is kept exactly.
+
+    :param x: Monotonic x values
+    :param y: y values
+    :param n_bins: Number of bins, typically the width of the axis in pixels
+    :return: x[], y[] with at most 2 * n_bins + 2 points
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n_bins < 1 or n <= 2 * n_bins + 2:
+        return x, y
+    bin_size = -(-n // n_bins)
+    n_bins = -(-n // bin_size)
+    # the last bin is padded with the last value, so all bins can be reduced at once
+    bins = np.concatenate([y, np.full(n_bins * bin_size - n, y[-1])]).reshape(n_bins, bin_size)
+    offsets = np.arange(n_bins) * bin_size
+    indices = np.concatenate([[0], offsets + np.argmin(bins, axis=1), offsets + np.argmax(bins, axis=1), [n - 1]])
+    indices = np.unique(np.minimum(indices, n - 1))
+    return x[indices], y[indices]
+
+
+def decimate_lttb(x, y, n_out):
+    """Reduces a series to n_out points with the largest-triangle-three-buckets algorithm, which keeps the visual shape
+    of the series. The global minimum and maximum are always kept as well.
+
+    :param x: Monotonic x values
+    :param y: y values
+    :param n_out: Number of points, typically the width of the axis in pixels
+    :return: x[], y[] with at most n_out + 2 points
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n_out < 3 or n <= n_out:
+        return x, y
+    xf = x.astype(np.float64)
+    yf = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket, the last bucket is followed by the last point
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = xf[end:next_end].mean()
+        next_y = yf[end:next_end].mean()
+        area = np.abs((xf[selected] - next_x) * (yf[start:end] - yf[selected]) -
+                      (xf[selected] - xf[start:end]) * (next_y - yf[selected]))
+        selected = start + int(np.argmax(area))
+        indices[i + 1] = selected
+    indices = np.unique(np.concatenate([indices, [np.argmin(y), np.argmax(y)]]))
+    return x[indices], y[indices]
+
+
+DECIMATION_METHODS = {"minmax": decimate_minmax, "lttb": decimate_lttb}
+
+
+def decimate(x, y, n_pixels, method="minmax"):
+    """Reduces a series for plotting on an axis that is n_pixels wide, see decimate_minmax and decimate_lttb."""
+    if method not in DECIMATION_METHODS:
+        raise ValueError(f"Unknown decimation method '{method}', use one of {list(DECIMATION_METHODS)}")
+    return DECIMATION_METHODS[method](x, y, int(n_pixels))
+
+
 def get_min_max_pipe(pipes, property_name, scale_fac=1.0):
     """ Just a small convenience method to get both extremes at once, and scale the
     values immediately (e.g. for pressure, we scale with 1E5 typically to go
     from Pa to barg) """
 
-    tr_min_data = np.hstack([np.array(p.get_property(property_name).get_extr_min_pipe()) for p in pipes])
-    tr_max_data = np.hstack([np.array(p.get_property(property_name).get_extr_max_pipe()) for p in pipes])
+    tr_min_data = np.hstack([get_extreme_pipe_array(p.get_property(property_name), 'MIN') for p in pipes])
+    tr_max_data = np.hstack([get_extreme_pipe_array(p.get_property(property_name), 'MAX') for p in pipes])
 
     tr_min = np.min(tr_min_data)
     tr_max = np.max(tr_max_data)
@@ -27,20 +137,74 @@ def get_min_max_pipe_relative(pipes, property_name):
     values immediately (e.g. for pressure, we scale with 1E5 typically to go
     from Pa to barg)"""
 
-    tr_min_data = np.hstack([np.array(p.get_property(property_name).get_extr_min_pipe()) for p in pipes])
-    tr_max_data = np.hstack([np.array(p.get_property(property_name).get_extr_max_pipe()) for p in pipes])
+    tr_min_data = np.hstack([get_extreme_pipe_array(p.get_property(property_name), 'MIN') for p in pipes])
+    tr_max_data = np.hstack([get_extreme_pipe_array(p.get_property(property_name), 'MAX') for p in pipes])
 
     tr_min = np.min(tr_min_data)
     tr_max = np.max(tr_max_data)
 
-    ss_data = np.hstack([np.array(p.get_property(property_name).get_series_pipe())[:, 0] for p in pipes])
+    ss_data = np.hstack([get_series_pipe_array(p.get_property(property_name), apply_unit_factor=False)[:, 0]
+                         for p in pipes])
     ss_min = np.maximum(np.min(ss_data), -0.99)
     ss_max = np.max(ss_data)
 
     return (tr_max + 1) / ss_max, (tr_min + 1) / (ss_min + 1),
 
 
-def get_route_data(model, pipes, annotations, prop, times):
+class RouteGeometry:
+    """Geometry of a route: the s-locations of the output grid points and of the profile points, and the elevation
+    profile. The geometry only depends on the layout of the model, so it can be reused for every plot and every
+    scenario of a sweep."""
+
+    def __init__(self, pipe_names, annotations, n_elements, s_location, elevation, s_location_profile):
+        self.pipe_names = pipe_names
+        self.annotations = annotations
+        self.n_elements = n_elements
+        self.s_location = s_location
+        self.elevation = elevation
+        self.s_location_profile = s_location_profile
+
+    def matches(self, model):
+        """Whether the pipes of the route in the model have the discretisation of the geometry. The scenarios of a
+        sweep can change the pipes, a cached geometry is only valid when the number of elements is unchanged."""
+        return self.n_elements == [model.get_component(name).get_num_elements() for name in self.pipe_names]
+
+
+class RouteGeometryCache:
+    """Cache of route geometries, for example keyed on (model file, route keyword, direction). The cache can be
+    persisted to disk, so the geometry is only computed once for a sweep."""
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.geometries = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load()
+
+    def get(self, key):
+        return self.geometries.get(key)
+
+    def add(self, key, geometry):
+        if self.cache_file is not None and os.path.exists(self.cache_file):
+            # the geometries added by other processes since this cache was loaded are kept
+            self.load()
+        self.geometries[key] = geometry
+        if self.cache_file is not None:
+            self.save()
+
+    def load(self):
+        with open(self.cache_file, 'rb') as f:
+            self.geometries.update(pickle.load(f))
+
+    def save(self):
+        # write to a temporary file first, other processes may read the cache at the same time
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'wb') as f:
+            pickle.dump(self.geometries, f)
+        os.replace(temp_file, self.cache_file)
+
+
+def get_route_geometry(model, pipes, annotations):
     """First we get the s-locations and elevations of every grid point in the output
     Note that we also interpolate the elevations to the grid points, such that we
     can use a single source of x-axis data."""
@@ -48,18 +212,16 @@ def get_route_data(model, pipes, annotations, prop, times):
     s_locations = []
     s_location_profile = []
     elevations = []
+    n_elements = []
 
-    pipes = pipes.copy()
-    for i, p in enumerate(pipes):
-        if isinstance(p, str):
-            pipes[i] = model.get_component(p)
-
-    for p in pipes:
+    pipes = [model.get_component(p) if isinstance(p, str) else p for p in pipes]
+    for p, direction in zip(pipes, annotations):
         profile_data_s_h = np.array(p.get_property('Profile').get_table().get_float_data()[:3]).transpose()[:, -1:0:-1]
 
-        s_dist_pipe = np.linspace(profile_data_s_h[0, 0], profile_data_s_h[-1, 0], p.get_num_elements() + 1)
+        n_elements.append(p.get_num_elements())
+        s_dist_pipe = np.linspace(profile_data_s_h[0, 0], profile_data_s_h[-1, 0], n_elements[-1] + 1)
 
-        if (annotations[pipes.index(p)] == -1):
+        if (direction == -1):
             # elevations.append(np.flipud(np.interp(s_dist_pipe, profile_data_s_h[:, 0], profile_data_s_h[:, 1])))
             elevations.append(np.flipud(profile_data_s_h[:, 1]))
         else:
@@ -70,42 +232,50 @@ def get_route_data(model, pipes, annotations, prop, times):
         s_locations.append(s_dist_pipe + offset)
         s_location_profile.append(profile_data_s_h[:, 0] + offset)
 
-    s_location = np.hstack(s_locations)
-    s_location_profile = np.hstack(s_location_profile)
-    elevation = np.hstack(elevations)
+    return RouteGeometry([p.get_complete_name_spec() for p in pipes], list(annotations), n_elements,
+                         np.hstack(s_locations), np.hstack(elevations), np.hstack(s_location_profile))
+
+
+def get_route_data(model, pipes, annotations, prop, times, geometry=None):
+    """Gets the data of a property along a route for the given times (or 'min'/'max' for the envelopes). The geometry
+    of the route is computed when it is not given."""
+    if geometry is None:
+        geometry = get_route_geometry(model, pipes, annotations)
+    pipes = [model.get_component(p) if isinstance(p, str) else p for p in pipes]
 
     dt = np.average(np.diff(model.get_time_steps()))
     if np.isnan(dt):
         dt = 1.0
 
-    # check annotation and reverse data if necessary
-    data_list = []
-    for p in pipes:
-        direction = annotations[pipes.index(p)]
+    # The data is read one pipe at a time. Only the requested time columns and the envelopes are kept, so the memory
+    # scales with the route length times the number of snapshots instead of the number of time steps.
+    location_series_parts = {t: [] for t in times}
+    for p, direction in zip(pipes, annotations):
         wanda_prop = p.get_property(prop)
-        data_array = np.array(wanda_prop.get_series_pipe()) * wanda_prop.get_unit_factor()
+        # the unit factor is applied to the selection only, not to the complete series
+        data_array = get_series_pipe_array(wanda_prop, apply_unit_factor=False)
+        # check annotation and reverse data if necessary
         if (direction == -1):
-            data_list.append(np.flipud(data_array))
-        else:
-            data_list.append(data_array)
-    data = np.vstack(data_list)
-
-    output_location_series = {}
-    for t in times:
-        if isinstance(t, str) and t.lower().startswith('max'):
-            output_location_series[t] = np.max(data, axis=1)
-        elif isinstance(t, str) and t.lower().startswith('min'):
-            output_location_series[t] = np.min(data, axis=1)
-        else:
-            ind = int(round(t / dt))
-            output_location_series[t] = data[:, ind].ravel()
+            data_array = data_array[::-1]
+        unit_factor = wanda_prop.get_unit_factor()
+        for t in times:
+            if isinstance(t, str) and t.lower().startswith('max'):
+                location_series_parts[t].append(np.max(data_array, axis=1) * unit_factor)
+            elif isinstance(t, str) and t.lower().startswith('min'):
+                location_series_parts[t].append(np.min(data_array, axis=1) * unit_factor)
+            else:
+                ind = int(round(t / dt))
+                location_series_parts[t].append(data_array[:, ind] * unit_factor)
+        del data_array
+
+    output_location_series = {t: np.concatenate(parts) for t, parts in location_series_parts.items()}
 
-    return s_location, elevation, output_location_series, s_location_profile
+    return geometry.s_location, geometry.elevation, output_location_series, geometry.s_location_profile
 
 
 def get_syschar(model, dataframe, component_name, max_flowrate, scenario, number_of_points=10,
                 discharge_parameter='Discharge at t = 0 [s]',
-                result_parameter='Head 1'):
+                result_parameter='Head 1', flows=None, warm_start=None, timings=None):
     """Calculate the system characteristic for a specific supplier in a model
     :param model: Wanda model to be used for the system characteristic
     :param dataframe: Pandas dataframe with columns for the names and flowrates of the other suppliers in the network
@@ -116,6 +286,11 @@ def get_syschar(model, dataframe, component_name, max_flowrate, scenario, number
     :param discharge_parameter: the parameter in the model used for setting the discharge (default =
     'Discharge at t = 0 [s]')
     :param result_parameter: The parameter that is used for the output (default = 'Head 1')
+    :param flows: Flow rates to compute, instead of number_of_points equidistant flows between 0 and max_flowrate
+    :param warm_start: Optional function warm_start(model, previous_flow, flow), called before every steady run
+    after the first one. It can set the (engine specific) properties that make Wanda start from the previous steady
+    state instead of a cold start
+    :param timings: Optional list, a dictionary with the flow and the time spent per step is appended for every point
     :return: model_inputs[], model_outputs[]
     """
     if len(dataframe.index) > 0:
@@ -126,21 +301,140 @@ def get_syschar(model, dataframe, component_name, max_flowrate, scenario, number
             prop = comp.get_property(discharge_parameter)
             prop.set_scalar(discharge_setting)
 
-    model.save_model_input()
     target_comp = model.get_component(component_name)
     target_prop = target_comp.get_property(discharge_parameter)
     result_prop = target_comp.get_property(result_parameter)
-    model_inputs = np.linspace(0, max_flowrate, number_of_points).tolist()
+    if flows is None:
+        flows = np.linspace(0, max_flowrate, number_of_points)
+    # consecutive points are as close as possible, so every steady state is a good initial guess for the next one
+    model_inputs = np.sort(np.asarray(flows, dtype=float)).tolist()
     model_outputs = []
+    previous_flow = None
     print(f"Computing result for {component_name}...", end="", flush=True)
     for flow in model_inputs:
+        start = time.perf_counter()
         target_prop.set_scalar(flow)
+        if warm_start is not None and previous_flow is not None:
+            warm_start(model, previous_flow, flow)
+        # the input is saved once per point, the discharges of the other suppliers are saved along with it
         model.save_model_input()
+        saved = time.perf_counter()
         print(f" {flow:{2}.{6}}", end="", flush=True)
         model.run_steady()
+        steady = time.perf_counter()
         model.reload_output()
         model_outputs.append(result_prop.get_scalar_float())
+        if timings is not None:
+            timings.append({'flow': flow, 'save': saved - start, 'steady': steady - saved,
+                            'reload': time.perf_counter() - steady})
+        previous_flow = flow
     print(' Done.')
     if len(model_inputs) != len(model_outputs):
         raise Exception('Length of lists should be equal')
     return model_inputs, model_outputs
+
+
+def refine_points(evaluate, lower, upper, initial_points=5, tolerance=0.01, max_points=50):
+    """Samples a curve adaptively. The curve is evaluated at initial_points equidistant points, after which every
+    interval where the interpolation error of the straight line is larger than tolerance times the range of the curve
+    is bisected, until no interval needs refinement or max_points is reached. The interpolation error is estimated
+    from the second divided differences (the curvature) of the neighbouring points.
+
+    :param evaluate: Function that returns the values of the curve for a list of points
+    :param lower: Start of the range
+    :param upper: End of the range
+    :param initial_points: Number of points of the initial, uniform sampling (at least 3)
+    :param tolerance: Relative tolerance of the interpolation error
+    :param max_points: Maximum number of points
+    :return: points[], values[], sorted by point
+    """
+    x = np.linspace(lower, upper, max(initial_points, 3))
+    y = np.asarray(evaluate(x.tolist()), dtype=float)
+    while len(x) < max_points:
+        h = np.diff(x)
+        slopes = np.diff(y) / h
+        second = np.abs(np.diff(slopes) / (x[2:] - x[:-2]))
+        # every interval takes the largest curvature of the (up to two) triples of points it belongs to
+        curvature = np.zeros(len(h))
+        curvature[:-1] = second
+        curvature[1:] = np.maximum(curvature[1:], second)
+        error = curvature * h ** 2 / 4.0
+        scale = max(np.ptp(y), np.finfo(float).tiny)
+        refine = np.flatnonzero(error > tolerance * scale)
+        if len(refine) == 0:
+            break
+        # the intervals with the largest errors first, when not all of them fit within max_points
+        refine = refine[np.argsort(-error[refine])][:max_points - len(x)]
+        new_x = np.sort((x[refine] + x[refine + 1]) / 2.0)
+        new_y = np.asarray(evaluate(new_x.tolist()), dtype=float)
+        order = np.argsort(np.concatenate([x, new_x]), kind='stable')
+        x = np.concatenate([x, new_x])[order]
+        y = np.concatenate([y, new_y])[order]
+    return x.tolist(), y.tolist()
+
+
+def get_syschar_adaptive(model, dataframe, component_name, max_flowrate, scenario, initial_points=5, tolerance=0.01,
+                         max_points=50, **kwargs):
+    """Calculate the system characteristic for a specific supplier with adaptive refinement of the flow points, see
+    refine_points. The remaining arguments are passed on to get_syschar.
+    :return: model_inputs[], model_outputs[]
+    """
+    def evaluate(flows):
+        return get_syschar(model, dataframe, component_name, max_flowrate, scenario, flows=flows, **kwargs)[1]
+
+    return refine_points(evaluate, 0.0, max_flowrate, initial_points, tolerance, max_points)
+
+
+def syschar_to_series(syschar_data, flow_factor=1.0):
+    """Converts the dataframe of a system characteristic to dictionaries of the flows and results per scenario."""
+    flows = {}
+    results = {}
+    for scenario, group in syschar_data.groupby("scenario", sort=False):
+        flows[scenario] = (group["flow"].to_numpy() * flow_factor).tolist()
+        results[scenario] = group["result"].tolist()
+    return flows, results
+
+
+# files in the bin directory that are only read by Wanda, these are hard-linked instead of copied
+LINKED_EXTENSIONS = ('.exe', '.dll', '.pyd', '.so')
+
+
+def link_or_copy(src, dst):
+    if src.lower().endswith(LINKED_EXTENSIONS):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def get_bin_version(wanda_bin):
+    """Fingerprint of the Wanda version, based on the name, size and modification time of the files in the bin
+    directory."""
+    bin_hash = hashlib.sha256()
+    for file_name in sorted(os.listdir(wanda_bin)):
+        full_name = os.path.join(wanda_bin, file_name)
+        if os.path.isfile(full_name):
+            stat = os.stat(full_name)
+            bin_hash.update(f"{file_name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return bin_hash.hexdigest()
+
+
+def prepare_worker_directory(worker_directory, case_path, wanda_bin):
+    """Copies the case to the worker directory. The bin directory is reused when it is a copy of the same Wanda bin
+    directory and Wanda has not been updated since, otherwise it is recreated, with the executables and libraries
+    hard-linked where possible."""
+    bin_directory = os.path.join(worker_directory, "bin")
+    marker_file = os.path.join(worker_directory, "wanda_bin.txt")
+    source = os.path.abspath(wanda_bin) + "\n" + get_bin_version(wanda_bin)
+    if os.path.isfile(marker_file):
+        with open(marker_file, 'r') as f:
+            if f.read() != source:
+                shutil.rmtree(worker_directory)
+    if not os.path.isdir(bin_directory):
+        os.makedirs(worker_directory, exist_ok=True)
+        shutil.copytree(wanda_bin, bin_directory, copy_function=link_or_copy)
+        with open(marker_file, 'w') as f:
+            f.write(source)
+    shutil.copyfile(case_path, os.path.join(worker_directory, os.path.split(case_path)[1]))
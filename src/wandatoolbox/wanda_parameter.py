@@ -2,16 +2,20 @@ import shutil
 import pywanda
 import pandas as pd
 import numpy as np
-import multiprocessing as mp
 import time
-import queue
+import json
+import hashlib
+import logging
+import pickle
 import yaml
-from wanda_plot import plot, PlotTimeseries, PlotRoute
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from wandatoolbox.wanda_plot import render_pdf, PlotTimeseries, PlotRoute
+from wandatoolbox.result_store import SeriesStore, ResultWriter
+from wandatoolbox.util import RouteGeometryCache, get_route_geometry, get_series_array, get_bin_version
+from wandatoolbox.case_index import CaseIndex, build_case_index, get_case_index
 from PyPDF2 import PdfFileMerger
 import collections
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 # routine to merge all files in the input lis into the file in the output.
@@ -64,28 +68,99 @@ def parse_text_data(point_data):
     return point_data_parsed
 
 
-# routine to perform the work.
-def do_work(tasks_to_accomplish, tasks_that_are_done):
-    while True:
-        try:
-            # try to get task from the queue. get_nowait() function will
-            # raise queue.Empty exception if the queue is empty.
-            # queue(False) function would do the same task also.
-            task = tasks_to_accomplish.get_nowait()
-        except queue.Empty:
-            break
+# routine to perform the work in a worker process. The duration is returned as well, it is used to schedule the
+# longest scenarios first in the next run.
+def run_timed(scenario):
+    start = time.perf_counter()
+    result = scenario.run_scenario(render=False)
+    return result, scenario.pages, time.perf_counter() - start
+
+
+# routine to compute the content hash of a file, read in blocks to keep large models out of memory.
+def hash_file(file_name, block_size=2 ** 20):
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+# class which stores the results of finished scenarios on disk. The key is a hash of everything that determines the
+# results of a scenario, so an unchanged scenario can be skipped in a next run.
+class ScenarioResultCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_file(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def load(self, key):
+        if not os.path.exists(self.get_file(key)):
+            return None
+        with open(self.get_file(key), 'rb') as f:
+            return pickle.load(f)
+
+    def store(self, key, result):
+        # write to a temporary file first, an interrupted run should never leave a half written entry
+        temp_file = self.get_file(key) + '.tmp'
+        with open(temp_file, 'wb') as f:
+            pickle.dump({"result": result}, f)
+        os.replace(temp_file, self.get_file(key))
+
+
+# the route geometry is the same for all scenarios of a sweep. Every worker process keeps the geometries in memory and
+# they are persisted next to the result cache, so they are computed only once.
+route_geometry_caches = {}
+
+
+def get_route_geometry_cache(cache_file):
+    if cache_file not in route_geometry_caches:
+        route_geometry_caches[cache_file] = RouteGeometryCache(cache_file)
+    return route_geometry_caches[cache_file]
+
+
+# class which holds the resolved property handles of one opened model. The handles are shared by every parameter and
+# output of a scenario, so the keyword searches over the pywanda bridge are done only once per (component, property).
+# With the index of the case, the components are found without any keyword search.
+class WandaPropertyCache:
+    def __init__(self, model, case_index=None):
+        self.model = model
+        self.case_index = case_index
+        self.handles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_properties(self, parameter):
+        key = (parameter.wanda_component, parameter.wanda_property)
+        if key in self.handles:
+            self.hits += 1
         else:
-            # if no exception has been raised, add the task completion
-            # message to task_that_are_done queue
-            print(task)
-            result = task()
-            tasks_that_are_done.put(result)
-            time.sleep(0.5)
-    return
+            self.misses += 1
+            self.handles[key] = parameter.resolve_properties(self.model, self.case_index)
+        return self.handles[key]
 
+    def invalidate(self):
+        self.handles.clear()
 
-# class which holds the value for one parameter this cna be input or output
+    def reload_input(self):
+        self.model.reload_input()
+        self.invalidate()
+
+    def reload_output(self):
+        self.model.reload_output()
+        self.invalidate()
+
+    def get_statistics(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.handles)}
+
+
+# class which holds the value for one parameter this cna be input or output. The output definitions are shared by all
+# scenarios of a sweep, so the class uses slots to keep the many instances small.
 class WandaParameter:
+    __slots__ = ('wanda_component', 'wanda_property', 'value', 'output', 'result', 'fig_number', 'plot_number',
+                 'legend', 'direction')
+
     def __init__(self, wanda_component, wanda_property, value=None, output=None, fig_number=None, plot_number=None,
                  legend=None, direction=None):
         self.wanda_component = wanda_component.strip()
@@ -101,9 +176,9 @@ class WandaParameter:
         if legend == legend:
             self.legend = legend
 
-    def set_parameter(self, model):
+    def set_parameter(self, model, cache=None):
         if self.value is not None:
-            wanda_properties = self.get_properties(model)
+            wanda_properties = self.get_properties(model, cache)
             for wanda_property in wanda_properties:
                 if type(wanda_property) == pywanda.WandaProperty:
                     wanda_property.set_scalar(self.value / wanda_property.get_unit_factor())
@@ -117,8 +192,25 @@ class WandaParameter:
             return wanda_item.set_disused
         # raise Exception(self.wanda_property + " not in " + wanda_item.get_complete_name_spec())
 
-    def get_properties(self, model):
+    def get_properties(self, model, cache=None):
+        # the lookup over the pywanda bridge is expensive, so use the resolved handles of the model when available
+        if cache is not None:
+            return cache.get_properties(self)
+        return self.resolve_properties(model)
+
+    def resolve_properties(self, model, case_index=None):
         properties = []
+        if case_index is not None and self.wanda_component.lower() != 'GENERAL'.lower():
+            # the index gives the names of the items with the keyword directly, the model is only walked for items
+            # that are not in the index
+            get_item = {"component": model.get_component, "node": model.get_node,
+                        "signal_line": model.get_signal_line}
+            for kind, name in case_index.get_items(self.wanda_component):
+                prop = self.get_wanda_property(get_item[kind](name))
+                if prop is not None:
+                    properties.append(prop)
+            if properties:
+                return properties
         if self.wanda_component.lower() == 'GENERAL'.lower():
             properties.append(model.get_property(self.wanda_property))
         else:
@@ -155,45 +247,74 @@ class WandaParameter:
             raise Exception(self.wanda_property + " does not exist for " + self.wanda_component)
         return properties
 
-    def get_result_extreme(self, model):
-        if self.output is not None:
-            wanda_properties = self.get_properties(model)
-            if not wanda_properties:
-                self.result = -999.0
-            if self.output.lower() == 'Min'.lower():
-                min_val = []
-                for wanda_property in wanda_properties:
-                    min_val.append(wanda_property.get_extr_min())
-                    self.result = min(min_val) * wanda_property.get_unit_factor()
-            elif self.output.lower() == 'Max'.lower():
-                max_val = []
-                for wanda_property in wanda_properties:
-                    if not (wanda_property.is_disused()):
-                        max_val.append(wanda_property.get_extr_max())
-                    else:
-                        max_val.append(-np.inf)
-                    self.result = max(max_val) * wanda_property.get_unit_factor()
+    def get_result_extreme(self, model, cache=None):
+        if self.output is not None and self.output.lower() in ('min', 'max'):
+            self.result = get_result_extremes(model, [self], cache).iloc[0]
         return self.result
 
-    def get_series(self, model):
+    def get_series(self, model, cache=None, dtype=np.float64):
         self.result = []
         if self.output is not None:
             if self.output == "Series":
-                wanda_properties = self.get_properties(model)
+                wanda_properties = self.get_properties(model, cache)
                 for wanda_property in wanda_properties:
                     if wanda_property is not None:
-                        series = [x * wanda_property.get_unit_factor() for x in wanda_property.get_series()]
-                        self.result.append(series)
+                        self.result.append(get_series_array(wanda_property, dtype))
         return self.result
 
     def create_graphs(self, model):
-        with PdfPages('Document.pdf') as pdf:
-            plot_time = [PlotTimeseries([(self.wanda_component, self.wanda_property, self.wanda_component)],
-                                        title='test', xlabel='test2', ylabel='test2')]
-            plot(model, plot_time, title='test', case_title='case_title', case_description='case_description',
-                 proj_number='proj_number', section_name='section_name', fig_name='fig_name')
-            pdf.savefig()
-            plt.close()
+        plot_time = [PlotTimeseries([(self.wanda_component, self.wanda_property, self.wanda_component)],
+                                    title='test', xlabel='test2', ylabel='test2')]
+        fields = dict(title='test', case_title='case_title', case_description='case_description',
+                      proj_number='proj_number', section_name='section_name', fig_name='fig_name')
+        render_pdf('Document.pdf', [(plot_time, fields)], model)
+
+
+# routine to get the extremes of all Min/Max outputs at once. The extremes of all properties are gathered in one
+# array, scaled with their own unit factor and reduced per output in a single pass. Disused properties are masked.
+# The result is one row with the (component, property, kind) of the outputs as index.
+def get_result_extremes(model, outputs, cache=None):
+    outputs = [output for output in outputs if output.output is not None and output.output.lower() in ('min', 'max')]
+    if not outputs:
+        return pd.Series([], dtype=float)
+    index = pd.MultiIndex.from_tuples([(output.wanda_component, output.wanda_property, output.output)
+                                       for output in outputs])
+    is_min = np.array([output.output.lower() == 'min' for output in outputs])
+    values = []
+    unit_factors = []
+    disused = []
+    counts = []
+    for output, output_is_min in zip(outputs, is_min):
+        wanda_properties = output.get_properties(model, cache)
+        for wanda_property in wanda_properties:
+            values.append(wanda_property.get_extr_min() if output_is_min else wanda_property.get_extr_max())
+            unit_factors.append(wanda_property.get_unit_factor())
+            disused.append(wanda_property.is_disused())
+        counts.append(len(wanda_properties))
+    values = np.array(values, dtype=np.float64) * np.array(unit_factors, dtype=np.float64)
+    property_is_min = np.repeat(is_min, counts)
+    disused = np.array(disused, dtype=bool)
+    values[disused] = np.where(property_is_min[disused], np.inf, -np.inf)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    extremes = np.where(is_min, np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))
+    return pd.Series(extremes, index=index)
+
+
+# routine to get a value of the cache key of a scenario that json can not serialize
+def get_key_value(value):
+    if hasattr(value, '__dict__'):
+        return value.__dict__
+    return str(value)
+
+
+# routine to get the figure settings or route texts (by figure and plot number) as part of the cache key. The plot
+# numbers read from the workbook are NumPy integers, which json does not accept as keys, so the entries are listed
+# with the numbers as text.
+def get_figure_key(figure_data):
+    if not figure_data:
+        return []
+    return sorted(([str(fig), str(plot), data] for fig, plots in figure_data.items() for plot, data in plots.items()),
+                  key=lambda entry: entry[:2])
 
 
 # simple class to store some figure data
@@ -211,78 +332,197 @@ class FigureDate:
 class WandaScenario:
     def __init__(self, model, wanda_bin, name, figure_data, plot_data, text_data, only_figure=False):
         self.name = name
+        self.base_model = model
         self.model_file = model[:-4] + "_" + name + ".wdi"
         self.model_dir = os.path.split(model)[0]
         self.only_figures = only_figure
         if not (os.path.exists(self.model_dir + '\\figures\\')):
             os.mkdir(self.model_dir + '\\figures\\')
-        if not self.only_figures:
-            shutil.copyfile(model, self.model_file)
         self.bin = wanda_bin
         self.parameters = []
         self.output = []
         self.figure_data = figure_data
         self.plot_data = plot_data
         self.text_data = text_data
+        number = int(self.plot_data["Case number"])
+        self.pdf_file = self.model_dir + '\\figures\\' + self.plot_data["Appendix"] + "_" + f"{number:03}" + '.pdf'
+        self.result_cache = None
+        self.cache_key = None
+        # the case whose index is used to look up the properties, the scenarios share the index of the base model
+        self.case_index_file = None
+        self.series_store = None
+        self.series_dtype = np.float64
+        # decimation of the series in the figures, see PlotObject
+        self.decimate = None
+        self.pages = None
+        # key of the shared output definitions in shared_outputs, None when the scenario has its own outputs
+        self.outputs_key = None
+        # the series of this scenario, by index of the output
+        self.series = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # shared output definitions are not pickled with every scenario, the worker processes already have them
+        if self.outputs_key is not None:
+            state['output'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.output is None:
+            self.output = shared_outputs[self.outputs_key]
+
+    def set_shared_outputs(self, outputs_key, outputs):
+        register_outputs(outputs_key, outputs)
+        self.outputs_key = outputs_key
+        self.output = outputs
 
     def add_parameter(self, component_name, property_name, value):
         self.parameters.append(WandaParameter(component_name, property_name, value=value))
 
     def add_output(self, component_name, property_name, kind, fig_number=None, plot_number=None, legend=None,
                    direction=None):
-        self.output.append(WandaParameter(component_name, property_name, output=kind, fig_number=fig_number,
-                                          plot_number=plot_number, legend=legend, direction=direction))
-
-    def run_scenario(self):
+        # the scenario gets its own list of outputs, the shared outputs are never changed
+        self.output = list(self.output) + [WandaParameter(component_name, property_name, output=kind,
+                                                          fig_number=fig_number, plot_number=plot_number,
+                                                          legend=legend, direction=direction)]
+        self.outputs_key = None
+
+    def get_cache_key(self, model_hash, bin_version):
+        key_data = [model_hash, bin_version,
+                    [(p.wanda_component, p.wanda_property, p.value) for p in self.parameters],
+                    [(o.wanda_component, o.wanda_property, o.output, o.fig_number, o.plot_number, o.legend,
+                      o.direction) for o in self.output],
+                    self.plot_data, get_figure_key(self.figure_data), get_figure_key(self.text_data), self.decimate]
+        return hashlib.sha256(json.dumps(key_data, default=get_key_value).encode()).hexdigest()
+
+    def get_key_file(self):
+        return self.pdf_file + '.key'
+
+    def write_pdf_key(self):
+        # the key of the scenario is stored next to its pdf file once the pdf is rendered, so a pdf of an older version
+        # of the scenario is never taken for the current one
+        if self.cache_key is None:
+            return
+        temp_file = self.get_key_file() + '.tmp'
+        with open(temp_file, 'w') as f:
+            f.write(self.cache_key)
+        os.replace(temp_file, self.get_key_file())
+
+    def has_current_pdf(self):
+        if not (os.path.exists(self.pdf_file) and os.path.exists(self.get_key_file())):
+            return False
+        with open(self.get_key_file(), 'r') as f:
+            return f.read() == self.cache_key
+
+    def load_cached_result(self):
+        # the figures and series are part of the result, so a scenario without its current pdf file or series has to
+        # run again
+        if self.result_cache is None or not self.has_current_pdf():
+            return None
+        if self.series_store is not None and self.has_series() and not self.series_store.contains(self.name):
+            return None
+        cached = self.result_cache.load(self.cache_key)
+        if cached is None:
+            return None
+        return cached["result"]
+
+    def has_series(self):
+        return any(output.output == "Series" for output in self.output)
+
+    def get_series_columns(self):
+        columns = {}
+        for index, series_list in self.series.items():
+            if series_list:
+                output = self.output[index]
+                # the index of the output keeps the names unique, several outputs can have the same property
+                name = output.wanda_component + "|" + output.wanda_property + "|" + str(index)
+                for i, series in enumerate(series_list):
+                    columns[name if len(series_list) == 1 else f"{name}|{i}"] = series
+        return columns
+
+    def run_scenario(self, render=True):
+        if not self.only_figures:
+            shutil.copyfile(self.base_model, self.model_file)
         model = pywanda.WandaModel(self.model_file, self.bin)
+        case_index = get_case_index(self.case_index_file) if self.case_index_file is not None else None
+        cache = WandaPropertyCache(model, case_index)
         if self.only_figures:
-            model.reload_output()
+            cache.reload_output()
         else:
             for parameter in self.parameters:
-                parameter.set_parameter(model)
+                parameter.set_parameter(model, cache)
             model.save_model_input()
             model.run_steady()
             model.run_unsteady()
-        result = self.get_results(model)
-        self.create_graphs(model)
+        result = self.get_results(model, cache)
+        self.pages = self.get_pages(model)
+        stats = cache.get_statistics()
+        logging.getLogger(__name__).debug(f"{self.name}: property cache {stats['hits']} hits, {stats['misses']} misses")
+        if self.series_store is not None and self.has_series():
+            self.series_store.write(self.name, model.get_time_steps(), self.get_series_columns())
+            # the series are on disk now, there is no need to keep them in memory or send them back
+            self.series = {}
         model.close()
+        if self.result_cache is not None:
+            self.result_cache.store(self.cache_key, result)
+        if render:
+            render_pdf(self.pdf_file, self.pages)
+            self.write_pdf_key()
         return result
 
-    def get_results(self, model):
-        results = [self.name]
-        for output in self.output:
-            if output.output == "Route":
-                continue
-            result = output.get_result_extreme(model)
-            if result is not None:
-                results.append(result)
-            output.get_series(model)
+    def get_results(self, model, cache=None):
+        if cache is None:
+            cache = WandaPropertyCache(model)
+        extremes = get_result_extremes(model, self.output, cache)
+        results = [self.name] + extremes.tolist()
+        # the series are kept per scenario, the output definitions are shared
+        self.series = {}
+        for index, output in enumerate(self.output):
+            if output.output == "Series":
+                self.series[index] = [get_series_array(wanda_property, self.series_dtype)
+                                      for wanda_property in output.get_properties(model, cache)
+                                      if wanda_property is not None]
         return results
 
     def create_graphs(self, model):
+        render_pdf(self.pdf_file, self.get_pages(model))
+
+    def get_route_geometry(self, model, output):
+        comps, directions = model.get_route(output.wanda_component)
+        if sum(directions) < 0:
+            # flip direction
+            comps.reverse()
+            directions.reverse()
+            directions = [-1 * x for x in directions]
+        if output.direction == -1:
+            # flip direction
+            comps.reverse()
+            directions.reverse()
+            directions = [-1 * x for x in directions]
+        pipes = []
+        pipes_dir = []
+        for p, direction in zip(comps, directions):
+            if p.is_pipe():
+                pipes.append(p)
+                pipes_dir.append(direction)
+        return get_route_geometry(model, pipes, pipes_dir)
+
+    def get_pages(self, model):
         figures = {}
         for output in self.output:
             if output.output == "Series":
                 tuple_data = (output.wanda_component, output.wanda_property, output.legend)
             elif output.output == "Route":
-                comps, directions = model.get_route(output.wanda_component)
-                if sum(directions) < 0:
-                    # flip direction
-                    comps.reverse()
-                    directions.reverse()
-                    directions = [-1 * x for x in directions]
-                if output.direction == -1:
-                    # flip direction
-                    comps.reverse()
-                    directions.reverse()
-                    directions = [-1 * x for x in directions]
-                pipes = []
-                pipes_dir = []
-                for p, direction in zip(comps, directions):
-                    if p.is_pipe():
-                        pipes.append(p)
-                        pipes_dir.append(direction)
-                tuple_data = (pipes, pipes_dir, output.wanda_property)
+                geometry_cache = get_route_geometry_cache(os.path.join(self.model_dir, 'cache', 'route_geometry.pkl'))
+                geometry_key = (self.base_model, os.stat(self.base_model).st_mtime_ns, output.wanda_component,
+                                output.direction)
+                geometry = geometry_cache.get(geometry_key)
+                # a scenario can change the discretisation of the pipes, then the geometry is computed again
+                if geometry is None or not geometry.matches(model):
+                    geometry = self.get_route_geometry(model, output)
+                    geometry_cache.add(geometry_key, geometry)
+                tuple_data = (geometry.pipe_names, geometry.annotations, output.wanda_property, geometry)
             else:
                 continue
             if output.fig_number in figures:
@@ -294,50 +534,131 @@ class WandaScenario:
                 figures[output.fig_number] = {output.plot_number: [tuple_data]}
         # creation of plot object and then plotting
         number = int(self.plot_data["Case number"])
-        pdf_file = self.model_dir + '\\figures\\' + self.plot_data["Appendix"] + "_" + f"{number:03}" + '.pdf'
         order_figures = collections.OrderedDict(sorted(figures.items()))
-        with PdfPages(pdf_file) as pdf:
-            for figure in order_figures.keys():
-                plot_figures = []
-                for plotter in figures[figure].keys():
-                    if self.figure_data[figure][plotter].times:
-                        text_data = []
-                        if figure in self.text_data:
-                            if plotter in self.text_data[figure]:
-                                text_data = self.text_data[figure][plotter]
-                        plot_figures.append(PlotRoute(figures[figure][plotter][0][0], figures[figure][plotter][0][1],
-                                                      figures[figure][plotter][0][2],
-                                                      self.figure_data[figure][plotter].times,
-                                                      title=self.figure_data[figure][plotter].title,
-                                                      xlabel=self.figure_data[figure][plotter].x_label,
-                                                      ylabel=self.figure_data[figure][plotter].y_label,
-                                                      plot_elevation=figures[figure][plotter][0][2].lower() == 'head',
-                                                      plot_text=text_data))
-                    else:
-                        plot_figures.append(PlotTimeseries(figures[figure][plotter],
-                                                           title=self.figure_data[figure][plotter].title,
-                                                           xlabel=self.figure_data[figure][plotter].x_label,
-                                                           ylabel=self.figure_data[figure][plotter].y_label))
-                date = None
-                if "Date" in self.plot_data:
-                    date = self.plot_data["Date"]
-                plot(model, plot_figures,
-                     title=self.plot_data["Description"],
-                     case_title=self.plot_data["Case description"],
-                     case_description=self.plot_data["Extra description"],
-                     proj_number=self.plot_data["Project number"],
-                     section_name='Chapter ' + str(self.plot_data["Chapter"]),
-                     date=date,
-                     # fig_name='Fig ' + self.plot_data["Appendix"] + '.' + f"{number:03}" + figure)
-                     fig_name=self.plot_data["Appendix"] + '.' + f"{number:03}" + figure)
-                pdf.savefig()
-                plt.close()
+        pages = []
+        for figure in order_figures.keys():
+            plot_figures = []
+            for plotter in figures[figure].keys():
+                if self.figure_data[figure][plotter].times:
+                    text_data = []
+                    if figure in self.text_data:
+                        if plotter in self.text_data[figure]:
+                            text_data = self.text_data[figure][plotter]
+                    plot_figures.append(PlotRoute(figures[figure][plotter][0][0], figures[figure][plotter][0][1],
+                                                  figures[figure][plotter][0][2],
+                                                  self.figure_data[figure][plotter].times,
+                                                  title=self.figure_data[figure][plotter].title,
+                                                  xlabel=self.figure_data[figure][plotter].x_label,
+                                                  ylabel=self.figure_data[figure][plotter].y_label,
+                                                  plot_elevation=figures[figure][plotter][0][2].lower() == 'head',
+                                                  plot_text=text_data, geometry=figures[figure][plotter][0][3],
+                                                  decimate=self.decimate))
+                else:
+                    plot_figures.append(PlotTimeseries(figures[figure][plotter],
+                                                       title=self.figure_data[figure][plotter].title,
+                                                       xlabel=self.figure_data[figure][plotter].x_label,
+                                                       ylabel=self.figure_data[figure][plotter].y_label,
+                                                       decimate=self.decimate))
+            # read the data from the model now, the pages are rendered after the model has been closed
+            for plot_figure in plot_figures:
+                plot_figure.extract(model)
+            date = None
+            if "Date" in self.plot_data:
+                date = self.plot_data["Date"]
+            pages.append((plot_figures, dict(title=self.plot_data["Description"],
+                                             case_title=self.plot_data["Case description"],
+                                             case_description=self.plot_data["Extra description"],
+                                             proj_number=self.plot_data["Project number"],
+                                             section_name='Chapter ' + str(self.plot_data["Chapter"]),
+                                             date=date,
+                                             # fig_name='Fig ' + self.plot_data["Appendix"] + '.' + f"{number:03}" +
+                                             # figure)
+                                             fig_name=self.plot_data["Appendix"] + '.' + f"{number:03}" + figure)))
+        return pages
+
+
+# the output definitions shared by the scenarios of a sweep, by key. The scenarios do not pickle them, the worker
+# processes get them once from the pool initializer.
+shared_outputs = {}
+
+
+def register_outputs(outputs_key, outputs):
+    shared_outputs[outputs_key] = outputs
+
+
+# class which holds the compiled scenario plan of a parameter workbook: the figures, the output definitions shared by
+# all scenarios and the name, plot data and parameters of every included case. The plan only depends on the workbook,
+# so it is cached by the hash of the workbook.
+class ScenarioPlan:
+    # version of the plan layout, a cached plan of another version is compiled again
+    version = 2
+
+    def __init__(self, figures, text_data, outputs, output_columns, cases):
+        self.figures = figures
+        self.text_data = text_data
+        self.outputs = outputs
+        self.output_columns = output_columns
+        self.cases = cases
+
+
+# routine to compile the scenario plan of a workbook. Every sheet is parsed from the same opened workbook and the
+# included cases are selected with vectorized masks.
+def compile_plan(excel_file):
+    with pd.ExcelFile(excel_file) as workbook:
+        cases = workbook.parse("Cases", header=None)
+        output = workbook.parse("Output")
+        series = workbook.parse('Tplots')
+        routes = workbook.parse("Rplots")
+        route_points = workbook.parse("route_points")
+    # the first row holds the column names, the parameter columns can share a component name so they are kept as is
+    input_data = cases.iloc[1:].reset_index(drop=True).infer_objects()
+    input_data.columns = cases.iloc[0].values
+    figures = parse_figures(series)
+    figures.update(parse_figures(routes))
+    if route_points.empty:
+        text_data = []
+    else:
+        text_data = parse_text_data(route_points)
+
+    # the output definitions are the same for all scenarios
+    output_columns = [(row[0], row[1], row[2]) for row in output.values]
+    outputs = [WandaParameter(comp, prop, output=kind) for comp, prop, kind in output_columns]
+    for comp, prop, fig_number, plot_number, legend in zip(series['name'], series['property'], series['fig'],
+                                                           series['plot'], series['Legend']):
+        outputs.append(WandaParameter(comp, prop, output='Series', fig_number=fig_number, plot_number=plot_number,
+                                      legend=legend))
+    directions = routes['Direction'] if 'Direction' in routes else np.ones(len(routes['name'])).tolist()
+    for comp, prop, fig_number, plot_number, legend, direction in zip(routes['name'], routes['property'],
+                                                                      routes['fig'], routes['plot'],
+                                                                      routes['Legend'], directions):
+        outputs.append(WandaParameter(comp, prop, output='Route', fig_number=fig_number, plot_number=plot_number,
+                                      legend=legend, direction=direction))
+
+    # a row is used when it has a number and is included
+    numbers = pd.to_numeric(input_data['Number'], errors='coerce')
+    rows = np.flatnonzero(numbers.notna().to_numpy() & (input_data['Include'] == 1).to_numpy())
+    column_start = input_data.columns.get_loc("Name") + 1
+    components = input_data.columns[column_start:]
+    parameter_values = input_data.iloc[:, column_start:].to_numpy(dtype=object)
+    properties = parameter_values[0]
+    meta = {column: input_data[column].to_numpy(dtype=object)
+            for column in ["Name", "Number", "Include", "Description", "Extra", "Appendix", "Chapter", "Date"]}
+    plan_cases = []
+    for i in rows:
+        plot_data = {"Description": meta["Description"][0], "Project number": meta["Include"][0],
+                     "Case description": meta["Description"][i], "Extra description": meta["Extra"][i],
+                     "Appendix": meta["Appendix"][i], "Chapter": meta["Chapter"][i],
+                     "Case number": meta["Number"][i], "Date": meta["Date"][i]}
+        parameters = list(zip(components, properties, parameter_values[i]))
+        plan_cases.append((meta["Name"][i], plot_data, parameters))
+    return ScenarioPlan(figures, text_data, tuple(outputs), output_columns, plan_cases)
 
 
 # class which holds all scenarios for scenario run can be used to run the case in parallel adn get the output.
 # Plotting is also possible
 class WandaParameterScript:
-    def __init__(self, wanda_model, wanda_bin, excel_file, only_figures=False):
+    def __init__(self, wanda_model, wanda_bin, excel_file, only_figures=False, use_cache=True,
+                 series_dtype=np.float64, use_index=False, decimate=None):
         self.wanda_model = wanda_model
         self.model_dir = os.path.split(wanda_model)[0]
         self.wanda_bin = wanda_bin
@@ -348,96 +669,186 @@ class WandaParameterScript:
         self.output_value = []
         self.appendix = {}
         self.output_filled = False
+        self.outputs_key = None
+        # the summary results, one preallocated row per scenario and one column per min/max output
+        self.results = None
         self.only_figures = only_figures
+        self.duration_file = wanda_model[:-4] + "_durations.json"
+        self.result_cache = None
+        self.use_cache = use_cache
+        if use_cache and not only_figures:
+            self.result_cache = ScenarioResultCache(os.path.join(self.model_dir, 'cache'))
+        self.series_store = SeriesStore(wanda_model[:-4] + "_series")
+        # np.float32 halves the size of the series store for large sweeps
+        self.series_dtype = series_dtype
+        # building the index walks every property of the base model once, it pays off for large models only
+        self.use_index = use_index
+        # 'minmax' or 'lttb' decimates the long series of the figures to the resolution of the page, see PlotObject
+        self.decimate = decimate
+
+    def get_plan_file(self, workbook_hash):
+        return os.path.join(self.model_dir, 'cache', f"plan_v{ScenarioPlan.version}_{workbook_hash}.pkl")
+
+    def load_plan(self):
+        # the compiled plan is reused as long as the workbook does not change, the hash of the workbook is also the key
+        # of the shared output definitions
+        self.outputs_key = hash_file(self.excel_file)
+        plan_file = self.get_plan_file(self.outputs_key) if self.use_cache else None
+        if plan_file is not None and os.path.exists(plan_file):
+            with open(plan_file, 'rb') as f:
+                return pickle.load(f)
+        plan = compile_plan(self.excel_file)
+        if plan_file is not None:
+            os.makedirs(os.path.dirname(plan_file), exist_ok=True)
+            temp_file = plan_file + '.tmp'
+            with open(temp_file, 'wb') as f:
+                pickle.dump(plan, f)
+            os.replace(temp_file, plan_file)
+        return plan
 
     def parse_excel_file(self):
-        cols = pd.read_excel(self.excel_file, "Cases", header=None, nrows=1).values[0]
-        input_data = pd.read_excel(self.excel_file, "Cases", header=None, skiprows=1)
-        input_data.columns = cols
-        output = pd.read_excel(self.excel_file, "Output")
-        series = pd.read_excel(self.excel_file, 'Tplots')
-        routes = pd.read_excel(self.excel_file, "Rplots")
-        route_points = pd.read_excel(self.excel_file, "route_points")
-        figures = parse_figures(series)
-        figures.update(parse_figures(routes))
-        if route_points.empty:
-            text_data = []
-        else:
-            text_data = parse_text_data(route_points)
-        column_start = input_data.columns.get_loc("Name") + 1
-        for i in range(len(input_data.values)):
-            # check if there number is a Nan, this means the row is not used and should be skipped.
-            if input_data['Number'][i] != input_data['Number'][i]:
-                continue
-            # checking if the row is included or not
-            if input_data['Include'][i] != 1:
-                continue
-            directions = np.ones(len(routes['name'])).tolist()
-            if 'Direction' in routes:
-                directions = routes['Direction']
-
-            number = int(input_data['Number'][i])
-            pdf_file = self.model_dir + '\\figures\\' + input_data['Appendix'][i] + "_" + f"{number:03}" + '.pdf'
-            if input_data['Appendix'][i] in self.appendix:
-                self.appendix[input_data['Appendix'][i]].append(pdf_file)
-            else:
-                self.appendix[input_data['Appendix'][i]] = [pdf_file]
-            plot_data = {"Description": input_data["Description"][0], "Project number": input_data["Include"][0],
-                         "Case description": input_data["Description"][i], "Extra description": input_data["Extra"][i],
-                         "Appendix": input_data["Appendix"][i], "Chapter": input_data["Chapter"][i],
-                         "Case number": input_data["Number"][i], "Date": input_data["Date"][i]}
-            self.scenarios.append(WandaScenario(self.wanda_model, self.wanda_bin, input_data['Name'][i],
-                                                figures, plot_data, text_data, self.only_figures))
+        plan = self.load_plan()
+        if not self.output_filled:
+            for component, prop, value in plan.output_columns:
+                self.output_component.append(component)
+                self.output_properties.append(prop)
+                self.output_value.append(value)
+        for name, plot_data, parameters in plan.cases:
+            # the name is part of the paths of the scenario, check it before anything is run
+            self.series_store.check_name(name)
+            number = int(plot_data["Case number"])
+            pdf_file = self.model_dir + '\\figures\\' + plot_data["Appendix"] + "_" + f"{number:03}" + '.pdf'
+            self.appendix.setdefault(plot_data["Appendix"], []).append(pdf_file)
+            scenario = WandaScenario(self.wanda_model, self.wanda_bin, name, plan.figures, plot_data, plan.text_data,
+                                     self.only_figures)
             # looping over all parameters and adding them to the scenario
-            for j in range(column_start, len(input_data.axes[1])):
-                self.scenarios[-1].add_parameter(input_data.axes[1][j], input_data.iloc[0][j],
-                                                 input_data.iloc[i][j])
-            for j in range(0, len(output.values)):
-                if not self.output_filled:
-                    self.output_component.append(output.values[j][0])
-                    self.output_properties.append(output.values[j][1])
-                    self.output_value.append(output.values[j][2])
-                self.scenarios[-1].add_output(output.values[j][0], output.values[j][1], output.values[j][2])
-            for comp, prop, fig_number, plot_number, legend in zip(series['name'], series['property'],
-                                                                   series['fig'], series['plot'], series['Legend']):
-                self.scenarios[-1].add_output(comp, prop, 'Series', fig_number, plot_number, legend)
-            for comp, prop, fig_number, plot_number, legend, direction in zip(routes['name'], routes['property'],
-                                                                              routes['fig'], routes['plot'],
-                                                                              routes['Legend'],
-                                                                              directions):
-                self.scenarios[-1].add_output(comp, prop, 'Route', fig_number, plot_number, legend, direction=direction)
-            self.output_filled = True
-
-    def run_scenarios(self, n_workers):
-        number_of_processes = n_workers
-        tasks_to_accomplish = mp.Queue()
-        tasks_that_are_done = mp.Queue()
-        processes = []
+            for component, prop, value in parameters:
+                scenario.add_parameter(component, prop, value)
+            # the output definitions are shared by all scenarios
+            scenario.set_shared_outputs(self.outputs_key, plan.outputs)
+            self.scenarios.append(scenario)
+        self.output_filled = True
+
+    def prepare_case_index(self):
+        # the index of the base model is built once and reused as long as the model does not change, the scenarios
+        # have the same components and keywords as the base model. The index only speeds up the lookups, when it can
+        # not be built the properties are found with the keyword search.
+        if CaseIndex.load(self.wanda_model) is None:
+            try:
+                model = pywanda.WandaModel(self.wanda_model, self.wanda_bin)
+                try:
+                    build_case_index(model, self.wanda_model)
+                finally:
+                    model.close()
+            except Exception as inst:
+                print("Error in building the index of " + self.wanda_model + ", the keyword search is used")
+                print(inst)
+                return
+        for scenario in self.scenarios:
+            scenario.case_index_file = self.wanda_model
+
+    def load_durations(self):
+        if not os.path.exists(self.duration_file):
+            return {}
+        with open(self.duration_file, 'r') as f:
+            return json.load(f)
+
+    def save_durations(self, durations):
+        with open(self.duration_file, 'w') as f:
+            json.dump(durations, f, indent=2)
+
+    def run_scenarios(self, n_workers, n_render_workers=None):
+        if n_render_workers is None:
+            n_render_workers = n_workers
+        durations = self.load_durations()
+        # longest expected scenario first, scenarios that did not run before are assumed to be the longest
+        default_duration = max(durations.values()) if durations else 0.0
+        order = sorted(range(len(self.scenarios)),
+                       key=lambda i: durations.get(self.scenarios[i].name, default_duration), reverse=True)
+        writer = self.get_result_writer()
+        writer.start()
+        n_extremes = sum(str(kind).lower() in ('min', 'max') for kind in self.output_value)
+        self.results = np.full((len(self.scenarios), n_extremes), np.nan)
         for scenario in self.scenarios:
-            tasks_to_accomplish.put(scenario.run_scenario)
-        # creating processes
-        for w in range(number_of_processes + 1):
-            p = mp.Process(target=do_work, args=(tasks_to_accomplish, tasks_that_are_done))
-            processes.append(p)
-            p.start()
-        # completing process
-        print("waiting for processes to finish")
-        for p in processes:
-            p.join()
-        # print the output
-        result = []
-        while not tasks_that_are_done.empty():
-            res = tasks_that_are_done.get()
-            result.append(res)
-        self.output_component.insert(0, "Scenario")
-        self.output_properties.insert(0, "Name")
-        self.output_value.insert(0, " ")
-        columns = pd.MultiIndex.from_tuples(zip(self.output_component, self.output_properties, self.output_value))
-        frame = pd.DataFrame(result, columns=columns)
-        frame.to_excel(self.wanda_model[:-3] + "xlsx")
-        # combine pdfs into ond pdf.
+            scenario.series_store = self.series_store
+            scenario.series_dtype = self.series_dtype
+            scenario.decimate = self.decimate
+        if self.use_index:
+            self.prepare_case_index()
+        # the pdf files of this run, rendered or taken from the cache, only those are merged into the appendices
+        current_pdfs = set()
+        if self.result_cache is not None:
+            model_hash = hash_file(self.wanda_model)
+            bin_version = get_bin_version(self.wanda_bin)
+            n_cached = 0
+            for i, scenario in enumerate(self.scenarios):
+                scenario.result_cache = self.result_cache
+                scenario.cache_key = scenario.get_cache_key(model_hash, bin_version)
+                cached_result = scenario.load_cached_result()
+                if cached_result is not None:
+                    self.results[i] = cached_result[1:]
+                    writer.append(int(scenario.plot_data["Case number"]), cached_result)
+                    order.remove(i)
+                    current_pdfs.add(scenario.pdf_file)
+                    n_cached += 1
+            print(f"{n_cached} of {len(self.scenarios)} scenarios are unchanged, results are taken from the cache")
+        # the simulation workers only extract the data of the figures, the pages are rendered by a separate pool so
+        # the simulation workers (and their Wanda license) are free for the next scenario. The pages are rendered
+        # headless, without pyplot, so the render workers share no global figure state.
+        with ProcessPoolExecutor(max_workers=n_render_workers) as render_executor:
+            # the shared output definitions are sent to every worker once, instead of with every scenario
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=register_outputs,
+                                     initargs=(self.outputs_key, shared_outputs.get(self.outputs_key))) as executor:
+                futures = {executor.submit(run_timed, self.scenarios[i]): i for i in order}
+                render_futures = {}
+                for n_done, future in enumerate(as_completed(futures), start=1):
+                    scenario = self.scenarios[futures[future]]
+                    try:
+                        result, pages, durations[scenario.name] = future.result()
+                    except Exception as inst:
+                        print("Error in running scenario " + scenario.name)
+                        print(inst)
+                        continue
+                    render_futures[render_executor.submit(render_pdf, scenario.pdf_file, pages)] = scenario
+                    self.results[futures[future]] = result[1:]
+                    # the row is on disk right away, so the summary survives an interrupted run
+                    writer.append(int(scenario.plot_data["Case number"]), result)
+                    print(f"{scenario.name} finished in {durations[scenario.name]:.1f} s ({n_done}/{len(futures)})")
+            for future in as_completed(render_futures):
+                try:
+                    future.result()
+                except Exception as inst:
+                    print("Error in rendering figures of scenario " + render_futures[future].name)
+                    print(inst)
+                    continue
+                render_futures[future].write_pdf_key()
+                current_pdfs.add(render_futures[future].pdf_file)
+        self.save_durations(durations)
+        self.write_summary()
+        self.merge_appendices(current_pdfs)
+
+    def merge_appendices(self, current_pdfs):
+        # combine the pdfs of every appendix into one pdf. The pdfs of failed scenarios are left out, an older pdf of
+        # such a scenario does not match the results.
         for appendix in self.appendix:
-            merge_pdf(self.appendix[appendix], self.model_dir + '\\figures\\' + appendix + '.pdf')
+            pdf_files = [pdf_file for pdf_file in self.appendix[appendix] if pdf_file in current_pdfs]
+            missing = [pdf_file for pdf_file in self.appendix[appendix] if pdf_file not in current_pdfs]
+            if missing:
+                print("Appendix " + appendix + " is incomplete, the figures of these scenarios are missing:")
+                for pdf_file in missing:
+                    print("    " + pdf_file)
+            if pdf_files:
+                merge_pdf(pdf_files, self.model_dir + '\\figures\\' + appendix + '.pdf')
+
+    def get_result_writer(self):
+        columns = [("Scenario", "Name", " ")]
+        columns += zip(self.output_component, self.output_properties, self.output_value)
+        return ResultWriter(self.wanda_model[:-4] + "_results.csv", columns)
+
+    def write_summary(self):
+        # (re)creates the summary workbook from the rows of the last run, ordered by case number. This also works for
+        # the rows of an interrupted run.
+        self.get_result_writer().write_excel(self.wanda_model[:-3] + "xlsx")
 
 
 def main(scenario, only_output):
@@ -1,102 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import functools
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
 from typing import List, Tuple
+import matplotlib.image
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
 import numpy as np
 
-from .util import get_route_data, get_syschar
+from .util import decimate, get_route_data, get_series_array, get_syschar, get_syschar_adaptive, syschar_to_series
 
 
-def plot_7box(figure, title, case_title, case_description, proj_number, section_name, fig_name,
-              company_name="Deltares", software_version="Wanda 4.6", company_image=None, date=None,
-              fontsize=8):
-    """
-    Creates box around and in the plot window. Also fills in some info about the calculation.
-    Based on the 7-box WL-layout.
-    """
+# Locations of the vertical (v) and horizontal (h) lines of the 7-box layout, in figure coordinates
+XO = 0.04
+YO = 0.03
+TEXTBOX_HEIGHT = 0.75
+V0 = 0.0 + XO
+V1 = 0.62 + XO
+V2 = 0.81
+V3 = 1.0 - XO
+H0 = 0.0 + YO
+H1 = 1.2 * TEXTBOX_HEIGHT / 29.7 + YO
+H2 = 2.4 * TEXTBOX_HEIGHT / 29.7 + YO
+H3 = 3.6 * TEXTBOX_HEIGHT / 29.7 + YO
+
+# A4 portrait, in inches
+PAGE_SIZE = (8.27, 11.69)
 
-    # Define locations of vertical and horizontal lines
-    xo = 0.04
-    yo = 0.03
-    textbox_height = 0.75
 
-    v0 = 0.0 + xo
-    v1 = 0.62 + xo
-    v2 = 0.81
-    v3 = 1.0 - xo
+@functools.lru_cache(maxsize=None)
+def get_company_logo():
+    """Returns the decoded Deltares logo, the image is read from disk only once per process."""
+    module_dir, module_filename = os.path.split(__file__)
+    return matplotlib.image.imread(os.path.join(module_dir, "image_data", "Deltares_logo.png"))
 
-    h0 = 0.0 + yo
-    h1 = 1.2 * textbox_height / 29.7 + yo
-    h2 = 2.4 * textbox_height / 29.7 + yo
-    h3 = 3.6 * textbox_height / 29.7 + yo
 
-    ax = plt.axes([0, 0, 1, 1], facecolor=(1, 1, 1, 0))
+def draw_7box_frame(figure, company_image=None, fontsize=8):
+    """
+    Draws the static part of the 7-box layout: the lines, the border and the logo. The texts are created empty.
+    :return: Dictionary with the text artists by name and the logo image artist
+    """
+    ax = figure.add_axes([0, 0, 1, 1], facecolor=(1, 1, 1, 0))
+    # the frame is drawn on top of the subplots, as if it was created after them
+    ax.set_zorder(1)
 
     ax.get_xaxis().set_visible(False)
     ax.get_yaxis().set_visible(False)
 
-    l1 = ax.axhline(y=h3, xmin=v0, xmax=v3, linewidth=1.5, color='k')  # noqa: F841
-    l2 = ax.axvline(x=v1, ymin=h0, ymax=h3, linewidth=1.5, color='k')  # noqa: F841
-    l3 = ax.axhline(y=h1, xmin=v0, xmax=v3, linewidth=1.5, color='k')  # noqa: F841
-    l4 = ax.axvline(x=v2, ymin=h0, ymax=h1, linewidth=1.5, color='k')  # noqa: F841
-    l5 = ax.axvline(x=v2, ymin=h2, ymax=h3, linewidth=1.5, color='k')  # noqa: F841
-    l6 = ax.axhline(y=h2, xmin=v1, xmax=v3, linewidth=1.5, color='k')  # noqa: F841
-
-    #     bbox = ax.get_window_extent().transformed(fig.dpi_scale_trans.inverted())
-    #     width, height = bbox.width * fig.dpi, bbox.height * fig.dpi
-    #     linewidth = 2
-    rect = Rectangle((xo, yo), 1 - (2 * xo), 1 - (2 * yo), fill=False, linewidth=1.5)
-    ax.add_patch(rect)
-
-    # Case title and description
-    text1 = "\n".join((title, case_title, case_description))
-    figure.text(v0 + 0.01, (h3 - (h3 - h1) / 2.), text1,
-                verticalalignment='center', horizontalalignment='left',
-                color='black', fontsize=fontsize)
+    ax.axhline(y=H3, xmin=V0, xmax=V3, linewidth=1.5, color='k')
+    ax.axvline(x=V1, ymin=H0, ymax=H3, linewidth=1.5, color='k')
+    ax.axhline(y=H1, xmin=V0, xmax=V3, linewidth=1.5, color='k')
+    ax.axvline(x=V2, ymin=H0, ymax=H1, linewidth=1.5, color='k')
+    ax.axvline(x=V2, ymin=H2, ymax=H3, linewidth=1.5, color='k')
+    ax.axhline(y=H2, xmin=V1, xmax=V3, linewidth=1.5, color='k')
 
-    # Section name/number
-    figure.text((v1 + (v2 - v1) / 2.), h2 + (h3 - h2) / 2., section_name,
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
+    rect = Rectangle((XO, YO), 1 - (2 * XO), 1 - (2 * YO), fill=False, linewidth=1.5)
+    ax.add_patch(rect)
 
-    # Project number
-    figure.text((v1 + (v2 - v1) / 2.), (h0 + (h1 - h0) / 2.), int(proj_number),
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
+    text_locations = {
+        'case': (V0 + 0.01, (H3 - (H3 - H1) / 2.), 'left'),  # Case title and description
+        'section_name': ((V1 + (V2 - V1) / 2.), H2 + (H3 - H2) / 2., 'center'),
+        'proj_number': ((V1 + (V2 - V1) / 2.), (H0 + (H1 - H0) / 2.), 'center'),
+        'company_name': ((V0 + (V1 - V0) / 2.), (H0 + (H1 - H0) / 2.), 'center'),
+        'date': ((V2 + (V3 - V2) / 2.), H2 + (H3 - H2) / 2., 'center'),
+        'fig_name': ((V2 + (V3 - V2) / 2.), (H0 + (H1 - H0) / 2.), 'center'),
+        'software_version': ((V1 + (V3 - V1) / 2.), H1 + (H2 - H1) / 2., 'center'),  # Print WANDA version
+    }
+    texts = {name: figure.text(x, y, '', verticalalignment='center', horizontalalignment=alignment,
+                               color='black', fontsize=fontsize)
+             for name, (x, y, alignment) in text_locations.items()}
+
+    img = get_company_logo() if company_image is None else company_image
+    imgax = figure.add_axes([V1, H0, V3 - V1, H3 - H0], zorder=-10)
+    image = imgax.imshow(img, alpha=0.3, interpolation='none')
+    imgax.axis('off')
+    return texts, image
 
-    # Company name
-    figure.text((v0 + (v1 - v0) / 2.), (h0 + (h1 - h0) / 2.), company_name,
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
 
+def set_7box_texts(texts, title, case_title, case_description, proj_number, section_name, fig_name,
+                   company_name="Deltares", software_version="Wanda 4.6", date=None):
+    """Fills in the texts of a 7-box layout created by draw_7box_frame."""
     # Create datestamp
     if date != date or date is None:
         today = datetime.date(datetime.now())
     else:
         today = date
-    figure.text((v2 + (v3 - v2) / 2.), h2 + (h3 - h2) / 2., today.strftime('%d-%m-%Y'),
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
-
-    # Figure name
-    figure.text((v2 + (v3 - v2) / 2.), (h0 + (h1 - h0) / 2.), fig_name,
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
-
-    # Print WANDA version
-    figure.text((v1 + (v3 - v1) / 2.), h1 + (h2 - h1) / 2., software_version,
-                verticalalignment='center', horizontalalignment='center',
-                color='black', fontsize=fontsize)
-
-    img = company_image
-    if company_image is None:
-        import os
-        module_dir, module_filename = os.path.split(__file__)
-        image_path = os.path.join(module_dir, "image_data", "Deltares_logo.png")
-        img = plt.imread(image_path)
-    imgax = figure.add_axes([v1, h0, v3 - v1, h3 - h0], zorder=-10)
-    imgax.imshow(img, alpha=0.3, interpolation='none')
-    imgax.axis('off')
+    texts['case'].set_text("\n".join((title, case_title, case_description)))
+    texts['section_name'].set_text(section_name)
+    texts['proj_number'].set_text(int(proj_number))
+    texts['company_name'].set_text(company_name)
+    texts['date'].set_text(today.strftime('%d-%m-%Y'))
+    texts['fig_name'].set_text(fig_name)
+    texts['software_version'].set_text(software_version)
+
+
+def plot_7box(figure, title, case_title, case_description, proj_number, section_name, fig_name,
+              company_name="Deltares", software_version="Wanda 4.6", company_image=None, date=None,
+              fontsize=8):
+    """
+    Creates box around and in the plot window. Also fills in some info about the calculation.
+    Based on the 7-box WL-layout.
+    """
+    texts, image = draw_7box_frame(figure, company_image, fontsize)
+    set_7box_texts(texts, title, case_title, case_description, proj_number, section_name, fig_name,
+                   company_name, software_version, date)
+
+
+class PageTemplate:
+    """
+    A4 page with the 7-box layout that is reused for all pages of a report. The frame, the logo and the text artists
+    are created once, every page only replaces the subplots and updates the texts.
+
+    The figure is drawn on its own Agg canvas and is not registered with pyplot, so templates can be used in threads
+    and worker processes without sharing any global state.
+    """
+
+    def __init__(self, company_image=None, fontsize=8):
+        self.figure = Figure(figsize=PAGE_SIZE)
+        FigureCanvasAgg(self.figure)
+        self.company_image = company_image
+        self.fontsize = fontsize
+        self.texts, self.image = draw_7box_frame(self.figure, company_image, fontsize)
+        self.frame_axes = list(self.figure.axes)
+
+    def render(self, model, plot_objects, title, case_title, case_description, proj_number, section_name, fig_name,
+               company_name="Deltares", software_version="Wanda 4.6", company_image=None, date=None, fontsize=8):
+        """Renders a page on the template, with the same arguments as plot() and plot_7box()."""
+        # every axes of the previous page is removed, including axes the plot objects added themselves
+        for ax in self.figure.axes:
+            if ax not in self.frame_axes:
+                ax.remove()
+        self.figure.subplots_adjust(left=0.15, right=0.89, top=0.92, bottom=0.16,
+                                    hspace=0.2 + (len(plot_objects) - 2) * 0.05)
+        axes = self.figure.subplots(len(plot_objects), 1, squeeze=False)
+        for ax, po in zip(axes[:, 0], plot_objects):
+            po.plot(model, ax)
+
+        if company_image is not None and company_image is not self.company_image:
+            self.image.set_data(company_image)
+            self.company_image = company_image
+        if fontsize != self.fontsize:
+            for text in self.texts.values():
+                text.set_fontsize(fontsize)
+            self.fontsize = fontsize
+        set_7box_texts(self.texts, title, case_title, case_description, proj_number, section_name, fig_name,
+                       company_name, software_version, date)
+        return self.figure
+
+    def close(self):
+        # the figure is not known to pyplot, clearing it releases the artists of the last page
+        self.figure.clear()
+
+
+def get_name(component):
+    """Returns the name of a pywanda component, names are returned as is."""
+    return component if isinstance(component, str) else component.get_complete_name_spec()
 
 
 class PlotObject:
@@ -105,7 +169,11 @@ class PlotObject:
     """
 
     def __init__(self, title='', xlabel='', ylabel='', xmin=None, xmax=None, xscale=1.0,
-                 ymin=None, ymax=None, yscale=1.0):
+                 ymin=None, ymax=None, yscale=1.0, decimate=None):
+        """
+        :param decimate: Optional decimation of long series before plotting, 'minmax' (keeps the envelope and every
+        peak exactly) or 'lttb' (largest-triangle-three-buckets), based on the width of the axis in pixels
+        """
         self.title = title
         self.xlabel = xlabel
         self.ylabel = ylabel
@@ -115,6 +183,15 @@ class PlotObject:
         self.ymin = ymin
         self.ymax = ymax
         self.yscale = yscale
+        self.decimate = decimate
+
+    def _decimate(self, ax, x, y):
+        """Returns the series to plot on the axis, decimated when the decimate option is set"""
+        if self.decimate is None:
+            return x, y
+        # the figure dpi is used for vector output as well, one bin per pixel is more than the eye can resolve
+        n_pixels = ax.get_window_extent().width
+        return decimate(np.asarray(x), np.asarray(y), n_pixels, self.decimate)
 
     def _plot_finish(self, ax):
         # Make tight on x-axis
@@ -156,6 +233,11 @@ class PlotObject:
         ax.legend(loc='upper center', bbox_to_anchor=(0.5, -1 * height_shrink / box.height),
                   fancybox=True, shadow=True, ncol=5, frameon=True)
 
+    def extract(self, model):
+        """Reads all data needed for this plot from the model. After this, the plot can be rendered without the
+        model (model=None), for example in another process after the model has been closed."""
+        pass
+
     def plot(self, model, ax):
         raise NotImplementedError
 
@@ -163,10 +245,12 @@ class PlotObject:
 class PlotRoute(PlotObject):
     """
     creates a route plot or location-graph for a given route in a wanda model (route is specified by keyword. Only
-    supports a single property, but allows plotting of pipeline profile in same figure
+    supports a single property, but allows plotting of pipeline profile in same figure. A precomputed route geometry
+    (see util.RouteGeometry) can be given, so it is not read from the model for every plot.
     """
 
-    def __init__(self, pipes, annotations, prop, times, *args, plot_elevation=False, plot_text=[], **kwargs):
+    def __init__(self, pipes, annotations, prop, times, *args, plot_elevation=False, plot_text=[], geometry=None,
+                 **kwargs):
         if (len(pipes) != len(annotations)):
             raise ValueError('Pipes list and Annotations list must have the same length')
         self.pipes = pipes
@@ -175,11 +259,21 @@ class PlotRoute(PlotObject):
         self.times = times
         self.plot_elevation = plot_elevation
         self.plot_text = plot_text
+        self.geometry = geometry
+        self.route_data = None
         super().__init__(*args, **kwargs)
 
+    def extract(self, model):
+        self.route_data = get_route_data(model, self.pipes, self.annotations, self.prop, self.times, self.geometry)
+        # pywanda components can not be pickled, only the names are needed from here on
+        self.pipes = [get_name(p) for p in self.pipes]
+
     def plot(self, model, ax):
-        s_location, elevation, data, s_location_profile = get_route_data(model, self.pipes, self.annotations,
-                                                                         self.prop, self.times)
+        if self.route_data is not None:
+            s_location, elevation, data, s_location_profile = self.route_data
+        else:
+            s_location, elevation, data, s_location_profile = get_route_data(model, self.pipes, self.annotations,
+                                                                             self.prop, self.times, self.geometry)
 
         color_ind = 0
         for t, v in data.items():
@@ -193,15 +287,16 @@ class PlotRoute(PlotObject):
             label = f'{t} s' if not isinstance(t, str) else t
 
             if label == "max":
-                ax.plot(s_location, v, label=label, linestyle='--', c='r', zorder=-1)
+                ax.plot(*self._decimate(ax, s_location, v), label=label, linestyle='--', c='r', zorder=-1)
             elif label == "min":
-                ax.plot(s_location, v, label=label, linestyle='-.', c='k', zorder=-1)
+                ax.plot(*self._decimate(ax, s_location, v), label=label, linestyle='-.', c='k', zorder=-1)
             else:
-                ax.plot(s_location, v, label=label, c=f'C{color_ind}')
+                ax.plot(*self._decimate(ax, s_location, v), label=label, c=f'C{color_ind}')
                 color_ind += 1
 
         if self.plot_elevation:
-            ax.plot(s_location_profile, elevation, label='Elevation', c='g', linewidth=2, alpha=0.3, zorder=-2)
+            ax.plot(*self._decimate(ax, s_location_profile, elevation), label='Elevation', c='g', linewidth=2, alpha=0.3,
+                    zorder=-2)
         # adding text and points to the graphs
         if self.plot_text:
             for text in self.plot_text:
@@ -213,8 +308,8 @@ class PlotRoute(PlotObject):
             ymin, ymax = np.array(ax.get_ylim()) / self.yscale
             stepx = (xmax - xmin) * 0.05
             stepy = (ymax - ymin) * 0.05
-            ax.text(xmin + stepx, ymin + stepy, self.pipes[0].get_complete_name_spec())
-            ax.text(xmax - 3 * stepx, ymin + stepy, self.pipes[-1].get_complete_name_spec())
+            ax.text(xmin + stepx, ymin + stepy, get_name(self.pipes[0]))
+            ax.text(xmax - 3 * stepx, ymin + stepy, get_name(self.pipes[-1]))
         self._plot_finish(ax)
 
 
@@ -224,7 +319,7 @@ class PlotSyschar(PlotObject):
     """
 
     def __init__(self, component_name, max_flowrate, description, discharge_dataframe, supplier_column, scenario_names,
-                 number_of_points, *args, **kwargs):
+                 number_of_points, *args, syschar_data=None, engine=None, n_workers=None, tolerance=None, **kwargs):
         """Creates system characteristics graphs for given wanda model, flow scenarios and flow range. It automatically
         calculates the system characteristic for a given model and flow scenarios.
         :param component_name: Name of the component the calculate the system characteristic for
@@ -235,6 +330,12 @@ class PlotSyschar(PlotObject):
         :param scenario_names: List of scenario names (names of columns in discharge_dataframe
         :param number_of_points: Number of steps for the system characteristic calculation. Default = 10
         :param args: remaining arguments for PlotObject (minimum: Title, xlabel, ylabel)
+        :param syschar_data: Precomputed system characteristics, a dataframe as returned by SyscharEngine.compute
+        :param engine: SyscharEngine to compute the system characteristics with, shared between suppliers
+        :param n_workers: Number of worker processes for the system characteristic, when no engine is given. By default
+        the points are computed one by one on the model itself
+        :param tolerance: Relative tolerance for adaptive refinement of the flow points, number_of_points is then the
+        number of initial points. Only used when the points are computed on the model itself
         :param kwargs:
         """
         self.component_name = component_name
@@ -243,19 +344,47 @@ class PlotSyschar(PlotObject):
         self.supplier_column = supplier_column
         self.scenario_names = scenario_names
         self.n_points = number_of_points
+        self.syschar_data = None
+        self.engine = engine
+        self.n_workers = n_workers
+        self.tolerance = tolerance
+        if syschar_data is not None:
+            self.syschar_data = syschar_to_series(syschar_data, 3600 * 24)
         super().__init__(*args, **kwargs)
 
-    def plot(self, model, ax):
-        color_ind = 0
+    def extract(self, model):
+        if self.syschar_data is None:
+            self.syschar_data = self._get_syschar(model)
+
+    def _get_syschar(self, model):
+        if self.engine is not None or self.n_workers is not None:
+            # the complete (scenario x flow point) grid is computed on the worker pool at once
+            from .syschar import compute_syschar
+            if self.engine is not None:
+                data = self.engine.compute(self.component_name, self.max_flowrate, self.discharge_dataframe,
+                                           self.scenario_names, self.n_points)
+            else:
+                data = compute_syschar(model, self.component_name, self.max_flowrate, self.discharge_dataframe,
+                                       self.scenario_names, self.n_points, n_workers=self.n_workers)
+            return syschar_to_series(data, 3600 * 24)  # display discharge in m3/day
         # suppliers = self.discharge_dataframe[self.supplier_column].tolist()
         flows = {}
         head_series = {}
         for scenario in self.scenario_names:
             print(f'Generating plot for {self.component_name}, max Q={self.max_flowrate * 3600 * 24:{2}.{6}} m3/day')
-            discharges, heads = get_syschar(model, self.discharge_dataframe, self.component_name, self.max_flowrate,
-                                            scenario, self.n_points)
+            if self.tolerance is not None:
+                discharges, heads = get_syschar_adaptive(model, self.discharge_dataframe, self.component_name,
+                                                         self.max_flowrate, scenario, self.n_points, self.tolerance)
+            else:
+                discharges, heads = get_syschar(model, self.discharge_dataframe, self.component_name,
+                                                self.max_flowrate, scenario, self.n_points)
             flows[scenario] = [q * 3600 * 24 for q in discharges]  # display discharge in m3/day
             head_series[scenario] = heads
+        return flows, head_series
+
+    def plot(self, model, ax):
+        color_ind = 0
+        flows, head_series = self.syschar_data if self.syschar_data is not None else self._get_syschar(model)
 
         for scenario, heads in head_series.items():
             ax.plot(flows[scenario], heads, label=scenario, marker='o', linestyle='--', c=f'C{color_ind}', zorder=-1)
@@ -268,19 +397,39 @@ class PlotTimeseries(PlotObject):
     Creates a timeseries plot for a given property, only supports a single axis.
     """
 
-    def __init__(self, collection=List[Tuple[str, str, str]], *args, **kwargs):
+    def __init__(self, collection=List[Tuple[str, str, str]], *args, case_index=None, **kwargs):
+        """
+        :param case_index: Optional CaseIndex of the case, when it reads the output (read_output) and all series are
+        indexed they are read from the output file directly and no model is needed
+        """
         self.collection = collection
+        self.series_data = None
+        self.case_index = case_index
         super().__init__(*args, **kwargs)
 
-    def plot(self, model, ax):
-        x = model.get_time_steps()
+    def extract(self, model):
+        self.series_data = self._get_series(model)
 
+    def _get_series(self, model):
+        index = self.case_index
+        if index is not None and all(index.has_output(comp, prop) for comp, prop, label in self.collection):
+            return index.get_time_steps(), [(index.read_series(comp, prop), label) for comp, prop, label in
+                                            self.collection]
+        x = model.get_time_steps()
+        series = []
         for comp, prop, label in self.collection:
             try:
                 prop = model.get_component(comp).get_property(prop)
             except ValueError:
                 prop = model.get_node(comp).get_property(prop)
-            ax.plot(x, [x * prop.get_unit_factor() for x in prop.get_series()], label=label)
+            series.append((get_series_array(prop), label))
+        return x, series
+
+    def plot(self, model, ax):
+        x, series = self.series_data if self.series_data is not None else self._get_series(model)
+
+        for y, label in series:
+            ax.plot(*self._decimate(ax, x, y), label=label)
 
         self._plot_finish(ax)
 
@@ -354,14 +503,17 @@ class PlotImage(PlotObject):
         self._plot_finish(ax)
 
 
-def plot(model, plot_objects, *args, **kwargs):
+def plot(model, plot_objects, *args, template=None, **kwargs):
     """Renders pages from the given set of subplots.
 
     Args:
-        model ([type]): Wanda model used as input
+        model ([type]): Wanda model used as input, can be None when all plot objects have been extracted
         plot_objects ([type]): List of objects to plot for the current page
+        template (PageTemplate, optional): Template to render the page on, instead of a new figure
     """
-    fig = plt.figure(figsize=(8.27, 11.69))
+    if template is not None:
+        return template.render(model, plot_objects, *args, **kwargs)
+    fig = plt.figure(figsize=PAGE_SIZE)
     plt.subplots_adjust(left=0.15, right=0.89, top=0.92, bottom=0.16, hspace=0.2 + (len(plot_objects) - 2) * 0.05)
 
     axes = fig.subplots(len(plot_objects), 1)
@@ -374,3 +526,93 @@ def plot(model, plot_objects, *args, **kwargs):
         po.plot(model, ax)
 
     plot_7box(fig, *args, **kwargs)
+
+
+def render_pdf(pdf_file, pages, model=None):
+    """Renders pages into one pdf file, all pages are rendered on a single headless page template.
+
+    Args:
+        pdf_file (str): Name of the pdf file
+        pages (list): Page specs, tuples of the plot objects of a page and a dictionary with the title block fields
+            (the keyword arguments of plot())
+        model ([type], optional): Wanda model, can be None when all plot objects have been extracted
+    """
+    template = PageTemplate()
+    try:
+        with PdfPages(pdf_file) as pdf:
+            for plot_objects, fields in pages:
+                pdf.savefig(template.render(model, plot_objects, **fields))
+    finally:
+        template.close()
+    return pdf_file
+
+
+def render_png(png_files, pages, model=None, dpi=150):
+    """Renders every page into its own png file on a single headless page template, see render_pdf.
+
+    Args:
+        png_files (list): Name of the png file of every page
+        dpi (int, optional): Resolution of the images
+    """
+    template = PageTemplate()
+    try:
+        for png_file, (plot_objects, fields) in zip(png_files, pages):
+            template.render(model, plot_objects, **fields).savefig(png_file, dpi=dpi)
+    finally:
+        template.close()
+    return png_files
+
+
+def merge_pdf_files(input_files, output_file):
+    try:
+        from PyPDF2 import PdfFileMerger
+    except ImportError:
+        raise ImportError("Merging the pdf files of a parallel render requires PyPDF2, use n_workers=1 instead")
+    merger = PdfFileMerger()
+    for pdf in input_files:
+        merger.append(pdf)
+    merger.write(output_file)
+    merger.close()
+
+
+def render_report(pages, output, n_workers=None, image_format="pdf", dpi=150):
+    """Renders the pages of a report on a pool of worker processes. The pages are split in consecutive chunks, one per
+    worker, every worker renders its chunk on its own page template. The plot objects are sent to the workers, so they
+    must have been extracted.
+
+    Args:
+        pages (list): Page specs, see render_pdf
+        output (str): Name of the pdf file, or for png a name with a field for the page number, e.g. 'Fig_{:03}.png'
+        n_workers (int, optional): Number of worker processes, defaults to the number of cpus
+        image_format (str, optional): 'pdf' for one pdf file with all pages or 'png' for one image per page
+        dpi (int, optional): Resolution of the png images
+
+    Returns:
+        list: Names of the written files
+    """
+    if image_format not in ("pdf", "png"):
+        raise ValueError(f"Unknown image format '{image_format}', use 'pdf' or 'png'")
+    n_workers = mp.cpu_count() if n_workers is None else n_workers
+    n_chunks = max(1, min(n_workers, len(pages)))
+    bounds = np.linspace(0, len(pages), n_chunks + 1).astype(int)
+    chunks = [pages[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    if image_format == "png":
+        png_files = [output.format(number) for number in range(1, len(pages) + 1)]
+        if n_chunks == 1:
+            return render_png(png_files, pages, dpi=dpi)
+        with ProcessPoolExecutor(max_workers=n_chunks) as executor:
+            futures = [executor.submit(render_png, png_files[start:end], chunk, None, dpi)
+                       for start, end, chunk in zip(bounds[:-1], bounds[1:], chunks)]
+            return [png_file for future in futures for png_file in future.result()]
+    if n_chunks == 1:
+        return [render_pdf(output, pages)]
+    temporary_directory = tempfile.mkdtemp(prefix="render_")
+    try:
+        with ProcessPoolExecutor(max_workers=n_chunks) as executor:
+            futures = [executor.submit(render_pdf, os.path.join(temporary_directory, f"{i}.pdf"), chunk)
+                       for i, chunk in enumerate(chunks)]
+            chunk_files = [future.result() for future in futures]
+        merge_pdf_files(chunk_files, output)
+    finally:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+    return [output]